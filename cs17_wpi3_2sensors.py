@@ -16,189 +16,56 @@
 # pi@raspberrypi ~ $ sudo python cs17_wpi3_2sensors.py
 #
 # データ計測時間は　SAMPLING_TIME x TIMES
+#
+# ループの各段階の時間とエラーの回数をSTATS_INTERVAL秒ごとにログへ入れる(wpi3_stats.py)
+# 計測の有効・無効は実行中に切り替えられる
+# pi@raspberrypi ~ $ sudo kill -USR1 $(pgrep -f cs17_wpi3_2sensors)
 ############################################################
 
 import sys  # sysモジュールの呼び出し
-import wiringpi as wi  # wiringPiモジュールの呼び出し
+from wpi3_i2c import shared_bus  # スレッド間で共有するI2Cバス
+from wpi3_bme280_driver import BME280  # ブロック読み出し対応のBME280ドライバ
+from wpi3_binlog import ThreadedRingLogger, RAW_RECORD  # 書き出しスレッド付きのバイナリロガー
+from wpi3_clock import monotonic_ns, clock_anchor  # サンプルの時刻
+from wpi3_stats import Stats  # ループの段階ごとの時間とエラーの回数
+from wpi3_altitude import Altimeter, reference_pressure  # 打ち上げ地点を基準にした高度
+from wpi3_magcal import MagCalibration, readASA, load_calibration, MAG_CAL_FILE  # 磁気センサの補正
+from wpi3_imucal import load_or_calibrate  # 加速度・ジャイロのオフセット(センサのレジスタに書く)
+from wpi3_mpu9250_i2cmst import MPU9250I2CMaster  # MPU-9250のI2Cマスタ経由で磁気を読む
 import time  # timeライブラリの呼び出し
 import datetime  # datetimeモジュールの呼び出し
 import os
+import signal
+import struct
 import serial
 import codecs
 # データ計測時間は　SAMPLING_TIME x TIMES
 SAMPLING_TIME = 0.1  # データ取得の時間間隔[sec]
 TIMES = 100  # データの計測回数
-
-wi.wiringPiSetup()  # wiringPiの初期化
-i2c = wi.I2C()  # i2cの初期化
+LOG_BATCH = 512  # ファイルへまとめて書き出すサンプル数
+LOG_CAPACITY = 8192  # 書き出し待ちのバッファのサンプル数(溢れたら捨てて数える)
+VERBOSE = False  # Trueなら1サンプルごとに標準出力する(Pi Zeroでは重い)
+REF_SAMPLES = 50  # 起動時に基準の気圧を測る回数
+IMU_CAL = True  # Trueなら加速度・ジャイロのオフセットをセンサのレジスタに書く(値はファイルにキャッシュする)
+MAG_VIA_MASTER = False  # TrueならMPU-9250のI2CマスタでAK8963を読み、9軸を22バイト1回で取得する
+RAW_MODE = False  # Trueならレジスタの生の値だけを記録する(単位への変換はwpi3_binlog.pyで後から行う)
+STATS = True  # Trueならループの段階ごとの時間を計測する(SIGUSR1で切り替え)
+STATS_INTERVAL = 1.0  # 統計のレコードをログに入れる間隔[sec]
+I2C_ERROR_REPORT = 100  # I2Cのエラーは最初の1回と、その後この回数ごとに表示する
+I2C_ERROR_LIMIT = 50  # この回数続けてI2Cのエラーになったらバスが使えないとみなして終了する
+
+# CS17_I2C_BACKEND=sim(wpi3_simulator.py)などのときはwiringPiを使わない
+if os.environ.get('CS17_I2C_BACKEND', 'wiringpi') == 'wiringpi':
+    import wiringpi as wi  # wiringPiモジュールの呼び出し
+    wi.wiringPiSetup()  # wiringPiの初期化
+i2c = shared_bus()  # i2cの初期化(ブロック読み出し対応、スレッド間で共有)
 
 ########################bme280 settings start#############################
 i2c_address = 0x76  # #I2Cアドレス SDO=GND
 # i2c_address = 0x77 # #I2Cアドレス SDO=VCC
 bme280 = i2c.setup(i2c_address)  # i2cアドレス0x76番地をbme280として設定(アドレスは$sudo i2cdetect 1で見られる)
 
-digT = []  # 配列を準備
-digP = []  # 配列を準備
-digH = []  # 配列を準備
-
-temp = 0
-humi = 0
-press = 0
-t_fine = 0.0
-
-
-# レジスタへの書き込み
-def writeReg(reg_address, data):
-    i2c.writeReg8(bme280, reg_address, data)
-
-
-# キャリブレーションデータの取得
-def get_calib_param():
-    calib = []
-
-    for i in range(0x88, 0x88 + 24):
-        calib.append(i2c.readReg8(bme280, i))
-    calib.append(i2c.readReg8(bme280, 0xA1))
-    for i in range(0xE1, 0xE1 + 7):
-        calib.append(i2c.readReg8(bme280, i))
-
-    digT.append((calib[1] << 8) | calib[0])
-    digT.append((calib[3] << 8) | calib[2])
-    digT.append((calib[5] << 8) | calib[4])
-    digP.append((calib[7] << 8) | calib[6])
-    digP.append((calib[9] << 8) | calib[8])
-    digP.append((calib[11] << 8) | calib[10])
-    digP.append((calib[13] << 8) | calib[12])
-    digP.append((calib[15] << 8) | calib[14])
-    digP.append((calib[17] << 8) | calib[16])
-    digP.append((calib[19] << 8) | calib[18])
-    digP.append((calib[21] << 8) | calib[20])
-    digP.append((calib[23] << 8) | calib[22])
-    digH.append(calib[24])
-    digH.append((calib[26] << 8) | calib[25])
-    digH.append(calib[27])
-    digH.append((calib[28] << 4) | (0x0F & calib[29]))
-    digH.append((calib[30] << 4) | ((calib[29] >> 4) & 0x0F))
-    digH.append(calib[31])
-
-    if digT[1] & 0x8000:
-        digT[1] = (-digT[1] ^ 0xFFFF) + 1
-
-    for i in range(1, 8):
-        if digP[i] & 0x8000:
-            digP[i] = (-digP[i] ^ 0xFFFF) + 1
-
-    for i in range(6):
-        if digH[i] & 0x8000:
-            digH[i] = (-digH[i] ^ 0xFFFF) + 1
-            #########################bme280 settings end####################
-
-#########################bme280 date get settings start####################
-# データの取得
-def readData():
-    data = []
-    global temp
-    global humi
-    global press
-    for i in range(247, 255):
-        data.append(i2c.readReg8(bme280, i))
-    pres_raw = (data[0] << 12) | (data[1] << 4) | (data[2] >> 4)
-    temp_raw = (data[3] << 12) | (data[4] << 4) | (data[5] >> 4)
-    hum_raw = (data[6] << 8) | data[7]
-
-    temp = compensate_T(temp_raw)
-    press = compensate_P(pres_raw)
-    humi = compensate_H(hum_raw)
-
-
-# 気圧データを取得する
-def compensate_P(adc_P):
-    global t_fine
-    pressure = 0.0
-
-    v1 = (t_fine / 2.0) - 64000.0
-    v2 = (((v1 / 4.0) * (v1 / 4.0)) / 2048) * digP[5]
-    v2 = v2 + ((v1 * digP[4]) * 2.0)
-    v2 = (v2 / 4.0) + (digP[3] * 65536.0)
-    v1 = (((digP[2] * (((v1 / 4.0) * (v1 / 4.0)) / 8192)) / 8) + ((digP[1] * v1) / 2.0)) / 262144
-    v1 = ((32768 + v1) * digP[0]) / 32768
-
-    if v1 == 0:
-        return 0
-    pressure = ((1048576 - adc_P) - (v2 / 4096)) * 3125
-    if pressure < 0x80000000:
-        pressure = (pressure * 2.0) / v1
-    else:
-        pressure = (pressure / v1) * 2
-    v1 = (digP[8] * (((pressure / 8.0) * (pressure / 8.0)) / 8192.0)) / 4096
-    v2 = ((pressure / 4.0) * digP[7]) / 8192.0
-    pressure = pressure + ((v1 + v2 + digP[6]) / 16.0)
-
-    # print("pressure : %7.2f hPa" % (pressure/100))
-    return pressure / 100
-
-
-# 温度データを取得する
-def compensate_T(adc_T):
-    global t_fine
-    v1 = (adc_T / 16384.0 - digT[0] / 1024.0) * digT[1]
-    v2 = (adc_T / 131072.0 - digT[0] / 8192.0) * (adc_T / 131072.0 - digT[0] / 8192.0) * digT[2]
-    t_fine = v1 + v2
-    temperature = t_fine / 5120.0
-    # print("temp : %-6.2f ℃" % (temperature))
-    return temperature
-
-
-# 湿度データを取得する
-def compensate_H(adc_H):
-    global t_fine
-    var_h = t_fine - 76800.0
-    if var_h != 0:
-        var_h = (adc_H - (digH[3] * 64.0 + digH[4] / 16384.0 * var_h)) * (
-            digH[1] / 65536.0 * (1.0 + digH[5] / 67108864.0 * var_h * (1.0 + digH[2] / 67108864.0 * var_h)))
-    else:
-        return 0
-    var_h = var_h * (1.0 - digH[0] * var_h / 524288.0)
-    if var_h > 100.0:
-        var_h = 100.0
-    elif var_h < 0.0:
-        var_h = 0.0
-    # print("hum : %6.2f ％" % (var_h))
-    return var_h
-
-
-# 設定
-def setup():
-    # osrs_t[2:0] 温度オーバーサンプリング設定
-    # スキップ(output set to 0x80000)=0 オーバーサンプリング×1=1 オーバーサンプリング×2= 2 オーバーサンプリング×4= 3 オーバーサンプリング ×8=4 オーバーサンプリング ×16=5
-    osrs_t = 1  # 温度オーバーサンプリング x 1
-    # osrs_p[2:0] 気圧オーバーサンプリング 設定
-    # スキップ(output set to 0x80000)=0 オーバーサンプリング ×1=1 オーバーサンプリング ×2=2    オーバーサンプリング ×4=3 オーバーサンプリング ×8=4 オーバーサンプリング ×16=5
-    osrs_p = 3  # 気圧オーバーサンプリング x 4
-    # osrs_h[2:0] 湿度オーバーサンプリング settings
-    # スキップ(output set to 0x80000)=0 オーバーサンプリング ×1=1 オーバーサンプリング ×2=2    オーバーサンプリング ×4=3 オーバーサンプリング ×8=4 オーバーサンプリング ×16=5
-    osrs_h = 0  # 湿度オーバーサンプリング Skipped
-    mode = 3  # ノーマルモード (Sleep mode:0 Forced mode:1 Normal mode:3)
-    # t_sb[2:0] tstandby [ms]
-    # 0= 0.5[ms] 1= 62.5[ms] 2= 125[ms] 3= 250[ms] 4= 500[ms] 5= 1000[ms] 6= 10[ms] 7= 20[ms]
-    t_sb = 0  # Tstandby 0.5ms
-    # filter[2:0] Filter coefficient
-    # 0= Filter off 1=coefficient2 2=coefficient4 3=coefficient8 4=coefficient 16
-    filter = 4  # Filter coefficient 16
-    spi3w_en = 0  # 3-wire SPI Disable
-
-    ctrl_meas_reg = (osrs_t << 5) | (osrs_p << 2) | mode
-    config_reg = (t_sb << 5) | (filter << 2) | spi3w_en
-    ctrl_hum_reg = osrs_h
-
-    writeReg(0xF2, ctrl_hum_reg)
-    writeReg(0xF4, ctrl_meas_reg)
-    writeReg(0xF5, config_reg)
-
-
-setup()
-get_calib_param()
-############################bme280 date get settings end#####################
+########################bme280 settings end#############################
 
 ############################mpu9250 settings start##########################
 address = 0x68
@@ -208,6 +75,10 @@ AK8963 = i2c.setup(addrAK8963)
 gyroRange = 1000  # 250, 500, 1000, 2000　'dps'から選択
 accelRange = 8  # +-2, +-4, +-8, +-16 'g'から選択
 magRange = 4912  # 'μT'
+gyroCoefficient = gyroRange / float(0x8000)  # coefficient : sensed decimal val to dps val.
+accelCoefficient = accelRange / float(0x8000)  # coefficient : sensed decimal val to g val
+magCoefficient16 = magRange / 32760.0  # confficient : sensed decimal val to μT val (16bit)
+magCoefficient14 = magRange / 8190.0  # confficient : sensed decimal val to μT val (14bit)
 
 # センサ定数
 REG_PWR_MGMT_1 = 0x6B
@@ -215,6 +86,8 @@ REG_INT_PIN_CFG = 0x37
 REG_ACCEL_CONFIG1 = 0x1C
 REG_ACCEL_CONFIG2 = 0x1D
 REG_GYRO_CONFIG = 0x1B
+REG_SMPLRT_DIV = 0x19
+REG_CONFIG = 0x1A
 
 MAG_MODE_POWERDOWN = 0  # 磁気センサpower down
 MAG_MODE_SERIAL_1 = 1  # 磁気センサ8Hz連続測定モード
@@ -233,6 +106,9 @@ offsetAccelZ = 0
 offsetGyroX = 0
 offsetGyroY = 0
 offsetGyroZ = 0
+magCal = None  # 磁気センサの補正(MagCalibration)
+lastMagRaw = None  # 最後に読んだ磁気の生の値
+stats = Stats(STATS, STATS_INTERVAL)  # ループの計測
 
 
 # レジスタを初期設定に戻す。
@@ -324,6 +200,14 @@ def setGyroRange(val, _calibration=False):
     return
 
 
+# サンプリングレートを1kHz / (1 + div)にする(DLPF_CFG=1: ジャイロ184Hz, 加速度は別のACCEL_CONFIG2)
+# I2Cマスタ(SLV0)はこのレートで動くので、MAG_VIA_MASTERのときに間引く間隔の基準になる
+def setSampleRate(div=0):
+    i2c.writeReg8(mpu9250, REG_CONFIG, 0x01)
+    i2c.writeReg8(mpu9250, REG_SMPLRT_DIV, div)
+    print("set sample rate=%d [Hz]" % (1000 // (1 + div)))
+
+
 # 磁気センサのレジスタを設定する
 def setMagRegister(_mode, _bit):
     global MAG_ACCESS
@@ -373,46 +257,69 @@ def u2s(unsigneddata):
 #################################mpu9250 settings end###################
 
 #################################mpu9250 date get settings start#########################
+# 加速度・温度・ジャイロ値を0x3B~0x48の14バイトまとめて取得
+# 1回のI2Cトランザクションで全軸を読み出す
+def getAccelTempGyro():
+    data = i2c.readBlock(mpu9250, 0x3B, 14)
+    ax, ay, az, t, gx, gy, gz = struct.unpack('>7h', data)  # ビッグエンディアンの符号付き16bit
+    acc = (accelCoefficient * ax + offsetAccelX,
+           accelCoefficient * ay + offsetAccelY,
+           accelCoefficient * az + offsetAccelZ)
+    gyr = (gyroCoefficient * gx + offsetGyroX,
+           gyroCoefficient * gy + offsetGyroY,
+           gyroCoefficient * gz + offsetGyroZ)
+    temp_mpu = t / 333.87 + 21.0  # [℃]
+    return acc, temp_mpu, gyr
+
+
+# 加速度・温度・ジャイロの生の値(ax, ay, az, t, gx, gy, gz)を取得
+def getAccelTempGyroRaw():
+    return struct.unpack('>7h', i2c.readBlock(mpu9250, 0x3B, 14))
+
+
 # 加速度値を取得
 def getAccel():
-    ACCEL_XOUT_H = i2c.readReg8(mpu9250, 0x3B)
-    ACCEL_XOUT_L = i2c.readReg8(mpu9250, 0x3C)
-    ACCEL_YOUT_H = i2c.readReg8(mpu9250, 0x3D)
-    ACCEL_YOUT_L = i2c.readReg8(mpu9250, 0x3E)
-    ACCEL_ZOUT_H = i2c.readReg8(mpu9250, 0x3F)
-    ACCEL_ZOUT_L = i2c.readReg8(mpu9250, 0x40)
-    rawX = accelCoefficient * u2s(ACCEL_XOUT_H << 8 | ACCEL_XOUT_L) + offsetAccelX
-    rawY = accelCoefficient * u2s(ACCEL_YOUT_H << 8 | ACCEL_YOUT_L) + offsetAccelY
-    rawZ = accelCoefficient * u2s(ACCEL_ZOUT_H << 8 | ACCEL_ZOUT_L) + offsetAccelZ
-    # data    = i2c.readReg8(address, 0x3B )
-    # print "getaccell data=%d"%data
-    # rawX    = accelCoefficient * u2s(data[0] << 8 | data[1]) + offsetAccelX
-    # rawY    = accelCoefficient * u2s(data[2] << 8 | data[3]) + offsetAccelY
-    # rawZ    = accelCoefficient * u2s(data[4] << 8 | data[5]) + offsetAccelZ
+    data = i2c.readBlock(mpu9250, 0x3B, 6)
+    x, y, z = struct.unpack('>3h', data)
+    rawX = accelCoefficient * x + offsetAccelX
+    rawY = accelCoefficient * y + offsetAccelY
+    rawZ = accelCoefficient * z + offsetAccelZ
     return rawX, rawY, rawZ
 
 
 # ジャイロ値を取得
 def getGyro():
-    GYRO_XOUT_H = i2c.readReg8(mpu9250, 0x43)
-    GYRO_XOUT_L = i2c.readReg8(mpu9250, 0x44)
-    GYRO_YOUT_H = i2c.readReg8(mpu9250, 0x45)
-    GYRO_YOUT_L = i2c.readReg8(mpu9250, 0x46)
-    GYRO_ZOUT_H = i2c.readReg8(mpu9250, 0x47)
-    GYRO_ZOUT_L = i2c.readReg8(mpu9250, 0x48)
-    rawX = gyroCoefficient * u2s(GYRO_XOUT_H << 8 | GYRO_XOUT_L) + offsetGyroX
-    rawY = gyroCoefficient * u2s(GYRO_YOUT_H << 8 | GYRO_YOUT_L) + offsetGyroY
-    rawZ = gyroCoefficient * u2s(GYRO_ZOUT_H << 8 | GYRO_ZOUT_L) + offsetGyroZ
-    # data    =  i2c.readReg8(address, 0x43 )
-    # rawX    = gyroCoefficient * u2s(data[0] << 8 | data[1]) + offsetGyroX
-    # rawY    = gyroCoefficient * u2s(data[2] << 8 | data[3]) + offsetGyroY
-    # rawZ    = gyroCoefficient * u2s(data[4] << 8 | data[5]) + offsetGyroZ
+    data = i2c.readBlock(mpu9250, 0x43, 6)
+    x, y, z = struct.unpack('>3h', data)
+    rawX = gyroCoefficient * x + offsetGyroX
+    rawY = gyroCoefficient * y + offsetGyroY
+    rawZ = gyroCoefficient * z + offsetGyroZ
     return rawX, rawY, rawZ
 
 
 # 磁気値を取得
 def getMag():
-    global MAG_ACCESS
+    rawX, rawY, rawZ = getMagRaw()
+
+    # μTへの変換
+    if MAG_BIT == 16:  # output 16bit
+        rawX = rawX * magCoefficient16
+        rawY = rawY * magCoefficient16
+        rawZ = rawZ * magCoefficient16
+    else:  # output 14bit
+        rawX = rawX * magCoefficient14
+        rawY = rawY * magCoefficient14
+        rawZ = rawZ * magCoefficient14
+
+    # 感度調整値(ASA)とハードアイアン・ソフトアイアンの補正
+    if magCal is not None:
+        return magCal.apply(rawX, rawY, rawZ)
+    return rawX, rawY, rawZ
+
+
+# 磁気の生の値を取得
+def getMagRaw():
+    global MAG_ACCESS, lastMagRaw
     if not MAG_ACCESS:
         # 磁気センサへのアクセスが有効になっていない場合は例外
         raise Exception('002 Access to a sensor is invalid.')
@@ -428,13 +335,6 @@ def getMag():
         i2c.writeReg8(AK8963, 0x0A, _writeData)
         time.sleep(0.01)
 
-    elif MAG_MODE == MAG_MODE_SERIAL_1 or MAG_MODE == MAG_MODE_SERIAL_2:
-        status = i2c.readReg8(AK8963, 0x02)
-        if (status & 0x02) == 0x02:
-            # if (status[0] & 0x02) == 0x02:
-            # データオーバーランがあるので再度センシング
-            i2c.readReg8(AK8963, 0x09)
-
     elif MAG_MODE == MAG_MODE_EX_TRIGER:
         # 未実装
         return
@@ -442,48 +342,27 @@ def getMag():
     elif MAG_MODE == MAG_MODE_POWERDOWN:
         raise Exception('003 Mag sensor power down')
 
-    # ST1レジスタを確認してデータ読み出しが可能か確認する
+    # ST1を1回だけ見る 連続測定モードで新しいデータがなければ前の値を使う(sleepで待たない)
+    # 最初の1回と単発測定モードだけはデータができるまで待つ
     status = i2c.readReg8(AK8963, 0x02)
-    while (status & 0x01) != 0x01:
-        # while (status[0] & 0x01) != 0x01:
-        # Wait until data ready state.
-        time.sleep(0.01)
-        status = i2c.readReg8(AK8963, 0x02)
-
-    # データ読み出し
-    MAG_XOUT_L = i2c.readReg8(AK8963, 0x03)
-    MAG_XOUT_H = i2c.readReg8(AK8963, 0x04)
-    MAG_YOUT_L = i2c.readReg8(AK8963, 0x05)
-    MAG_YOUT_H = i2c.readReg8(AK8963, 0x06)
-    MAG_ZOUT_L = i2c.readReg8(AK8963, 0x07)
-    MAG_ZOUT_H = i2c.readReg8(AK8963, 0x08)
-    MAG_OF = i2c.readReg8(AK8963, 0x09)
-    rawX = u2s(MAG_XOUT_H << 8 | MAG_XOUT_L)
-    rawY = u2s(MAG_YOUT_H << 8 | MAG_YOUT_L)
-    rawZ = u2s(MAG_ZOUT_H << 8 | MAG_ZOUT_L)
-    st2 = MAG_OF
-    # data    = i2c.readReg8(addrAK8963, 0x03 ,7)
-    # rawX    = u2s(data[1] << 8 | data[0])  # Lower bit is ahead.
-    # rawY    = u2s(data[3] << 8 | data[2])  # Lower bit is ahead.
-    # rawZ    = u2s(data[5] << 8 | data[4])  # Lower bit is ahead.
-    # st2     = data[6]
+    if (status & 0x01) != 0x01:
+        stats.count('mag_not_ready')  # 新しいデータがなかった
+        if lastMagRaw is not None and MAG_MODE != MAG_MODE_SINGLE:
+            return lastMagRaw
+        while (status & 0x01) != 0x01:
+            time.sleep(0.001)
+            status = i2c.readReg8(AK8963, 0x02)
+
+    # HXL~HZH, ST2の7バイトをまとめて読む(ST2まで読むと次の測定に進む、オーバーランもこれで解除)
+    rawX, rawY, rawZ, st2 = struct.unpack('<3hB', i2c.readBlock(AK8963, 0x03, 7))
 
     # オーバーフローチェック
     if (st2 & 0x08) == 0x08:
         # オーバーフローのため正しい値が得られていない
         raise Exception('004 Mag sensor over flow')
 
-    # μTへの変換
-    if MAG_BIT == 16:  # output 16bit
-        rawX = rawX * magCoefficient16
-        rawY = rawY * magCoefficient16
-        rawZ = rawZ * magCoefficient16
-    else:  # output 14bit
-        rawX = rawX * magCoefficient14
-        rawY = rawY * magCoefficient14
-        rawZ = rawZ * magCoefficient14
-
-    return rawX, rawY, rawZ
+    lastMagRaw = rawX, rawY, rawZ
+    return lastMagRaw
 
 
 # 加速度センサを較正する
@@ -542,43 +421,149 @@ if __name__ == '__main__':
     # bus     = smbus.SMBus(1)
     resetRegister()
     powerWakeUp()
-    gyroCoefficient = gyroRange / float(0x8000)  # coefficient : sensed decimal val to dps val.
-    accelCoefficient = accelRange / float(0x8000)  # coefficient : sensed decimal val to g val
-    magCoefficient16 = magRange / 32760.0  # confficient : sensed decimal val to μT val (16bit)
-    magCoefficient14 = magRange / 8190.0  # confficient : sensed decimal val to μT val (14bit)
     setAccelRange(accelRange, False)
     setGyroRange(gyroRange, False)
+    imuCal = None
+    if IMU_CAL:
+        # キャッシュが古くなければレジスタに書くだけ(古ければFIFOで0.4秒ほど測り直す)
+        # センサは静止させ、z軸を上に向けておく
+        imuCal, reason = load_or_calibrate(i2c, mpu9250, accelRange, gyroRange)
+        print("IMU calibration: %s" % (reason or 'cached'))
+    asa = readASA(i2c, AK8963)  # 磁気センサの感度調整値(パワーダウンモードで読む)
+    if os.path.exists(MAG_CAL_FILE):
+        # wpi3_magcal.pyで作った補正を使う
+        magCal = load_calibration(MAG_CAL_FILE)
+        magCal = MagCalibration(magCal.offset, magCal.matrix, asa, magCal.field)
+    else:
+        magCal = MagCalibration(asa=asa)  # 感度調整だけ
     setMagRegister('100Hz', '16bit')
+    mst = None
+    if MAG_VIA_MASTER and not RAW_MODE:
+        # ASAはmagCalで補正するので、ここでは係数だけ
+        # 1kHzのサンプルのうち10回に1回(100Hz)だけSLV0で磁気を読む(I2C_MST_DLYはenable()で決まる)
+        setSampleRate(0)
+        mst = MPU9250I2CMaster(i2c, mpu9250, accelCoefficient, gyroCoefficient,
+                               magCoefficient16 if MAG_BIT == 16 else magCoefficient14)
+        mst.enable(mode=0x16 if MAG_BIT == 16 else 0x06)
+    bme = BME280(i2c, bme280)  # キャリブレーション値は起動時に1回だけ読み出す
+    bme.setup()  # 温度x1, 気圧x4, 湿度なし, ノーマルモード, IIRフィルタ16
+    # 地上の気圧の平均を高度0mにする(setup()の直後はまだ変換前なので、最初の変換を待ってリセット値は使わない)
+    altimeter = Altimeter(reference_pressure(bme.readValid, REF_SAMPLES, wait=bme.waitReady))
+    print("reference pressure=%7.2f [hPa]" % altimeter.ref_pressure)
     # ファイルへ書出し準備
     now = datetime.datetime.now()
     # 現在時刻を織り込んだファイル名を生成
-    fmt_name = "/home/pi/data/cs17_wpi3_2sensors_logs_{0:%Y%m%d-%H%M%S}.csv".format(now)
-    f_cs17_wpi3_2sensors = codecs.open(fmt_name, mode='w', encoding="utf-8")  # 書き込みファイル
-    # f_cs17_wpi3_2sensors= open('home/pi/data/cs17_wpi3_2sensors_logs.csv', 'w')    #書き込みファイル
-    value = u"yyyy-mm-dd hh:mm:ss.mmmmmm,T[℃],H[%],P[hPa],x[g],y[g],z[g],x[dps],y[dps],z[dps],x[uT],y[uT],z[uT],h[m]"  # header行への書き込み内容
-    f_cs17_wpi3_2sensors.write(value + "\n")  # header行をファイル出力
+    # CSVへは python3 wpi3_binlog.py <ファイル名> で変換する
+    fmt_name = "/home/pi/data/cs17_wpi3_2sensors_logs_{0:%Y%m%d-%H%M%S}.bin".format(now)
+    header = {
+        'sensor': 'cs17_wpi3_2sensors',
+        'start': str(now),
+        'sampling_time': SAMPLING_TIME,
+        'accel_range': accelRange,
+        'gyro_range': gyroRange,
+        'mag_range': magRange,
+        'mag_bit': MAG_BIT,
+        'accel_offset': [offsetAccelX, offsetAccelY, offsetAccelZ],
+        'gyro_offset': [offsetGyroX, offsetGyroY, offsetGyroZ],
+        'bme280_calib': bme.calib._asdict(),
+        'ref_pressure': altimeter.ref_pressure,
+        'mag_calibration': magCal.to_dict(),
+        'imu_calibration': imuCal,
+        'stats_interval': STATS_INTERVAL,
+    }
+    header.update(clock_anchor())  # レコードの時刻(monotonic_ns)を実際の時刻に換算するためのアンカー
+    if RAW_MODE:
+        # 生の値から単位に変換するための係数
+        header['mode'] = 'raw'
+        header['accel_coefficient'] = accelCoefficient
+        header['gyro_coefficient'] = gyroCoefficient
+        header['mag_coefficient'] = magCoefficient16 if MAG_BIT == 16 else magCoefficient14
+        logger = ThreadedRingLogger(fmt_name, header, record=RAW_RECORD, capacity=LOG_CAPACITY, block=LOG_BATCH)
+    else:
+        logger = ThreadedRingLogger(fmt_name, header, capacity=LOG_CAPACITY, block=LOG_BATCH)  # 書き込みファイル
+    period = int(SAMPLING_TIME * 1e9)
+    mag = (0.0, 0.0, 0.0)
+    signal.signal(signal.SIGUSR1, stats.toggle)  # kill -USR1で計測の有効・無効を切り替える
+    errors = 0  # 続けてI2Cのエラーになった回数
     while True:  # データ取得時間制限あり
         try:
             # for _i in range(TIMES):		#データ取得時間制限なし
-            date = datetime.datetime.now()  # now()メソッドで現在日付・時刻のdatetime型データの変数を取得 世界時：UTCnow
-            now = time.time()  # 現在時刻の取得
-            readData()
-            acc = getAccel()  # 加速度値の取得
-            gyr = getGyro()  # ジャイロ値の取得
-            mag = getMag()  # 磁気値の取得
-            h = (((1013.25 / press) ** (1 / 5.257) - 1) * (temp + 273.15)) / 0.0065
-
-            # ファイルへ書出し
-            value = "%s,%6.2f,%6.2f,%7.2f,%6.3f,%6.3f,%6.3f,%6.3f,%6.3f,%6.3f,%6.3f,%6.3f,%6.3f,%4.4f" % (
-            date, temp, humi, press, acc[0], acc[1], acc[2], gyr[0], gyr[1], gyr[2], mag[0], mag[1], mag[2],
-            h)  # 時間、xyz軸回りの加速度
-            f_cs17_wpi3_2sensors.write(value + "\n")  # ファイルを出力
-            print(value)  # 標準出力
+            start = monotonic_ns()  # ループの開始時刻[ns]
+            st = stats if stats.enabled else None  # 無効ならこのループの計測はすべて飛ばす
+            if st:
+                st.begin()
+            if RAW_MODE:
+                # 変換せずにそのままバッファへ
+                pres_raw, temp_raw, hum_raw = bme.readRaw()
+                now = monotonic_ns()
+                if st:
+                    st.lap('bme')
+                ax, ay, az, t, gx, gy, gz = getAccelTempGyroRaw()
+                if st:
+                    st.lap('imu')
+                mx, my, mz = getMagRaw()
+                if st:
+                    st.lap('mag')
+                logger.write(now, pres_raw, temp_raw, hum_raw, ax, ay, az, t, gx, gy, gz, mx, my, mz)
+            else:
+                temp, press, humi = bme.read()  # 温度、気圧、湿度をまとめて取得
+                now = monotonic_ns()  # 加速度・ジャイロを読む直前の時刻[ns]
+                if st:
+                    st.lap('bme')
+                if mst is not None:
+                    acc, temp_mpu, gyr, m = mst.read()  # 加速度・ジャイロ・磁気を1回で取得
+                    if m is not None:
+                        mag = magCal.apply(m[0], m[1], m[2])  # オーバーフローのときは前の値を使う
+                    if st:
+                        st.lap('imu')
+                else:
+                    acc, temp_mpu, gyr = getAccelTempGyro()  # 加速度・ジャイロ値をまとめて取得
+                    if st:
+                        st.lap('imu')
+                    mag = getMag()  # 磁気値の取得
+                    if st:
+                        st.lap('mag')
+                h = altimeter.altitude(press, temp)
+
+                # バッファへ書出し(ファイルへは書き出しスレッドがまとめて書き出す)
+                logger.write(now, temp, humi, press, acc[0], acc[1], acc[2], gyr[0], gyr[1], gyr[2],
+                             mag[0], mag[1], mag[2], h)
+                if VERBOSE:
+                    print("%d,%6.2f,%6.2f,%7.2f,%6.3f,%6.3f,%6.3f,%6.3f,%6.3f,%6.3f,%6.3f,%6.3f,%6.3f,%4.4f" % (
+                        now, temp, humi, press, acc[0], acc[1], acc[2], gyr[0], gyr[1], gyr[2], mag[0], mag[1],
+                        mag[2], h))  # 標準出力
+            errors = 0
+            if st:
+                st.lap('log')
+                st.end()
+                if st.due(start):
+                    logger.write_stats(start, *st.record(start, logger.dropped))
             # 指定秒数の一時停止
-            sleepTime = SAMPLING_TIME - (time.time() - now)
+            sleepTime = (period - (monotonic_ns() - start)) / 1e9
             if sleepTime < 0.0:
+                stats.count('overruns')  # 周期に間に合わなかった
                 continue
             time.sleep(sleepTime)
+        except IOError as e:
+            stats.count('i2c_errors')  # このサンプルは捨てて次へ
+            errors += 1
+            total = stats.totals['i2c_errors']
+            if total == 1 or total % I2C_ERROR_REPORT == 0:
+                print("I2C error #%d: %s" % (total, e))
+            if errors >= I2C_ERROR_LIMIT:
+                print("%d consecutive I2C errors, giving up" % errors)
+                break
+            sleepTime = (period - (monotonic_ns() - start)) / 1e9
+            if sleepTime > 0.0:
+                time.sleep(sleepTime)
         except KeyboardInterrupt:
             break
-    f_cs17_wpi3_2sensors.close()  # 書き込みファイルを閉じる
+    logger.close()  # 書き込みファイルを閉じる
+    print("written=%(written)d dropped=%(dropped)d batches=%(batches)d max_pending=%(max_pending)d" % logger.stats())
+    summary = stats.summary()
+    print("overruns=%(overruns)d i2c_errors=%(i2c_errors)d mag_not_ready=%(mag_not_ready)d" % summary)
+    for name, hist in sorted(summary['stages'].items()):
+        if hist['count']:
+            print("%-5s p50=%8.0f p99=%8.0f max=%8.0f [us]" % (name, hist['p50_us'], hist['p99_us'], hist['max_us']))
+    if errors >= I2C_ERROR_LIMIT:
+        sys.exit(1)  # 止まったことが分かるように失敗で終わる
@@ -0,0 +1,367 @@
+#!/usr/bin/python3 -u
+# -*- coding: utf-8 -*-
+
+############################################################
+# Written by pond-e
+#
+# Environment:  Python 3.4.2
+#               OS: Raspi OS
+#               on Raspberry Pi Zero W
+# Used sensor: MPU-9250(Akiduki denshi)
+#
+# 加速度、ジャイロ、磁気から姿勢(クォータニオン)をリアルタイムに求める
+# ・MadgwickAHRS: 勾配降下法のフィルタ(S. Madgwick, 2010)
+# ・MahonyAHRS: 相補フィルタ(PI制御) (R. Mahony, 2008)
+# ・姿勢はインスタンスの変数q0~q3に持ち、update()は値を返さない
+#   ループの中でタプルやリストを作らないので、IMUのレート(500Hz以上)で回せる
+# ・角速度は[dps]で渡す(中で[rad/s]にする)。加速度、磁気は単位を問わない(正規化する)
+# ・AK8963の軸はMPU9250と違うので、磁気は(my, mx, -mz)の順に並べ替えて渡す
+#
+# 1サンプルあたりの時間の計測(実機なし)
+# pi@raspberrypi ~ $ python3 wpi3_ahrs.py bench
+# 実機で姿勢を表示する
+# pi@raspberrypi ~ $ sudo python3 wpi3_ahrs.py
+############################################################
+
+import math
+import sys
+import time
+
+DEG2RAD = math.pi / 180.0
+RAD2DEG = 180.0 / math.pi
+
+
+# クォータニオンからオイラー角(ロール, ピッチ, ヨー)[deg]
+def quaternion_to_euler(q0, q1, q2, q3):
+    roll = math.atan2(q0 * q1 + q2 * q3, 0.5 - q1 * q1 - q2 * q2)
+    sinp = -2.0 * (q1 * q3 - q0 * q2)
+    pitch = math.asin(1.0 if sinp > 1.0 else -1.0 if sinp < -1.0 else sinp)
+    yaw = math.atan2(q1 * q2 + q0 * q3, 0.5 - q2 * q2 - q3 * q3)
+    return roll * RAD2DEG, pitch * RAD2DEG, yaw * RAD2DEG
+
+
+class MadgwickAHRS(object):
+    # beta: 加速度、磁気で補正する強さ(大きいほど速く収束し、ノイズに弱くなる)
+    def __init__(self, beta=0.1):
+        self.beta = beta
+        self.q0 = 1.0
+        self.q1 = 0.0
+        self.q2 = 0.0
+        self.q3 = 0.0
+
+    # 9軸の更新 g:[dps], dt:[s]
+    def update(self, gx, gy, gz, ax, ay, az, mx, my, mz, dt):
+        if mx == 0.0 and my == 0.0 and mz == 0.0:
+            self.updateIMU(gx, gy, gz, ax, ay, az, dt)
+            return
+        q0 = self.q0
+        q1 = self.q1
+        q2 = self.q2
+        q3 = self.q3
+        gx *= DEG2RAD
+        gy *= DEG2RAD
+        gz *= DEG2RAD
+
+        # ジャイロによるクォータニオンの変化率
+        qDot1 = 0.5 * (-q1 * gx - q2 * gy - q3 * gz)
+        qDot2 = 0.5 * (q0 * gx + q2 * gz - q3 * gy)
+        qDot3 = 0.5 * (q0 * gy - q1 * gz + q3 * gx)
+        qDot4 = 0.5 * (q0 * gz + q1 * gy - q2 * gx)
+
+        if not (ax == 0.0 and ay == 0.0 and az == 0.0):
+            recipNorm = 1.0 / math.sqrt(ax * ax + ay * ay + az * az)
+            ax *= recipNorm
+            ay *= recipNorm
+            az *= recipNorm
+            recipNorm = 1.0 / math.sqrt(mx * mx + my * my + mz * mz)
+            mx *= recipNorm
+            my *= recipNorm
+            mz *= recipNorm
+
+            _2q0mx = 2.0 * q0 * mx
+            _2q0my = 2.0 * q0 * my
+            _2q0mz = 2.0 * q0 * mz
+            _2q1mx = 2.0 * q1 * mx
+            _2q0 = 2.0 * q0
+            _2q1 = 2.0 * q1
+            _2q2 = 2.0 * q2
+            _2q3 = 2.0 * q3
+            _2q0q2 = 2.0 * q0 * q2
+            _2q2q3 = 2.0 * q2 * q3
+            q0q0 = q0 * q0
+            q0q1 = q0 * q1
+            q0q2 = q0 * q2
+            q0q3 = q0 * q3
+            q1q1 = q1 * q1
+            q1q2 = q1 * q2
+            q1q3 = q1 * q3
+            q2q2 = q2 * q2
+            q2q3 = q2 * q3
+            q3q3 = q3 * q3
+
+            # 地磁気の向き(水平成分と鉛直成分)
+            hx = mx * q0q0 - _2q0my * q3 + _2q0mz * q2 + mx * q1q1 + _2q1 * my * q2 + _2q1 * mz * q3 - mx * q2q2 - mx * q3q3
+            hy = _2q0mx * q3 + my * q0q0 - _2q0mz * q1 + _2q1mx * q2 - my * q1q1 + my * q2q2 + _2q2 * mz * q3 - my * q3q3
+            _2bx = math.sqrt(hx * hx + hy * hy)
+            _2bz = -_2q0mx * q2 + _2q0my * q1 + mz * q0q0 + _2q1mx * q3 - mz * q1q1 + _2q2 * my * q3 - mz * q2q2 + mz * q3q3
+            _4bx = 2.0 * _2bx
+            _4bz = 2.0 * _2bz
+
+            # 勾配
+            ex = 2.0 * q1q3 - _2q0q2 - ax
+            ey = 2.0 * q0q1 + _2q2q3 - ay
+            ez = 1.0 - 2.0 * q1q1 - 2.0 * q2q2 - az
+            fx = _2bx * (0.5 - q2q2 - q3q3) + _2bz * (q1q3 - q0q2) - mx
+            fy = _2bx * (q1q2 - q0q3) + _2bz * (q0q1 + q2q3) - my
+            fz = _2bx * (q0q2 + q1q3) + _2bz * (0.5 - q1q1 - q2q2) - mz
+            s0 = -_2q2 * ex + _2q1 * ey - _2bz * q2 * fx + (-_2bx * q3 + _2bz * q1) * fy + _2bx * q2 * fz
+            s1 = _2q3 * ex + _2q0 * ey - 4.0 * q1 * ez + _2bz * q3 * fx + (_2bx * q2 + _2bz * q0) * fy + (
+                _2bx * q3 - _4bz * q1) * fz
+            s2 = -_2q0 * ex + _2q3 * ey - 4.0 * q2 * ez + (-_4bx * q2 - _2bz * q0) * fx + (
+                _2bx * q1 + _2bz * q3) * fy + (_2bx * q0 - _4bz * q2) * fz
+            s3 = _2q1 * ex + _2q2 * ey + (-_4bx * q3 + _2bz * q1) * fx + (-_2bx * q0 + _2bz * q2) * fy + _2bx * q1 * fz
+            norm = math.sqrt(s0 * s0 + s1 * s1 + s2 * s2 + s3 * s3)
+            if norm > 0.0:
+                recipNorm = self.beta / norm
+                qDot1 -= recipNorm * s0
+                qDot2 -= recipNorm * s1
+                qDot3 -= recipNorm * s2
+                qDot4 -= recipNorm * s3
+
+        q0 += qDot1 * dt
+        q1 += qDot2 * dt
+        q2 += qDot3 * dt
+        q3 += qDot4 * dt
+        recipNorm = 1.0 / math.sqrt(q0 * q0 + q1 * q1 + q2 * q2 + q3 * q3)
+        self.q0 = q0 * recipNorm
+        self.q1 = q1 * recipNorm
+        self.q2 = q2 * recipNorm
+        self.q3 = q3 * recipNorm
+
+    # 6軸(磁気なし)の更新 g:[dps], dt:[s]
+    def updateIMU(self, gx, gy, gz, ax, ay, az, dt):
+        q0 = self.q0
+        q1 = self.q1
+        q2 = self.q2
+        q3 = self.q3
+        gx *= DEG2RAD
+        gy *= DEG2RAD
+        gz *= DEG2RAD
+
+        qDot1 = 0.5 * (-q1 * gx - q2 * gy - q3 * gz)
+        qDot2 = 0.5 * (q0 * gx + q2 * gz - q3 * gy)
+        qDot3 = 0.5 * (q0 * gy - q1 * gz + q3 * gx)
+        qDot4 = 0.5 * (q0 * gz + q1 * gy - q2 * gx)
+
+        if not (ax == 0.0 and ay == 0.0 and az == 0.0):
+            recipNorm = 1.0 / math.sqrt(ax * ax + ay * ay + az * az)
+            ax *= recipNorm
+            ay *= recipNorm
+            az *= recipNorm
+
+            _2q0 = 2.0 * q0
+            _2q1 = 2.0 * q1
+            _2q2 = 2.0 * q2
+            _2q3 = 2.0 * q3
+            _4q0 = 4.0 * q0
+            _4q1 = 4.0 * q1
+            _4q2 = 4.0 * q2
+            _8q1 = 8.0 * q1
+            _8q2 = 8.0 * q2
+            q0q0 = q0 * q0
+            q1q1 = q1 * q1
+            q2q2 = q2 * q2
+            q3q3 = q3 * q3
+
+            s0 = _4q0 * q2q2 + _2q2 * ax + _4q0 * q1q1 - _2q1 * ay
+            s1 = _4q1 * q3q3 - _2q3 * ax + 4.0 * q0q0 * q1 - _2q0 * ay - _4q1 + _8q1 * q1q1 + _8q1 * q2q2 + _4q1 * az
+            s2 = 4.0 * q0q0 * q2 + _2q0 * ax + _4q2 * q3q3 - _2q3 * ay - _4q2 + _8q2 * q1q1 + _8q2 * q2q2 + _4q2 * az
+            s3 = 4.0 * q1q1 * q3 - _2q1 * ax + 4.0 * q2q2 * q3 - _2q2 * ay
+            norm = math.sqrt(s0 * s0 + s1 * s1 + s2 * s2 + s3 * s3)
+            if norm > 0.0:
+                recipNorm = self.beta / norm
+                qDot1 -= recipNorm * s0
+                qDot2 -= recipNorm * s1
+                qDot3 -= recipNorm * s2
+                qDot4 -= recipNorm * s3
+
+        q0 += qDot1 * dt
+        q1 += qDot2 * dt
+        q2 += qDot3 * dt
+        q3 += qDot4 * dt
+        recipNorm = 1.0 / math.sqrt(q0 * q0 + q1 * q1 + q2 * q2 + q3 * q3)
+        self.q0 = q0 * recipNorm
+        self.q1 = q1 * recipNorm
+        self.q2 = q2 * recipNorm
+        self.q3 = q3 * recipNorm
+
+    # オイラー角(ロール, ピッチ, ヨー)[deg]
+    def euler(self):
+        return quaternion_to_euler(self.q0, self.q1, self.q2, self.q3)
+
+
+class MahonyAHRS(object):
+    # kp: 比例ゲイン, ki: 積分ゲイン(ジャイロのバイアスを打ち消す)
+    def __init__(self, kp=1.0, ki=0.0):
+        self.twoKp = 2.0 * kp
+        self.twoKi = 2.0 * ki
+        self.q0 = 1.0
+        self.q1 = 0.0
+        self.q2 = 0.0
+        self.q3 = 0.0
+        self.integralFBx = 0.0
+        self.integralFBy = 0.0
+        self.integralFBz = 0.0
+
+    # 9軸の更新 g:[dps], dt:[s] 磁気が(0, 0, 0)なら6軸で更新する
+    def update(self, gx, gy, gz, ax, ay, az, mx, my, mz, dt):
+        q0 = self.q0
+        q1 = self.q1
+        q2 = self.q2
+        q3 = self.q3
+        gx *= DEG2RAD
+        gy *= DEG2RAD
+        gz *= DEG2RAD
+
+        if not (ax == 0.0 and ay == 0.0 and az == 0.0):
+            recipNorm = 1.0 / math.sqrt(ax * ax + ay * ay + az * az)
+            ax *= recipNorm
+            ay *= recipNorm
+            az *= recipNorm
+
+            q0q0 = q0 * q0
+            q0q1 = q0 * q1
+            q0q2 = q0 * q2
+            q1q1 = q1 * q1
+            q1q3 = q1 * q3
+            q2q2 = q2 * q2
+            q2q3 = q2 * q3
+            q3q3 = q3 * q3
+
+            # 推定した重力の向きと測った加速度の外積が誤差
+            halfvx = q1q3 - q0q2
+            halfvy = q0q1 + q2q3
+            halfvz = q0q0 - 0.5 + q3q3
+            halfex = ay * halfvz - az * halfvy
+            halfey = az * halfvx - ax * halfvz
+            halfez = ax * halfvy - ay * halfvx
+
+            if not (mx == 0.0 and my == 0.0 and mz == 0.0):
+                recipNorm = 1.0 / math.sqrt(mx * mx + my * my + mz * mz)
+                mx *= recipNorm
+                my *= recipNorm
+                mz *= recipNorm
+                q0q3 = q0 * q3
+                q1q2 = q1 * q2
+
+                # 地磁気の向き
+                hx = 2.0 * (mx * (0.5 - q2q2 - q3q3) + my * (q1q2 - q0q3) + mz * (q1q3 + q0q2))
+                hy = 2.0 * (mx * (q1q2 + q0q3) + my * (0.5 - q1q1 - q3q3) + mz * (q2q3 - q0q1))
+                bx = math.sqrt(hx * hx + hy * hy)
+                bz = 2.0 * (mx * (q1q3 - q0q2) + my * (q2q3 + q0q1) + mz * (0.5 - q1q1 - q2q2))
+                halfwx = bx * (0.5 - q2q2 - q3q3) + bz * (q1q3 - q0q2)
+                halfwy = bx * (q1q2 - q0q3) + bz * (q0q1 + q2q3)
+                halfwz = bx * (q0q2 + q1q3) + bz * (0.5 - q1q1 - q2q2)
+                halfex += my * halfwz - mz * halfwy
+                halfey += mz * halfwx - mx * halfwz
+                halfez += mx * halfwy - my * halfwx
+
+            if self.twoKi > 0.0:
+                self.integralFBx += self.twoKi * halfex * dt
+                self.integralFBy += self.twoKi * halfey * dt
+                self.integralFBz += self.twoKi * halfez * dt
+                gx += self.integralFBx
+                gy += self.integralFBy
+                gz += self.integralFBz
+            gx += self.twoKp * halfex
+            gy += self.twoKp * halfey
+            gz += self.twoKp * halfez
+
+        gx *= 0.5 * dt
+        gy *= 0.5 * dt
+        gz *= 0.5 * dt
+        qa = q0
+        qb = q1
+        qc = q2
+        q0 += -qb * gx - qc * gy - q3 * gz
+        q1 += qa * gx + qc * gz - q3 * gy
+        q2 += qa * gy - qb * gz + q3 * gx
+        q3 += qa * gz + qb * gy - qc * gx
+        recipNorm = 1.0 / math.sqrt(q0 * q0 + q1 * q1 + q2 * q2 + q3 * q3)
+        self.q0 = q0 * recipNorm
+        self.q1 = q1 * recipNorm
+        self.q2 = q2 * recipNorm
+        self.q3 = q3 * recipNorm
+
+    # 6軸(磁気なし)の更新
+    def updateIMU(self, gx, gy, gz, ax, ay, az, dt):
+        self.update(gx, gy, gz, ax, ay, az, 0.0, 0.0, 0.0, dt)
+
+    # オイラー角(ロール, ピッチ, ヨー)[deg]
+    def euler(self):
+        return quaternion_to_euler(self.q0, self.q1, self.q2, self.q3)
+
+
+# フィルタ1回の更新の時間を測る 戻り値は{名前: 更新できる回数[Hz]}
+def benchmark(count=20000):
+    import random
+    rng = random.Random(0)
+    samples = [(rng.gauss(0, 5), rng.gauss(0, 5), rng.gauss(0, 5),
+                rng.gauss(0, 0.05), rng.gauss(0, 0.05), 1.0 + rng.gauss(0, 0.05),
+                30.0 + rng.gauss(0, 1), rng.gauss(0, 1), -40.0 + rng.gauss(0, 1)) for _i in range(count)]
+    dt = 1.0 / 500
+    results = {}
+    for name, ahrs, mag in (('madgwick9', MadgwickAHRS(), True), ('madgwick6', MadgwickAHRS(), False),
+                            ('mahony9', MahonyAHRS(ki=0.1), True), ('mahony6', MahonyAHRS(ki=0.1), False)):
+        update = ahrs.update
+        updateIMU = ahrs.updateIMU
+        start = time.perf_counter()
+        if mag:
+            for gx, gy, gz, ax, ay, az, mx, my, mz in samples:
+                update(gx, gy, gz, ax, ay, az, mx, my, mz, dt)
+        else:
+            for gx, gy, gz, ax, ay, az, mx, my, mz in samples:
+                updateIMU(gx, gy, gz, ax, ay, az, dt)
+        results[name] = count / (time.perf_counter() - start)
+    return results
+
+
+if __name__ == '__main__' and sys.argv[1:] == ['bench']:
+    for name, rate in sorted(benchmark().items()):
+        print("%-10s %10.0f updates/s (%6.1f us/update)" % (name, rate, 1e6 / rate))
+elif __name__ == '__main__':
+    import wiringpi as wi
+    from wpi3_i2c import I2C
+    from wpi3_drdy import DataReadyAcquisition, SysfsEdgeSource, INT_PIN
+
+    wi.wiringPiSetup()  # wiringPiの初期化
+    i2c = I2C()
+    mpu9250 = i2c.setup(0x68)
+    AK8963 = i2c.setup(0x0C)
+    i2c.writeReg8(mpu9250, 0x6B, 0x00)  # PWR_MGMT_1をクリア
+    time.sleep(0.1)
+    i2c.writeReg8(mpu9250, 0x19, 1)  # SMPLRT_DIV 1000/(1+1)=500Hz
+    i2c.writeReg8(mpu9250, 0x1A, 0x01)  # DLPF_CFG=1
+    i2c.writeReg8(mpu9250, 0x1B, 0x10)  # 1000dps
+    i2c.writeReg8(mpu9250, 0x1C, 0x10)  # 8g
+    acq = DataReadyAcquisition(i2c, mpu9250, AK8963, SysfsEdgeSource(INT_PIN))
+    acq.enable()
+    i2c.writeReg8(AK8963, 0x0A, 0x16)  # 100Hz連続測定モード, 16bit
+
+    ahrs = MadgwickAHRS()
+    mx = my = mz = 0.0
+    last = None
+    count = 0
+    try:
+        for t, acc, temp, gyr, mag in acq.samples():
+            if mag is not None:
+                my, mx, mz = mag[0], mag[1], -mag[2]  # AK8963の軸をMPU9250の軸にそろえる
+            if last is not None:
+                ahrs.update(gyr[0], gyr[1], gyr[2], acc[0], acc[1], acc[2], mx, my, mz, (t - last) / 1e9)
+            last = t
+            count += 1
+            if count % 50 == 0:
+                print("roll=%7.2f pitch=%7.2f yaw=%7.2f" % ahrs.euler())
+    except KeyboardInterrupt:
+        pass
+    acq.disable()
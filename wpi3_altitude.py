@@ -0,0 +1,183 @@
+#!/usr/bin/python3 -u
+# -*- coding: utf-8 -*-
+
+############################################################
+# Written by pond-e
+#
+# Environment:  Python 3.4.2
+#               OS: Raspi OS
+#               on Raspberry Pi Zero W
+# Used sensor: BME-280(Akiduki denshi)
+#
+# 気圧から高度を求める
+#   h = ((P0 / P) ** (1 / 5.257) - 1) * (T + 273.15) / 0.0065
+# ・P0は海面気圧(1013.25hPa)ではなく、起動時に地上でN回測った気圧の平均を使う
+#   (打ち上げ地点からの高さになる)
+# ・べき乗はP/P0の等間隔の表を線形補間して求めることもできる(AltitudeTable)
+#   誤差の最大値は表を作るときに全区間の中点で確かめてmax_errorに入れる
+#   CPythonでは**の方が表引きより速いことが多いので、benchmark()で比べて選ぶ
+# ・配列でまとめて計算するaltitude_batch()(NumPyが必要)
+#
+# 1サンプルあたりの時間と誤差の比較(実機なし)
+# pi@raspberrypi ~ $ python3 wpi3_altitude.py
+############################################################
+
+import time
+
+try:
+    import numpy as np
+except ImportError:  # 配列でまとめて計算するときだけ使う
+    np = None
+
+SEA_LEVEL_PRESSURE = 1013.25  # [hPa]
+EXPONENT = 1 / 5.257
+LAPSE_RATE = 0.0065  # 気温減率[K/m]
+
+
+# q = P / P0 に対する q ** (-1 / 5.257) の表
+# lo~hiを size 区間に分け、区間の中では線形補間する
+class AltitudeTable(object):
+    def __init__(self, lo=0.25, hi=1.25, size=2048):
+        self.lo = lo
+        self.hi = hi
+        self.size = size
+        self.scale = size / (hi - lo)
+        step = (hi - lo) / size
+        self.values = [(lo + i * step) ** -EXPONENT for i in range(size + 1)]
+        # 次の点との差(補間で毎回引き算しないように)
+        self.slopes = [self.values[i + 1] - self.values[i] for i in range(size)] + [0.0]
+        # 線形補間の誤差は区間の中点で最大になる
+        self.max_error = max(abs((self.values[i] + self.values[i + 1]) / 2 - (lo + (i + 0.5) * step) ** -EXPONENT)
+                             for i in range(size))
+
+    # q ** (-1 / 5.257) 表の範囲外は直接計算する
+    def power(self, q):
+        x = (q - self.lo) * self.scale
+        if not 0 <= x < self.size:
+            return q ** -EXPONENT
+        i = int(x)
+        return self.values[i] + self.slopes[i] * (x - i)
+
+    # 配列のqに対するq ** (-1 / 5.257)
+    def power_batch(self, q):
+        q = np.asarray(q, dtype=np.float64)
+        x = (q - self.lo) * self.scale
+        inside = (x >= 0) & (x < self.size)
+        i = np.where(inside, x, 0).astype(np.intp)
+        values = np.asarray(self.values)
+        slopes = np.asarray(self.slopes)
+        result = values[i] + slopes[i] * (x - i)
+        if not inside.all():
+            result[~inside] = q[~inside] ** -EXPONENT
+        return result
+
+
+class Altimeter(object):
+    # ref_pressure: 基準(高度0m)の気圧[hPa]
+    # table: AltitudeTableを使うとき指定する(Noneならべき乗を直接計算する)
+    def __init__(self, ref_pressure=SEA_LEVEL_PRESSURE, table=None):
+        self.ref_pressure = ref_pressure
+        self.inv_ref = 1.0 / ref_pressure
+        self.table = table
+        self.k = 1.0 / LAPSE_RATE
+        if table is not None:
+            self.altitude = self._altitude_table
+
+    # 気圧[hPa]と気温[℃]から基準の気圧からの高度[m]を求める
+    def altitude(self, press, temp):
+        return ((self.ref_pressure / press) ** EXPONENT - 1.0) * (temp + 273.15) * self.k
+
+    def _altitude_table(self, press, temp):
+        t = self.table
+        q = press * self.inv_ref
+        x = (q - t.lo) * t.scale
+        if 0 <= x < t.size:
+            i = int(x)
+            r = t.values[i] + t.slopes[i] * (x - i)
+        else:
+            r = q ** -EXPONENT
+        return (r - 1.0) * (temp + 273.15) * self.k
+
+    # 配列でまとめて求める
+    def altitude_batch(self, press, temp):
+        if np is None:
+            raise ImportError('altitude_batch requires numpy')
+        press = np.asarray(press, dtype=np.float64)
+        temp = np.asarray(temp, dtype=np.float64)
+        if self.table is not None:
+            r = self.table.power_batch(press * self.inv_ref)
+        else:
+            r = (self.ref_pressure / press) ** EXPONENT
+        return (r - 1.0) * (temp + 273.15) * self.k
+
+    # 高度の誤差の最大値[m] (表を使うとき、気温temp_max[℃]まで)
+    def max_error(self, temp_max=40.0):
+        if self.table is None:
+            return 0.0
+        return self.table.max_error * (temp_max + 273.15) / LAPSE_RATE
+
+
+# 地上の気圧をcount回測って平均する
+# read: (温度, 気圧, 湿度)を返す関数 (wpi3_bme280_driver.BME280.readValidなど)
+#       Noneを返したサンプル(変換前のリセット値など)は数えない
+# wait: 最初の変換が終わるまで待つ関数 (wpi3_bme280_driver.BME280.waitReadyなど)
+#       setup()の直後の1回目はリセット値なので、平均が数hPa(高度で数十m)ずれる
+def reference_pressure(read, count=50, interval=0.02, wait=None):
+    if wait is not None:
+        wait()
+    total = 0.0
+    n = 0
+    for _i in range(2 * count):  # 使えないサンプルはcount回まで読み直す
+        value = read()
+        if value is not None:
+            total += value[1]
+            n += 1
+            if n == count:
+                break
+        time.sleep(interval)
+    if n == 0:
+        raise IOError('no valid pressure sample')
+    return total / n
+
+
+# 1サンプルあたりの時間[ns]と表の誤差[m]を測る
+def benchmark(count=200000):
+    import random
+    rng = random.Random(0)
+    press = [rng.uniform(300.0, 1100.0) for _i in range(count)]
+    temp = [rng.uniform(-40.0, 40.0) for _i in range(count)]
+    direct = Altimeter(1005.0)
+    table = Altimeter(1005.0, AltitudeTable())
+    results = {}
+
+    start = time.perf_counter()
+    for p, t in zip(press, temp):
+        (((1013.25 / p) ** (1 / 5.257) - 1) * (t + 273.15)) / 0.0065
+    results['old'] = (time.perf_counter() - start) / count * 1e9
+
+    for name, alt in (('direct', direct), ('table', table)):
+        altitude = alt.altitude
+        start = time.perf_counter()
+        for p, t in zip(press, temp):
+            altitude(p, t)
+        results[name] = (time.perf_counter() - start) / count * 1e9
+
+    error = max(abs(direct.altitude(p, t) - table.altitude(p, t)) for p, t in zip(press, temp))
+    results['table_error_m'] = error
+    results['table_bound_m'] = table.max_error()
+    if np is not None:
+        press = np.array(press)
+        temp = np.array(temp)
+        for name, alt in (('direct_batch', direct), ('table_batch', table)):
+            start = time.perf_counter()
+            alt.altitude_batch(press, temp)
+            results[name] = (time.perf_counter() - start) / count * 1e9
+    return results
+
+
+if __name__ == '__main__':
+    results = benchmark()
+    for name in ('old', 'direct', 'table', 'direct_batch', 'table_batch'):
+        if name in results:
+            print("%-13s %8.1f ns/sample" % (name, results[name]))
+    print("table error   %8.4f m (bound %.4f m)" % (results['table_error_m'], results['table_bound_m']))
@@ -0,0 +1,189 @@
+#!/usr/bin/python3 -u
+# -*- coding: utf-8 -*-
+
+############################################################
+# Written by pond-e
+#
+# Environment:  Python 3.5以上(async/awaitを使う)
+#               OS: Raspi OS
+#               on Raspberry Pi Zero W
+#
+# asyncioで全センサを1つのプロセス、1つのイベントループで扱う
+# ・GPSはシリアルのファイルディスクリプタをイベントループに登録し、
+#   届いた分だけ読んでNMEAParserに渡す(readlineで止まらない)
+# ・I2Cのセンサは周期タスクにして、読み出しはI2C専用のスレッド1つで行う
+#   (I2Cの読み書きはブロックするのでイベントループの中では呼ばない)
+# ・全部のデータは1つのasyncio.Queueに入り、1つのコンシューマが処理する
+#
+# 起動方法
+# pi@raspberrypi ~ $ sudo python3 wpi3_async.py
+############################################################
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from wpi3_clock import monotonic_ns
+
+
+# funcを呼び、(呼ぶ直前の時刻(monotonic_ns), 戻り値)を返す (I2Cのスレッドで動く)
+def _timed(func):
+    return monotonic_ns(), func()
+
+
+class AsyncRuntime(object):
+    # consumer: (名前, 時刻(monotonic_ns), データ)を受け取る関数
+    # maxsize: キューの長さ 一杯になったら新しいデータを捨てて数える
+    def __init__(self, consumer, maxsize=4096, loop=None):
+        self.loop = loop if loop is not None else asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=1)  # I2C専用のスレッド
+        self.maxsize = maxsize
+        self.queue = None  # イベントループの中で作る
+        self.consumer = consumer
+        self.tasks = []
+        self.dropped = 0  # キューが一杯で捨てたデータの数
+        self.counts = {}  # 名前ごとのデータの数
+        self.errors = {}  # 名前ごとの例外の数
+        self._readers = []
+        self.elapsed = 0.0
+
+    def _put(self, name, t, data):
+        try:
+            self.queue.put_nowait((name, t, data))
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    # rate[Hz]の周期でfuncをI2Cのスレッドで呼び出す
+    # 時刻はI2Cのスレッドで読み出す直前に取る(executorの待ち行列やループの遅れを含めない)
+    def add_poll(self, name, rate, func):
+        self.counts[name] = 0
+        self.errors[name] = 0
+
+        async def poll():
+            loop = self.loop
+            period = 1.0 / rate
+            next_time = loop.time()
+            while True:
+                try:
+                    t, data = await loop.run_in_executor(self.executor, _timed, func)
+                except Exception:
+                    self.errors[name] += 1
+                    data = None
+                if data is not None:
+                    self.counts[name] += 1
+                    self._put(name, t, data)
+                next_time += period
+                delay = next_time - loop.time()
+                if delay < 0:
+                    next_time = loop.time()  # 遅れた分は取り戻さない
+                    delay = 0
+                await asyncio.sleep(delay)
+
+        self.tasks.append(poll)
+
+    # GPSの受信機(wpi3_gps_receiver.GPSReceiver)を登録する
+    # シリアルにデータが届いたときだけ読み出す
+    def add_gps(self, gps, name='gps'):
+        self.counts[name] = 0
+        self.errors[name] = 0
+        ser = gps.ser
+
+        def on_readable():
+            t = monotonic_ns()
+            for msg in gps.parser.feed(ser.read(ser.in_waiting or 1)):
+                self.counts[name] += 1
+                self._put(name, t, msg)
+
+        self._readers.append((ser.fileno(), on_readable))
+
+    async def _consume(self):
+        queue = self.queue
+        consumer = self.consumer
+        while True:
+            name, t, data = await queue.get()
+            consumer(name, t, data)
+
+    async def _main(self, duration):
+        loop = self.loop
+        self.queue = asyncio.Queue(self.maxsize)
+        for fd, callback in self._readers:
+            loop.add_reader(fd, callback)
+        tasks = [loop.create_task(poll()) for poll in self.tasks]
+        tasks.append(loop.create_task(self._consume()))
+        try:
+            if duration is None:
+                await asyncio.gather(*tasks)
+            else:
+                await asyncio.sleep(duration)
+        finally:
+            for fd, _callback in self._readers:
+                loop.remove_reader(fd)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # キューに残っている分も処理する
+            while not self.queue.empty():
+                self.consumer(*self.queue.get_nowait())
+
+    # duration秒動かす(Noneなら止めるまで)
+    def run(self, duration=None):
+        start = time.monotonic()
+        try:
+            self.loop.run_until_complete(self._main(duration))
+        finally:
+            self.elapsed = time.monotonic() - start
+
+    def close(self):
+        self.executor.shutdown()
+        self.loop.close()
+
+    def print_report(self):
+        for name in sorted(self.counts):
+            print("%-6s %8.1f /s errors=%d" % (name, self.counts[name] / self.elapsed, self.errors[name]))
+        print("dropped=%d" % self.dropped)
+
+
+if __name__ == '__main__':
+    import datetime
+    import struct
+    import wiringpi as wi
+    from wpi3_i2c import I2C
+    from wpi3_bme280_driver import BME280
+    from wpi3_drdy import DataReadyAcquisition
+    from wpi3_gps_receiver import GPSReceiver
+
+    wi.wiringPiSetup()  # wiringPiの初期化
+    i2c = I2C()
+    mpu9250 = i2c.setup(0x68)
+    AK8963 = i2c.setup(0x0C)
+    i2c.writeReg8(mpu9250, 0x6B, 0x00)  # PWR_MGMT_1をクリア
+    time.sleep(0.1)
+    i2c.writeReg8(mpu9250, 0x37, 0x02)  # BYPASS_EN=1
+    i2c.writeReg8(mpu9250, 0x1B, 0x10)  # 1000dps
+    i2c.writeReg8(mpu9250, 0x1C, 0x10)  # 8g
+    i2c.writeReg8(AK8963, 0x0A, 0x16)  # 100Hz連続測定モード, 16bit
+    mag = DataReadyAcquisition(i2c, mpu9250, AK8963, None)  # 磁気の読み出しだけ使う
+    bme = BME280(i2c, i2c.setup(0x76))
+    bme.setup()
+    gps = GPSReceiver()
+    gps.configure(baudrate=115200, rate=10)
+
+    now = datetime.datetime.now()
+    fmt_name = "/home/pi/data/async_logs_{0:%Y%m%d-%H%M%S}.txt".format(now)
+    f = open(fmt_name, 'w')
+
+    def consumer(name, t, data):
+        f.write("%s,%d,%s\n" % (name, t, data))
+
+    runtime = AsyncRuntime(consumer)
+    runtime.add_poll('imu', 200, lambda: struct.unpack('>7h', i2c.readBlock(mpu9250, 0x3B, 14)))
+    runtime.add_poll('mag', 100, mag.readMag)
+    runtime.add_poll('baro', 25, bme.read)
+    runtime.add_gps(gps)
+    try:
+        runtime.run()
+    except KeyboardInterrupt:
+        pass
+    runtime.print_report()
+    runtime.close()
+    f.close()
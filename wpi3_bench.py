@@ -0,0 +1,335 @@
+#!/usr/bin/python3 -u
+# -*- coding: utf-8 -*-
+
+############################################################
+# Written by pond-e
+#
+# Environment:  Python 3.4.2
+#               OS: Raspi OS
+#               on Raspberry Pi Zero W
+#
+# cs17_wpi3_2sensors.pyの計測ループ(読み出し→補正→高度→整形→書き込み)を
+# シミュレータ(wpi3_simulator.py)のバスで動かして測る
+# ・1秒あたりのサンプル数
+# ・サンプルの間隔のp50, p99, 最大[us] (周期を指定したときは間に合わなかった回数も)
+# ・1サンプルあたりの時間の内訳[us]
+#   i2c: バスの読み書き, mag_wait: 磁気センサのデータ待ち(getMag()のsleep),
+#   conversion: 単位への変換・補正・高度, formatting: レコード/行を作る, io: ファイルへの書き込み
+# ・ループの計測(wpi3_stats.py)の1ループあたりの負担[ns] (無効のとき、有効のとき)
+# ・結果はJSONに保存し、compareで前の結果と比べる(リリースごとの性能の低下を見つける)
+#
+# I2Cは既定で400kHzのバスをまねる(1回100us + 1バイト22.5us)
+#
+# 計測(1つの設定あたり5秒)
+# pi@raspberrypi ~ $ python3 wpi3_bench.py 5 bench.json
+# 前の結果と比べる(1秒あたりのサンプル数が10%以上減るか、p99が10%以上増えたら終了コード1)
+# pi@raspberrypi ~ $ python3 wpi3_bench.py compare old.json bench.json
+############################################################
+
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+from wpi3_altitude import Altimeter
+from wpi3_binlog import RingLogger, CSV_FORMAT
+from wpi3_bme280_driver import BME280
+from wpi3_clock import monotonic_ns, perf_counter_ns
+from wpi3_i2c import set_shared_backend
+from wpi3_magcal import MagCalibration, readASA
+from wpi3_mpu9250_i2cmst import MPU9250I2CMaster
+from wpi3_simulator import Simulator, FlightProfile
+from wpi3_stats import benchmark as stats_benchmark
+
+STAGES = ['i2c', 'mag_wait', 'conversion', 'formatting', 'io']
+BUS_LATENCY = 100e-6  # 1回の読み書きの時間[s]
+BUS_BYTE_TIME = 22.5e-6  # 1バイト(9bit, 400kHz)の時間[s]
+TOLERANCE = 0.1  # compareで低下とみなす割合
+
+# 計測する設定 (log: 'bin'(RingLogger)か'csv'(テキスト), mag: 'bypass'か'master', period: 周期[s] 0なら待たない)
+SUITE = [
+    {'log': 'bin', 'mag': 'bypass', 'period': 0.0},
+    {'log': 'bin', 'mag': 'master', 'period': 0.0},
+    {'log': 'csv', 'mag': 'bypass', 'period': 0.0},
+    {'log': 'bin', 'mag': 'master', 'period': 0.01},
+]
+
+
+# バスの読み書きにかかった時間を数えるバックエンド
+class TimedI2C(object):
+    def __init__(self, i2c):
+        self.i2c = i2c
+        self.ns = 0
+        self.transactions = 0
+
+    def setup(self, address):
+        return self.i2c.setup(address)
+
+    def readReg8(self, fd, reg):
+        start = perf_counter_ns()
+        data = self.i2c.readReg8(fd, reg)
+        self.ns += perf_counter_ns() - start
+        self.transactions += 1
+        return data
+
+    def writeReg8(self, fd, reg, data):
+        start = perf_counter_ns()
+        result = self.i2c.writeReg8(fd, reg, data)
+        self.ns += perf_counter_ns() - start
+        self.transactions += 1
+        return result
+
+    def readBlock(self, fd, reg, length):
+        start = perf_counter_ns()
+        data = self.i2c.readBlock(fd, reg, length)
+        self.ns += perf_counter_ns() - start
+        self.transactions += 1
+        return data
+
+
+# cs17_wpi3_2sensors.timeの代わりに入れて、time.sleep()で待った時間を数える
+class _SleepTimer(object):
+    def __init__(self):
+        self.ns = 0
+
+    def sleep(self, seconds):
+        start = perf_counter_ns()
+        time.sleep(seconds)
+        self.ns += perf_counter_ns() - start
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+# ファイルへの書き出し(flush)にかかった時間を数えるRingLogger
+class TimedRingLogger(RingLogger):
+    def __init__(self, *args, **kwargs):
+        RingLogger.__init__(self, *args, **kwargs)
+        self.io_ns = 0
+
+    def flush(self):
+        start = perf_counter_ns()
+        RingLogger.flush(self)
+        self.io_ns += perf_counter_ns() - start
+
+
+# 並べ替えたリストのq(0~1)の値(nearest rank)
+def _percentile(values, q):
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+# 1つの設定で duration 秒計測して結果の辞書を返す
+# directoryを省くとログは一時ディレクトリに書き、終わったら消す
+# 書き換えた環境変数CS17_I2C_BACKENDとcs17_wpi3_2sensorsのi2c, timeは終わったら元に戻す
+def run(duration=5.0, log='bin', mag='bypass', period=0.0, speed=10.0, latency=BUS_LATENCY,
+        byte_time=BUS_BYTE_TIME, directory=None):
+    backend = os.environ.get('CS17_I2C_BACKEND')
+    os.environ['CS17_I2C_BACKEND'] = 'sim'
+    import cs17_wpi3_2sensors as cs17
+    saved = (cs17.i2c, cs17.time)
+    tmp = None
+    if directory is None:
+        tmp = tempfile.TemporaryDirectory()
+        directory = tmp.name
+    try:
+        return _run(cs17, duration, log, mag, period, speed, latency, byte_time, directory)
+    finally:
+        cs17.i2c, cs17.time = saved
+        if backend is None:
+            del os.environ['CS17_I2C_BACKEND']
+        else:
+            os.environ['CS17_I2C_BACKEND'] = backend
+        if tmp is not None:
+            tmp.cleanup()
+
+
+def _run(cs17, duration, log, mag, period, speed, latency, byte_time, directory):
+    sim = Simulator(FlightProfile(), speed, latency, byte_time, loop=True)
+    bus = TimedI2C(sim.i2c)
+    shared = set_shared_backend(bus)
+    cs17.i2c = shared  # 2回目からのrun()でも新しいシミュレータを使う
+    sleeper = _SleepTimer()
+    cs17.time = sleeper
+
+    # cs17_wpi3_2sensors.pyの起動時と同じ設定
+    cs17.resetRegister()
+    cs17.powerWakeUp()
+    cs17.setAccelRange(cs17.accelRange)
+    cs17.setGyroRange(cs17.gyroRange)
+    cs17.magCal = MagCalibration(asa=readASA(shared, cs17.AK8963))
+    cs17.lastMagRaw = None  # 前のrun()の値を使わない
+    cs17.setMagRegister('100Hz', '16bit')
+    mst = None
+    if mag == 'master':
+        cs17.setSampleRate(0)
+        mst = MPU9250I2CMaster(shared, cs17.mpu9250, cs17.accelCoefficient, cs17.gyroCoefficient,
+                               cs17.magCoefficient16)
+        mst.enable()
+    bme = BME280(shared, cs17.bme280)
+    bme.setup()
+    bme.waitReady()  # 最初の変換が終わるまで待つ
+    altimeter = Altimeter(bme.read()[1])
+
+    path = os.path.join(directory, 'bench.' + log)
+    logger = None
+    f = None
+    if log == 'bin':
+        logger = TimedRingLogger(path, {'sensor': 'bench'}, capacity=8192, block=512)
+    else:
+        f = open(path, 'w', encoding='utf-8')
+
+    stage = dict((name, 0) for name in STAGES)
+    stamps = []
+    overruns = 0
+    period_ns = int(period * 1e9)
+    magValue = (0.0, 0.0, 0.0)
+    bus.ns = 0
+    bus.transactions = 0
+    sleeper.ns = 0
+    cpu = time.process_time()
+    begin = perf_counter_ns()
+    end = begin + int(duration * 1e9)
+    while True:
+        start = perf_counter_ns()
+        if start >= end:
+            break
+        bus0 = bus.ns
+        wait0 = sleeper.ns
+        temp, press, humi = bme.read()
+        now = monotonic_ns()
+        if mst is not None:
+            acc, temp_mpu, gyr, m = mst.read()
+            if m is not None:
+                magValue = cs17.magCal.apply(m[0], m[1], m[2])
+        else:
+            acc, temp_mpu, gyr = cs17.getAccelTempGyro()
+            magValue = cs17.getMag()
+        h = altimeter.altitude(press, temp)
+        t1 = perf_counter_ns()
+        values = (temp, humi, press, acc[0], acc[1], acc[2], gyr[0], gyr[1], gyr[2],
+                  magValue[0], magValue[1], magValue[2], h)
+        if logger is not None:
+            io0 = logger.io_ns
+            logger.write(now, *values)
+            t2 = perf_counter_ns()
+            io = logger.io_ns - io0
+        else:
+            line = CSV_FORMAT % ((datetime.datetime.now(),) + values) + "\n"
+            t_io = perf_counter_ns()
+            f.write(line)
+            t2 = perf_counter_ns()
+            io = t2 - t_io
+        bus_ns = bus.ns - bus0
+        wait_ns = sleeper.ns - wait0
+        stage['i2c'] += bus_ns
+        stage['mag_wait'] += wait_ns
+        stage['conversion'] += t1 - start - bus_ns - wait_ns
+        stage['formatting'] += t2 - t1 - io
+        stage['io'] += io
+        stamps.append(now)
+        if period_ns:
+            sleep_ns = period_ns - (perf_counter_ns() - start)
+            if sleep_ns < 0:
+                overruns += 1
+            else:
+                time.sleep(sleep_ns / 1e9)
+    elapsed = (perf_counter_ns() - begin) / 1e9
+    start = perf_counter_ns()
+    if logger is not None:
+        logger.close()
+    else:
+        f.close()
+    stage['io'] += perf_counter_ns() - start
+    cpu = time.process_time() - cpu
+    if mst is not None:
+        mst.disable()
+    sim.close()
+
+    n = len(stamps)
+    intervals = sorted(b - a for a, b in zip(stamps, stamps[1:]))
+    busy = sum(stage.values()) or 1
+    return {
+        'log': log, 'mag': mag, 'period': period,
+        'samples': n,
+        'samples_per_s': n / elapsed,
+        'interval_us': {
+            'p50': _percentile(intervals, 0.50) / 1e3,
+            'p99': _percentile(intervals, 0.99) / 1e3,
+            'max': intervals[-1] / 1e3 if intervals else 0.0,
+        },
+        'overruns': overruns,
+        'stage_us': dict((name, stage[name] / 1e3 / max(n, 1)) for name in STAGES),
+        'stage_share': dict((name, stage[name] / float(busy)) for name in STAGES),
+        'i2c_transactions_per_sample': bus.transactions / float(max(n, 1)),
+        'wall_s': elapsed,
+        'cpu_s': cpu,
+    }
+
+
+# SUITEの設定をすべて計測する
+def run_suite(duration=5.0, speed=10.0, latency=BUS_LATENCY, byte_time=BUS_BYTE_TIME):
+    results = [run(duration, speed=speed, latency=latency, byte_time=byte_time, **config) for config in SUITE]
+    return {
+        'date': str(datetime.datetime.now()),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'duration': duration,
+        'bus': {'latency': latency, 'byte_time': byte_time},
+        'results': results,
+        'stats_overhead_ns': stats_benchmark(),
+    }
+
+
+# 前の結果(old)と比べて、低下した項目の説明のリストを返す
+def compare(old, new, tolerance=TOLERANCE):
+    key = lambda r: (r['log'], r['mag'], r['period'])
+    before = dict((key(r), r) for r in old['results'])
+    regressions = []
+    for r in new['results']:
+        o = before.get(key(r))
+        if o is None:
+            continue
+        name = '%s/%s/%gs' % key(r)
+        if r['samples_per_s'] < o['samples_per_s'] * (1.0 - tolerance):
+            regressions.append('%s: samples/s %.1f -> %.1f' % (name, o['samples_per_s'], r['samples_per_s']))
+        if r['interval_us']['p99'] > o['interval_us']['p99'] * (1.0 + tolerance):
+            regressions.append('%s: p99 %.0f -> %.0f us' % (name, o['interval_us']['p99'], r['interval_us']['p99']))
+    return regressions
+
+
+def _print(report):
+    print("%-18s %9s %8s %8s %8s %5s  %s" % ('log/mag/period', 'samples/s', 'p50[us]', 'p99[us]', 'max[us]',
+                                             'over', ' '.join('%10s' % s for s in STAGES)))
+    for r in report['results']:
+        print("%-18s %9.1f %8.0f %8.0f %8.0f %5d  %s" % (
+            '%s/%s/%gs' % (r['log'], r['mag'], r['period']), r['samples_per_s'],
+            r['interval_us']['p50'], r['interval_us']['p99'], r['interval_us']['max'], r['overruns'],
+            ' '.join('%7.1fus' % r['stage_us'][s] for s in STAGES)))
+    print("stats overhead: disabled %(disabled).1f ns/loop, enabled %(enabled).1f ns/loop" % report['stats_overhead_ns'])
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'compare':
+        with open(sys.argv[2]) as f:
+            old = json.load(f)
+        with open(sys.argv[3]) as f:
+            new = json.load(f)
+        regressions = compare(old, new)
+        for line in regressions:
+            print(line)
+        print("%d regression(s)" % len(regressions))
+        sys.exit(1 if regressions else 0)
+
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+    out = sys.argv[2] if len(sys.argv) > 2 else "bench_{0:%Y%m%d-%H%M%S}.json".format(datetime.datetime.now())
+    report = run_suite(duration)
+    _print(report)
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print("saved to %s" % out)
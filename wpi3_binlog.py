@@ -0,0 +1,312 @@
+#!/usr/bin/python3 -u
+# -*- coding: utf-8 -*-
+
+############################################################
+# Written by pond-e
+#
+# Environment:  Python 3.4.2
+#               OS: Raspi OS
+#               on Raspberry Pi Zero W
+#
+# 計測データをバイナリで記録するロガー
+# 1サンプルを固定長のstructにして、あらかじめ確保したリングバッファに
+# pack_intoで詰め、まとまった量(block)になったらまとめてファイルに書き出す。
+# ファイルの先頭にはセンサの設定とキャリブレーション値をJSONで書いておく。
+#
+# ファイルの形式
+#   MAGIC(8バイト) | ヘッダ長(uint32 LE) | ヘッダ(JSON, UTF-8) | レコード | レコード | ...
+#
+# ThreadedRingLoggerは書き出しを別スレッドで行うので、SDカードの書き込みが
+# 詰まってもサンプリングのループは止まらない(バッファが一杯になったら捨てて数える)。
+#
+# 統計のレコード(wpi3_stats.py)はサンプルのレコードと同じ長さの枠に入れ、
+# 時刻を負にして区別する(読むときはサンプルと分けて返す)。
+#
+# RAW_RECORDは生のレジスタ値だけの記録(飛行中は単位への変換をしない)。
+# 変換に使う係数とキャリブレーション値はヘッダにあり、CSVへの変換時に
+# NumPyで全レコードをまとめて変換する。
+#
+# CSVへの変換(cs17_wpi3_2sensors.pyの従来のCSVと同じ列)
+# pi@raspberrypi ~ $ python3 wpi3_binlog.py cs17_wpi3_2sensors_logs_20200101-000000.bin
+############################################################
+
+import datetime
+import json
+import os
+import struct
+import sys
+import threading
+
+from wpi3_altitude import Altimeter, SEA_LEVEL_PRESSURE
+from wpi3_bme280_driver import BME280Calib, compensate_batch
+from wpi3_clock import to_unix
+from wpi3_magcal import MagCalibration
+
+try:
+    import numpy as np
+except ImportError:  # 生データのログを変換するときだけ使う
+    np = None
+
+MAGIC = b'CS17LOG1'
+HEADER_LEN = struct.Struct('<I')
+
+# cs17_wpi3_2sensors.pyの1サンプル
+# 時刻(monotonic_ns), T, H, P, 加速度xyz, ジャイロxyz, 磁気xyz, 高度
+# 実際の時刻はヘッダのanchor_ns, anchor_unix(wpi3_clock.clock_anchor())から換算する
+RECORD = struct.Struct('<q13f')
+# 生データの1サンプル
+# 時刻(monotonic_ns), BME280の気圧、温度、湿度のADC値,
+# MPU9250の加速度xyz、温度、ジャイロxyz, AK8963の磁気xyz
+RAW_RECORD = struct.Struct('<q3I7h3h')
+# 統計のレコード(RECORD, RAW_RECORDの枠に入る長さ 残りは0で埋める)
+# -時刻(monotonic_ns), 区間のサンプル数, 間に合わなかった回数, I2Cのエラー, 磁気のデータ待ち, バッファ溢れ,
+# 区間の最大の時間[ms] bme, imu, mag, log, loop
+STATS_RECORD = struct.Struct('<q5H5f')
+STATS_FIELDS = ['t', 'samples', 'overruns', 'i2c_errors', 'mag_not_ready', 'dropped',
+                'bme_max_ms', 'imu_max_ms', 'mag_max_ms', 'log_max_ms', 'loop_max_ms']
+STATS_CSV_HEADER = u"yyyy-mm-dd hh:mm:ss.mmmmmm," + ",".join(STATS_FIELDS[1:])
+STATS_CSV_FORMAT = "%s,%d,%d,%d,%d,%d,%.3f,%.3f,%.3f,%.3f,%.3f"
+RAW_FIELDS = ['t', 'pres_raw', 'temp_raw', 'hum_raw', 'ax', 'ay', 'az', 'temp_mpu', 'gx', 'gy', 'gz', 'mx', 'my', 'mz']
+CSV_HEADER = u"yyyy-mm-dd hh:mm:ss.mmmmmm,T[℃],H[%],P[hPa],x[g],y[g],z[g],x[dps],y[dps],z[dps],x[uT],y[uT],z[uT],h[m]"
+CSV_FORMAT = "%s,%6.2f,%6.2f,%7.2f,%6.3f,%6.3f,%6.3f,%6.3f,%6.3f,%6.3f,%6.3f,%6.3f,%6.3f,%4.4f"
+
+
+class RingLogger(object):
+    # path: 書き込むファイル, header: ヘッダに書く辞書(JSONにできるもの)
+    # capacity: リングバッファのレコード数, block: これだけたまったらファイルへ書き出す
+    def __init__(self, path, header, record=RECORD, capacity=4096, block=512):
+        if block > capacity:
+            raise ValueError('block must not be larger than capacity')
+        if record.size < STATS_RECORD.size:
+            raise ValueError('record must not be shorter than STATS_RECORD')
+        self.record = record
+        self.size = record.size
+        self.capacity = capacity
+        self.block = block
+        self.buf = bytearray(capacity * record.size)
+        self.view = memoryview(self.buf)
+        self.head = 0  # 書き込んだレコード数
+        self.tail = 0  # ファイルへ書き出したレコード数
+        self.dropped = 0  # バッファが一杯で捨てたレコード数
+        self._padding = bytes(record.size - STATS_RECORD.size)
+
+        header = dict(header)
+        header['record'] = record.format if isinstance(record.format, str) else record.format.decode()
+        header['stats_record'] = STATS_RECORD.format if isinstance(STATS_RECORD.format, str) else \
+            STATS_RECORD.format.decode()
+        body = json.dumps(header, ensure_ascii=False, sort_keys=True).encode('utf-8')
+        self.f = open(path, 'wb')
+        self.f.write(MAGIC + HEADER_LEN.pack(len(body)) + body)
+
+    # 1サンプル分をバッファに詰める バッファが一杯ならFalse
+    def write(self, *values):
+        head = self.head
+        if head - self.tail >= self.capacity:
+            self.dropped += 1
+            return False
+        self.record.pack_into(self.buf, (head % self.capacity) * self.size, *values)
+        self.head = head + 1
+        if self.head - self.tail >= self.block:
+            self.flush()
+        return True
+
+    # 統計のレコードをサンプルと同じバッファに詰める t: monotonic_ns
+    # 書き出しはサンプルのレコードと一緒に行う
+    def write_stats(self, t, *values):
+        head = self.head
+        if head - self.tail >= self.capacity:
+            self.dropped += 1
+            return False
+        offset = (head % self.capacity) * self.size
+        STATS_RECORD.pack_into(self.buf, offset, -t, *values)
+        self.buf[offset + STATS_RECORD.size:offset + self.size] = self._padding
+        self.head = head + 1
+        return True
+
+    # バッファにたまっているレコード数
+    def pending(self):
+        return self.head - self.tail
+
+    # たまっているレコードをまとめてファイルへ書き出す
+    def flush(self):
+        head = self.head
+        tail = self.tail
+        if head == tail:
+            return
+        start = (tail % self.capacity) * self.size
+        end = (head % self.capacity) * self.size
+        if end > start:
+            self.f.write(self.view[start:end])
+        else:  # バッファの終わりで折り返している
+            self.f.write(self.view[start:])
+            self.f.write(self.view[:end])
+        self.tail = head
+
+    def close(self):
+        self.flush()
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.f.close()
+
+
+# 書き出しを別スレッドで行うRingLogger
+# サンプリング側(write)はhead、書き出し側(flush)はtailだけを更新するので、
+# 1対1であればロックなしでバッファを共有できる。
+# block件たまるかinterval秒たつと書き出しスレッドがまとめて書き出す。
+class ThreadedRingLogger(RingLogger):
+    def __init__(self, path, header, record=RECORD, capacity=4096, block=512, interval=1.0):
+        RingLogger.__init__(self, path, header, record, capacity, block)
+        self.interval = interval
+        self.batches = 0  # 書き出した回数
+        self.max_pending = 0  # バッファにたまったレコード数の最大値
+        self._ready = threading.Event()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='RingLoggerWriter', daemon=True)
+        self._thread.start()
+
+    # 1サンプル分をバッファに詰める バッファが一杯ならFalse(dropに数える)
+    # ファイルへの書き出しは書き出しスレッドに任せる
+    def write(self, *values):
+        head = self.head
+        pending = head - self.tail
+        if pending >= self.capacity:
+            self.dropped += 1
+            return False
+        self.record.pack_into(self.buf, (head % self.capacity) * self.size, *values)
+        self.head = head + 1
+        if pending >= self.max_pending:
+            self.max_pending = pending + 1
+        if pending + 1 >= self.block and not self._ready.is_set():
+            self._ready.set()
+        return True
+
+    def _run(self):
+        while self._running:
+            self._ready.wait(self.interval)
+            self._ready.clear()
+            if self.head != self.tail:
+                self.flush()
+                self.batches += 1
+
+    # 書き出しスレッドを止めて、残りを書き出して閉じる
+    def close(self):
+        self._running = False
+        self._ready.set()
+        self._thread.join()
+        RingLogger.close(self)
+
+    # 統計情報
+    def stats(self):
+        return {'written': self.tail, 'dropped': self.dropped, 'batches': self.batches,
+                'max_pending': self.max_pending, 'capacity': self.capacity}
+
+
+# バイナリログを読む 戻り値は(ヘッダの辞書, レコードのイテレータ)
+# 電源断などで途中までしか書けていない最後のレコードは無視する
+# 統計のレコードは飛ばす(read_stats()で読む)
+def read_log(path):
+    header, record, data = _read(path)
+    return header, (r for r in record.iter_unpack(data) if r[0] >= 0)
+
+
+# 統計のレコードを読む 戻り値は(ヘッダの辞書, STATS_FIELDSの順のタプルのリスト(時刻は正に戻す))
+def read_stats(path):
+    header, record, data = _read(path)
+    return header, _stats(record, data)
+
+
+def _stats(record, data):
+    stats = []
+    for offset in range(0, len(data), record.size):
+        values = STATS_RECORD.unpack_from(data, offset)
+        if values[0] < 0:
+            stats.append((-values[0],) + values[1:])
+    return stats
+
+
+# 戻り値は(ヘッダの辞書, レコードのstruct, レコード部分のmemoryview)
+def _read(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError('%s is not a binary log' % path)
+    pos = len(MAGIC)
+    length, = HEADER_LEN.unpack_from(data, pos)
+    pos += HEADER_LEN.size
+    header = json.loads(data[pos:pos + length].decode('utf-8'))
+    pos += length
+    record = struct.Struct(header['record'])
+    end = pos + (len(data) - pos) // record.size * record.size
+    return header, record, memoryview(data)[pos:end]
+
+
+# 生データのログを全レコードまとめて単位に変換する
+# 戻り値は(ヘッダの辞書, 時刻(monotonic_ns), 14列の配列(CSVと同じ列の順))
+def convert_raw(path):
+    header, _record, data = _read(path)
+    t, values = _convert_raw(header, data)
+    return header, t, values
+
+
+# ヘッダの係数とキャリブレーション値でレコード部分をまとめて変換する
+def _convert_raw(header, data):
+    if np is None:
+        raise ImportError('convert_raw requires numpy')
+    # '<'のstructと同じくパディングなしのリトルエンディアン
+    dtype = np.dtype([(name, '<i8' if name == 't' else '<u4' if name.endswith('_raw') else '<i2')
+                      for name in RAW_FIELDS])
+    r = np.frombuffer(data, dtype=dtype)
+    r = r[r['t'] >= 0]  # 統計のレコードを除く
+    ac = header['accel_coefficient']
+    gc = header['gyro_coefficient']
+    mc = header['mag_coefficient']
+    ao = header['accel_offset']
+    go = header['gyro_offset']
+    temp, press, humi = compensate_batch(BME280Calib(**header['bme280_calib']),
+                                         r['temp_raw'], r['pres_raw'], r['hum_raw'])
+    h = Altimeter(header.get('ref_pressure', SEA_LEVEL_PRESSURE)).altitude_batch(press, temp)
+    columns = [temp, humi, press]
+    columns += [ac * r[name].astype(np.float64) + ao[i] for i, name in enumerate(('ax', 'ay', 'az'))]
+    columns += [gc * r[name].astype(np.float64) + go[i] for i, name in enumerate(('gx', 'gy', 'gz'))]
+    mag = np.column_stack([mc * r[name].astype(np.float64) for name in ('mx', 'my', 'mz')])
+    if 'mag_calibration' in header:
+        d = header['mag_calibration']
+        mag = MagCalibration(d['offset'], d['matrix'], d['asa'], d.get('field')).apply_batch(mag)
+    columns += [mag[:, 0], mag[:, 1], mag[:, 2]]
+    columns.append(h)
+    return r['t'], np.column_stack(columns)
+
+
+# バイナリログを従来と同じ列のCSVに変換する
+def to_csv(bin_path, csv_path):
+    header, record, data = _read(bin_path)
+    if header.get('mode') == 'raw':
+        t, values = _convert_raw(header, data)
+        records = ((t_ns,) + tuple(row) for t_ns, row in zip(t.tolist(), values.tolist()))
+    else:
+        records = (r for r in record.iter_unpack(data) if r[0] >= 0)
+    fromtimestamp = datetime.datetime.fromtimestamp
+    # アンカーがない古いログは時刻がtime.time()のまま入っている
+    anchor = header if 'anchor_ns' in header else None
+    with open(csv_path, 'w', encoding='utf-8') as f:
+        f.write(CSV_HEADER + "\n")
+        for r in records:
+            t = to_unix(anchor, r[0]) if anchor is not None else r[0]
+            f.write(CSV_FORMAT % ((fromtimestamp(t),) + r[1:]) + "\n")
+    stats = _stats(record, data)
+    if stats:
+        # 統計のレコードは別のCSV(<名前>_stats.csv)にする
+        root, ext = os.path.splitext(csv_path)
+        with open(root + '_stats' + ext, 'w', encoding='utf-8') as f:
+            f.write(STATS_CSV_HEADER + "\n")
+            for r in stats:
+                t = to_unix(anchor, r[0]) if anchor is not None else r[0]
+                f.write(STATS_CSV_FORMAT % ((fromtimestamp(t),) + r[1:]) + "\n")
+    return header
+
+
+if __name__ == '__main__':
+    bin_path = sys.argv[1]
+    csv_path = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(bin_path)[0] + '.csv'
+    to_csv(bin_path, csv_path)
+    print("%s -> %s" % (bin_path, csv_path))
@@ -23,6 +23,7 @@ import wiringpi as wi   #wiringPiモジュールの呼び出し
 import time             #timeライブラリの呼び出し
 import datetime         #datetimeモジュールの呼び出し
 import os
+from wpi3_clock import monotonic_ns, clock_anchor  #サンプルの時刻
 
 #データ計測時間は　SAMPLING_TIME x TIMES
 SAMPLING_TIME = 0.1     #データ取得の時間間隔[sec]
@@ -195,21 +196,23 @@ now = datetime.datetime.now()
 fmt_name = "/home/pi/data/bme280_logs_{0:%Y%m%d-%H%M%S}.csv".format(now)
 f_bme280= open(fmt_name, 'w')    #書き込みファイル
 #f_bme280= open('bme280_logs.csv', 'w')    #書き込みファイル
-value="yyyy-mm-dd hh:mm:ss.mmmmmm, T[℃],H[%],P[hPa]"   #header行への書き込み内容
+#時刻の列はmonotonic_ns 実際の時刻はanchor_unix + (t - anchor_ns) / 1e9
+f_bme280.write("# anchor_ns=%(anchor_ns)d,anchor_unix=%(anchor_unix).6f\n" % clock_anchor())
+value="t[ns],T[℃],H[%],P[hPa]"   #header行への書き込み内容
 f_bme280.write(value+"\n")   #header行をファイル出力
+period = int(SAMPLING_TIME * 1e9)
 
 if __name__ == '__main__':
 	#while True:
 	for _i in range(TIMES):
 		try:
-			date = datetime.datetime.now()  #now()メソッドで現在日付・時刻のdatetime型データの変数を取得 世界時：UTCnow
-			now     = time.time()     #現在時刻の取得
+			now     = monotonic_ns()     #読み出し直前の時刻[ns]
 			readData()
 			#ファイルへ書出し
-			value= "%s,%6.2f,%6.2f,%7.2f" % (date, temp,humi,press)      #時間、温度、湿度、気圧
+			value= "%d,%6.2f,%6.2f,%7.2f" % (now, temp,humi,press)      #時間、温度、湿度、気圧
 			f_bme280 .write(value + "\n")       #ファイルを出力
 			#指定秒数の一時停止
-			sleepTime       = SAMPLING_TIME - (time.time() - now)
+			sleepTime       = (period - (monotonic_ns() - now)) / 1e9
 			if sleepTime < 0.0:
 				continue
 			time.sleep(sleepTime)
@@ -0,0 +1,291 @@
+#!/usr/bin/python3 -u
+# -*- coding: utf-8 -*-
+
+############################################################
+# Written by pond-e
+#
+# Environment:  Python 3.4.2
+#               OS: Raspi OS
+#               on Raspberry Pi Zero W
+# Used sensor: BME-280(Akiduki denshi)
+#
+# BME280をオブジェクトとして扱うドライバ
+# ・データレジスタ0xF7~0xFEの8バイトを1回のトランザクションで読み出す
+# ・キャリブレーション値は起動時に1回だけ読み出し、補正式で使う
+#   定数まで計算済みのnamedtuple(変更不可)として保持する
+# ・t_fineはグローバル変数を使わずに戻り値で受け渡す
+# ・生データの配列をまとめて補正するcompensate_batch()(NumPyが必要)
+# ・setup()の直後は最初の変換(osrs_t=1, osrs_p=4で13msほど)が終わるまで
+#   データレジスタがリセット値(0x80000)のままなので、waitReady()で待つ
+#   1サンプルずつの補正式と同じ順番で計算するので結果はビット単位で一致する
+#
+# 1サンプルあたりの時間の比較(旧方式と新方式)
+# pi@raspberrypi ~ $ sudo python3 wpi3_bme280_driver.py
+# 配列でまとめて補正する場合の比較(実機なし、100万サンプル)
+# pi@raspberrypi ~ $ python3 wpi3_bme280_driver.py batch
+############################################################
+
+import struct
+import sys
+import time
+from collections import namedtuple
+
+try:
+    import numpy as np
+except ImportError:  # 配列でまとめて補正するときだけ使う
+    np = None
+
+RAW_SKIPPED = 0x80000  # 変換していない(リセット直後、オーバーサンプリングがスキップ)ときの気圧・温度の生データ
+
+# 補正式で使う定数(データシートの除算を先に済ませたもの)
+BME280Calib = namedtuple('BME280Calib', [
+    # 温度
+    'T1_1024', 'T1_8192', 'T2', 'T3',
+    # 気圧
+    'P1_32768', 'P2_2e19', 'P3_2e38', 'P4_65536', 'P5_2', 'P6_32768',
+    'P7', 'P8_32768', 'P9_2e31',
+    # 湿度
+    'H1_524288', 'H2_65536', 'H3_2e26', 'H4_64', 'H5_16384', 'H6_2e26',
+])
+
+
+# キャリブレーションレジスタの生の値から補正用の定数を作る
+# calib_88: 0x88~0x9F(24バイト), calib_a1: 0xA1(1バイト), calib_e1: 0xE1~0xE7(7バイト)
+def decode_calib(calib_88, calib_a1, calib_e1):
+    T1, T2, T3, P1, P2, P3, P4, P5, P6, P7, P8, P9 = struct.unpack('<HhhHhhhhhhhh', bytes(calib_88))
+    H1 = calib_a1[0]
+    H2, H3 = struct.unpack('<hB', bytes(calib_e1[0:3]))
+    H4 = (calib_e1[3] << 4) | (calib_e1[4] & 0x0F)
+    H5 = (calib_e1[5] << 4) | ((calib_e1[4] >> 4) & 0x0F)
+    # H4,H5は12bitの符号付き、H6は8bitの符号付き
+    if H4 & 0x800:
+        H4 -= 0x1000
+    if H5 & 0x800:
+        H5 -= 0x1000
+    H6 = struct.unpack('<b', bytes(calib_e1[6:7]))[0]
+    return BME280Calib(
+        T1_1024=T1 / 1024.0, T1_8192=T1 / 8192.0, T2=float(T2), T3=float(T3),
+        P1_32768=P1 / 32768.0, P2_2e19=P2 / 524288.0, P3_2e38=P3 / 274877906944.0,
+        P4_65536=P4 * 65536.0, P5_2=P5 * 2.0, P6_32768=P6 / 32768.0,
+        P7=float(P7), P8_32768=P8 / 32768.0, P9_2e31=P9 / 2147483648.0,
+        H1_524288=H1 / 524288.0, H2_65536=H2 / 65536.0, H3_2e26=H3 / 67108864.0,
+        H4_64=H4 * 64.0, H5_16384=H5 / 16384.0, H6_2e26=H6 / 67108864.0,
+    )
+
+
+# 温度の補正 戻り値は(温度[℃], t_fine)
+def compensate_T(c, adc_T):
+    v1 = (adc_T / 16384.0 - c.T1_1024) * c.T2
+    v2 = adc_T / 131072.0 - c.T1_8192
+    t_fine = v1 + v2 * v2 * c.T3
+    return t_fine / 5120.0, t_fine
+
+
+# 気圧の補正 戻り値は[hPa]
+def compensate_P(c, adc_P, t_fine):
+    v1 = (t_fine / 2.0) - 64000.0
+    vv = v1 * v1
+    v2 = vv * c.P6_32768 + v1 * c.P5_2
+    v2 = (v2 / 4.0) + c.P4_65536
+    v1 = (32768 + (vv * c.P3_2e38 + v1 * c.P2_2e19)) * c.P1_32768
+    if v1 == 0:
+        return 0
+    pressure = ((1048576 - adc_P) - (v2 / 4096)) * 3125
+    if pressure < 0x80000000:
+        pressure = (pressure * 2.0) / v1
+    else:
+        pressure = (pressure / v1) * 2
+    pressure = pressure + ((pressure * pressure * c.P9_2e31 + pressure * c.P8_32768 + c.P7) / 16.0)
+    return pressure / 100
+
+
+# 湿度の補正 戻り値は[%]
+def compensate_H(c, adc_H, t_fine):
+    var_h = t_fine - 76800.0
+    if var_h == 0:
+        return 0
+    var_h = (adc_H - (c.H4_64 + c.H5_16384 * var_h)) * (
+        c.H2_65536 * (1.0 + c.H6_2e26 * var_h * (1.0 + c.H3_2e26 * var_h)))
+    var_h = var_h * (1.0 - c.H1_524288 * var_h)
+    if var_h > 100.0:
+        var_h = 100.0
+    elif var_h < 0.0:
+        var_h = 0.0
+    return var_h
+
+
+# 生データの配列をまとめて補正する 戻り値は(温度[℃], 気圧[hPa], 湿度[%])の配列
+# compensate_T, compensate_P, compensate_Hと同じ順番で計算するので1サンプルずつ補正した値と一致する
+# (補正できないサンプルは同じく0になる) スカラーを渡すと長さ1の配列で返す
+def compensate_batch(c, adc_T, adc_P, adc_H):
+    if np is None:
+        raise ImportError('compensate_batch requires numpy')
+    adc_T = np.atleast_1d(np.asarray(adc_T, dtype=np.float64))
+    adc_P = np.atleast_1d(np.asarray(adc_P, dtype=np.float64))
+    adc_H = np.atleast_1d(np.asarray(adc_H, dtype=np.float64))
+
+    # 温度
+    v1 = (adc_T / 16384.0 - c.T1_1024) * c.T2
+    v2 = adc_T / 131072.0 - c.T1_8192
+    t_fine = v1 + v2 * v2 * c.T3
+    temp = t_fine / 5120.0
+
+    # 気圧
+    v1 = (t_fine / 2.0) - 64000.0
+    vv = v1 * v1
+    v2 = vv * c.P6_32768 + v1 * c.P5_2
+    v2 = (v2 / 4.0) + c.P4_65536
+    v1 = (32768 + (vv * c.P3_2e38 + v1 * c.P2_2e19)) * c.P1_32768
+    zero = v1 == 0
+    v1[zero] = 1.0  # 0で割らないように 後で0にする
+    pressure = ((1048576 - adc_P) - (v2 / 4096)) * 3125
+    pressure = np.where(pressure < 0x80000000, (pressure * 2.0) / v1, (pressure / v1) * 2)
+    pressure = pressure + ((pressure * pressure * c.P9_2e31 + pressure * c.P8_32768 + c.P7) / 16.0)
+    press = pressure / 100
+    press[zero] = 0.0
+
+    # 湿度
+    var_h = t_fine - 76800.0
+    zero = var_h == 0
+    var_h = (adc_H - (c.H4_64 + c.H5_16384 * var_h)) * (
+        c.H2_65536 * (1.0 + c.H6_2e26 * var_h * (1.0 + c.H3_2e26 * var_h)))
+    var_h = var_h * (1.0 - c.H1_524288 * var_h)
+    humi = np.clip(var_h, 0.0, 100.0)
+    humi[zero] = 0.0
+    return temp, press, humi
+
+
+class BME280(object):
+    # i2c: wpi3_i2c.I2C, fd: i2c.setup(0x76)の戻り値
+    def __init__(self, i2c, fd):
+        self.i2c = i2c
+        self.fd = fd
+        self.calib = self.readCalib()
+
+    # キャリブレーションデータの取得(3回のブロック読み出し)
+    def readCalib(self):
+        calib_88 = self.i2c.readBlock(self.fd, 0x88, 24)
+        calib_a1 = self.i2c.readBlock(self.fd, 0xA1, 1)
+        calib_e1 = self.i2c.readBlock(self.fd, 0xE1, 7)
+        return decode_calib(calib_88, calib_a1, calib_e1)
+
+    # 設定 (初期値はwpi3_bme280_2.pyのsetup()と同じ)
+    def setup(self, osrs_t=1, osrs_p=3, osrs_h=0, mode=3, t_sb=0, filter=4, spi3w_en=0):
+        self.i2c.writeReg8(self.fd, 0xF2, osrs_h)
+        self.i2c.writeReg8(self.fd, 0xF4, (osrs_t << 5) | (osrs_p << 2) | mode)
+        self.i2c.writeReg8(self.fd, 0xF5, (t_sb << 5) | (filter << 2) | spi3w_en)
+
+    # 生データ(pres_raw, temp_raw, hum_raw)を1回のトランザクションで取得
+    def readRaw(self):
+        d = self.i2c.readBlock(self.fd, 0xF7, 8)
+        pres_raw = (d[0] << 12) | (d[1] << 4) | (d[2] >> 4)
+        temp_raw = (d[3] << 12) | (d[4] << 4) | (d[5] >> 4)
+        hum_raw = (d[6] << 8) | d[7]
+        return pres_raw, temp_raw, hum_raw
+
+    # 最初の変換が終わってデータレジスタにリセット値でない値が入るまで待つ
+    # (ノーマルモードのt_sb=0.5msではSTATUSのmeasuringはほとんど立ったままなので、データの方を見る)
+    # timeout秒たっても入らなければIOError
+    def waitReady(self, timeout=0.1):
+        end = time.monotonic() + timeout
+        while True:
+            pres_raw, temp_raw, _hum_raw = self.readRaw()
+            if pres_raw != RAW_SKIPPED and temp_raw != RAW_SKIPPED:
+                return
+            if time.monotonic() > end:
+                raise IOError('BME280 conversion timeout')
+            time.sleep(0.001)
+
+    # read()と同じ 気圧か温度の生データがリセット値(0x80000)ならNone
+    def readValid(self):
+        pres_raw, temp_raw, hum_raw = self.readRaw()
+        if pres_raw == RAW_SKIPPED or temp_raw == RAW_SKIPPED:
+            return None
+        c = self.calib
+        temp, t_fine = compensate_T(c, temp_raw)
+        return temp, compensate_P(c, pres_raw, t_fine), compensate_H(c, hum_raw, t_fine)
+
+    # 温度[℃], 気圧[hPa], 湿度[%]を取得
+    def read(self):
+        pres_raw, temp_raw, hum_raw = self.readRaw()
+        c = self.calib
+        temp, t_fine = compensate_T(c, temp_raw)
+        return temp, compensate_P(c, pres_raw, t_fine), compensate_H(c, hum_raw, t_fine)
+
+
+# 1サンプルあたりの時間[us]を計測する
+# 旧方式(0xF7~0xFEを1バイトずつ8回読み出し)と新方式(ブロック読み出し)を比較する
+def benchmark(bme, count=1000):
+    i2c = bme.i2c
+    fd = bme.fd
+
+    start = time.perf_counter()
+    for _i in range(count):
+        data = []
+        for reg in range(0xF7, 0xFF):
+            data.append(i2c.readReg8(fd, reg))
+    old_us = (time.perf_counter() - start) / count * 1e6
+
+    start = time.perf_counter()
+    for _i in range(count):
+        bme.readRaw()
+    raw_us = (time.perf_counter() - start) / count * 1e6
+
+    start = time.perf_counter()
+    for _i in range(count):
+        bme.read()
+    new_us = (time.perf_counter() - start) / count * 1e6
+    return old_us, raw_us, new_us
+
+
+# データシートの例に近いキャリブレーション値(実機なしの確認用)
+# SAMPLE_CALIB_REGSはレジスタ(0x88~0x9F, 0xA1, 0xE1~0xE7)の中身(wpi3_simulator.pyでも使う)
+SAMPLE_CALIB_REGS = (
+    struct.pack('<HhhHhhhhhhhh', 27504, 26435, -1000, 36477, -10685, 3024, 2855, 140, -7, 15500, -14600, 6000),
+    bytes([75]), bytes([0x6A, 0x01, 0x00, 0x13, 0x2A, 0x03, 0x1E]))
+SAMPLE_CALIB = decode_calib(*SAMPLE_CALIB_REGS)
+
+
+# count個の生データを1サンプルずつ補正した場合とcompensate_batch()の時間[s]を比べる
+# 戻り値は(1サンプルずつ[s], まとめて[s], 一致しなかったサンプル数)
+def benchmark_batch(c=SAMPLE_CALIB, count=1000000):
+    rng = np.random.RandomState(0)
+    adc_T = rng.randint(400000, 600000, count)
+    adc_P = rng.randint(250000, 450000, count)
+    adc_H = rng.randint(20000, 40000, count)
+
+    start = time.perf_counter()
+    scalar = []
+    for t_raw, p_raw, h_raw in zip(adc_T.tolist(), adc_P.tolist(), adc_H.tolist()):
+        temp, t_fine = compensate_T(c, t_raw)
+        scalar.append((temp, compensate_P(c, p_raw, t_fine), compensate_H(c, h_raw, t_fine)))
+    scalar_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    temp, press, humi = compensate_batch(c, adc_T, adc_P, adc_H)
+    batch_s = time.perf_counter() - start
+
+    expected = np.array(scalar, dtype=np.float64)
+    mismatch = np.count_nonzero((expected[:, 0] != temp) | (expected[:, 1] != press) | (expected[:, 2] != humi))
+    return scalar_s, batch_s, mismatch
+
+
+if __name__ == '__main__' and sys.argv[1:] == ['batch']:
+    count = 1000000
+    scalar_s, batch_s, mismatch = benchmark_batch(count=count)
+    print("scalar : %8.3f s (%6.2f us/sample)" % (scalar_s, scalar_s / count * 1e6))
+    print("batch  : %8.3f s (%6.3f us/sample)" % (batch_s, batch_s / count * 1e6))
+    print("mismatch: %d / %d" % (mismatch, count))
+elif __name__ == '__main__':
+    from wpi3_i2c import I2C
+    import wiringpi as wi
+
+    wi.wiringPiSetup()  # wiringPiの初期化
+    i2c = I2C()
+    bme = BME280(i2c, i2c.setup(0x76))
+    bme.setup()
+    old_us, raw_us, new_us = benchmark(bme)
+    print("read 1byte x8     : %8.1f us/sample" % old_us)
+    print("block read        : %8.1f us/sample" % raw_us)
+    print("block read+補正   : %8.1f us/sample" % new_us)
+    print("T=%6.2f H=%6.2f P=%7.2f" % bme.read())
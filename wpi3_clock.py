@@ -0,0 +1,87 @@
+#!/usr/bin/python3 -u
+# -*- coding: utf-8 -*-
+
+############################################################
+# Written by pond-e
+#
+# Environment:  Python 3.4.2
+#               OS: Raspi OS
+#               on Raspberry Pi Zero W
+#
+# サンプルに付ける時刻
+# ・毎回datetime.now()とtime.time()を呼んで文字列にするのをやめ、
+#   time.monotonic_ns()の整数[ns]だけをI2Cの読み出しの直前に取る
+#   (NTPで時計が飛んでも順番が入れ替わらない)
+# ・実際の時刻は記録の開始時に1回だけ(monotonic_ns, time.time())の組を
+#   アンカーとしてヘッダに書き、後処理で換算する
+#
+# 1サンプルあたりの時刻取得にかかる時間の比較
+# pi@raspberrypi ~ $ python3 wpi3_clock.py
+############################################################
+
+import datetime
+import time
+
+# Python 3.7より前はmonotonic_nsがないのでmonotonicから作る
+if hasattr(time, 'monotonic_ns'):
+    monotonic_ns = time.monotonic_ns
+else:
+    def monotonic_ns():
+        return int(time.monotonic() * 1000000000)
+
+# 処理時間の計測用(同じくPython 3.7より前はperf_counterから作る)
+if hasattr(time, 'perf_counter_ns'):
+    perf_counter_ns = time.perf_counter_ns
+else:
+    def perf_counter_ns():
+        return int(time.perf_counter() * 1000000000)
+
+
+# monotonic_nsとUNIX時間の対応を1組取る
+# 2回のmonotonic_nsの間にtime.time()を挟み、間隔が一番短かった組の中点を使う
+def clock_anchor(tries=5):
+    best = None
+    for _i in range(tries):
+        t0 = monotonic_ns()
+        unix = time.time()
+        t1 = monotonic_ns()
+        if best is None or t1 - t0 < best[0]:
+            best = (t1 - t0, (t0 + t1) // 2, unix)
+    return {'anchor_ns': best[1], 'anchor_unix': best[2]}
+
+
+# アンカーを使ってmonotonic_nsの時刻をUNIX時間[s]にする
+def to_unix(anchor, t_ns):
+    return anchor['anchor_unix'] + (t_ns - anchor['anchor_ns']) / 1e9
+
+
+# アンカーを使ってmonotonic_nsの時刻をdatetimeにする
+def to_datetime(anchor, t_ns):
+    return datetime.datetime.fromtimestamp(to_unix(anchor, t_ns))
+
+
+# 従来の時刻の付け方(datetime.now() + time.time() + 文字列にする)と
+# monotonic_ns()だけの場合の1サンプルあたりの時間[us]を測る
+def benchmark(count=100000):
+    now = datetime.datetime.now
+    wall = time.time
+    start = time.perf_counter()
+    for _i in range(count):
+        date = now()
+        t = wall()
+        "%s" % date
+    old_us = (time.perf_counter() - start) / count * 1e6
+
+    mono = monotonic_ns
+    start = time.perf_counter()
+    for _i in range(count):
+        t = mono()
+    new_us = (time.perf_counter() - start) / count * 1e6
+    return old_us, new_us
+
+
+if __name__ == '__main__':
+    old_us, new_us = benchmark()
+    print("datetime.now()+time.time()+%%s: %6.2f us/sample" % old_us)
+    print("monotonic_ns():                 %6.2f us/sample" % new_us)
+    print("saved:                          %6.2f us/sample" % (old_us - new_us))
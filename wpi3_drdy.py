@@ -0,0 +1,218 @@
+#!/usr/bin/python3 -u
+# -*- coding: utf-8 -*-
+
+############################################################
+# Written by pond-e
+#
+# Environment:  Python 3.4.2
+#               OS: Raspi OS
+#               on Raspberry Pi Zero W
+# Used sensor: MPU-9250(Strawberry Linux)
+#
+# MPU-9250のINTピン(データレディ割り込み)を待ってからデータを読み出す
+# sleepで周期を作る代わりに、新しいデータができた瞬間に読み出すので
+# 同じデータを2回読んだり、古いデータを読んだりしない。
+#
+# ・INTピンをRaspberry PiのGPIOにつなぐ(下のINT_PINはBCM番号)
+# ・AK8963のDRDYピンはMPU-9250のパッケージの外に出ていないので、
+#   磁気はIMUの割り込みのたびにST1を1回だけ見て、データがあれば読む
+#   (time.sleep(0.01)で待たない)
+# ・BME280にはデータレディのピンがないので、ここでは扱わない
+#
+# GPIOのエッジはEdgeSourceを差し替えられるようにしてあり、
+# 実機ではSysfsEdgeSource、実機なしの確認ではFakeEdgeSourceを使う
+#
+# 起動方法
+# pi@raspberrypi ~ $ sudo python3 wpi3_drdy.py
+############################################################
+
+import os
+import select
+import struct
+import threading
+import time
+
+from wpi3_clock import monotonic_ns
+
+INT_PIN = 17  # MPU-9250のINTをつないだGPIO(BCM番号)
+
+# MPU-9250のレジスタ
+REG_INT_PIN_CFG = 0x37
+REG_INT_ENABLE = 0x38
+REG_INT_STATUS = 0x3A
+REG_ACCEL_XOUT_H = 0x3B
+INT_PIN_CFG_LATCH_INT_EN = 0x20  # 割り込みを読み出すまで保持する
+INT_PIN_CFG_INT_ANYRD_2CLEAR = 0x10  # どのレジスタを読んでも割り込みを解除する
+INT_PIN_CFG_BYPASS_EN = 0x02  # AK8963へ直接アクセスする
+INT_ENABLE_RAW_RDY_EN = 0x01
+INT_STATUS_RAW_DATA_RDY = 0x01
+
+# AK8963のレジスタ
+AK8963_ST1 = 0x02
+AK8963_HXL = 0x03  # HXL~HZH, ST2の7バイト
+AK8963_ST1_DRDY = 0x01
+AK8963_ST2_HOFL = 0x08
+
+
+# sysfsのGPIOで立ち上がりエッジを待つ
+class SysfsEdgeSource(object):
+    def __init__(self, pin, edge='rising'):
+        self.pin = pin
+        path = '/sys/class/gpio/gpio%d' % pin
+        if not os.path.exists(path):
+            with open('/sys/class/gpio/export', 'w') as f:
+                f.write(str(pin))
+            time.sleep(0.1)  # udevがパーミッションを設定するのを待つ
+        with open(path + '/direction', 'w') as f:
+            f.write('in')
+        with open(path + '/edge', 'w') as f:
+            f.write(edge)
+        self.fd = os.open(path + '/value', os.O_RDONLY | os.O_NONBLOCK)
+        self.poller = select.poll()
+        self.poller.register(self.fd, select.POLLPRI | select.POLLERR)
+        self._clear()
+
+    # valueを読んでエッジの通知を解除する
+    def _clear(self):
+        os.lseek(self.fd, 0, os.SEEK_SET)
+        os.read(self.fd, 2)
+
+    # エッジが来るまで最大timeout[s]待つ 来たらTrue
+    def wait(self, timeout=None):
+        events = self.poller.poll(None if timeout is None else timeout * 1000)
+        if not events:
+            return False
+        self._clear()
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+
+# 実機なしで動作を確認するためのエッジ
+# trigger()を呼ぶとwait()が1回戻る
+class FakeEdgeSource(object):
+    def __init__(self):
+        self._sem = threading.Semaphore(0)
+        self.count = 0
+
+    def trigger(self):
+        self.count += 1
+        self._sem.release()
+
+    # 一定間隔でtrigger()を呼ぶスレッドを起動する
+    def start_clock(self, rate):
+        def run():
+            period = 1.0 / rate
+            next_time = time.monotonic()
+            while not self._stop.is_set():
+                next_time += period
+                self.trigger()
+                time.sleep(max(0.0, next_time - time.monotonic()))
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+
+    def wait(self, timeout=None):
+        return self._sem.acquire(timeout=timeout)
+
+    def close(self):
+        if hasattr(self, '_stop'):
+            self._stop.set()
+
+
+class DataReadyAcquisition(object):
+    # i2c: wpi3_i2c.I2C, mpu_fd/ak_fd: i2c.setup()の戻り値
+    # edge: SysfsEdgeSourceまたはFakeEdgeSource
+    # ak_fdがNoneなら磁気は読まない
+    def __init__(self, i2c, mpu_fd, ak_fd, edge, accelCoefficient=8 / float(0x8000),
+                 gyroCoefficient=1000 / float(0x8000), magCoefficient=4912 / 32760.0, timeout=0.1):
+        self.i2c = i2c
+        self.mpu_fd = mpu_fd
+        self.ak_fd = ak_fd
+        self.edge = edge
+        self.accelCoefficient = accelCoefficient
+        self.gyroCoefficient = gyroCoefficient
+        self.magCoefficient = magCoefficient
+        self.timeout = timeout
+        self.timeouts = 0  # timeout秒以上割り込みが来なかった回数
+        self.magOverflows = 0  # 磁気センサのオーバーフローの回数
+
+    # データレディ割り込みを有効にする
+    # BYPASS_ENはそのままにしてAK8963へ直接アクセスできるようにしておく
+    def enable(self):
+        self.i2c.writeReg8(self.mpu_fd, REG_INT_PIN_CFG,
+                           INT_PIN_CFG_LATCH_INT_EN | INT_PIN_CFG_INT_ANYRD_2CLEAR | INT_PIN_CFG_BYPASS_EN)
+        self.i2c.writeReg8(self.mpu_fd, REG_INT_ENABLE, INT_ENABLE_RAW_RDY_EN)
+
+    def disable(self):
+        self.i2c.writeReg8(self.mpu_fd, REG_INT_ENABLE, 0x00)
+        self.i2c.writeReg8(self.mpu_fd, REG_INT_PIN_CFG, INT_PIN_CFG_BYPASS_EN)
+
+    # 磁気データができていれば(x, y, z)[uT]、まだならNoneを返す
+    # ST1を1回見るだけで待たない
+    def readMag(self):
+        if not self.i2c.readReg8(self.ak_fd, AK8963_ST1) & AK8963_ST1_DRDY:
+            return None
+        data = self.i2c.readBlock(self.ak_fd, AK8963_HXL, 7)  # ST2まで読むと次の測定に進む
+        x, y, z, st2 = struct.unpack('<3hB', data)
+        if st2 & AK8963_ST2_HOFL:
+            self.magOverflows += 1
+            return None
+        c = self.magCoefficient
+        return x * c, y * c, z * c
+
+    # 割り込みのたびに(時刻(monotonic_ns), 加速度(x,y,z)[g], 温度[℃], ジャイロ(x,y,z)[dps], 磁気(x,y,z)[uT]またはNone)を返す
+    def samples(self):
+        wait = self.edge.wait
+        readBlock = self.i2c.readBlock
+        ac = self.accelCoefficient
+        gc = self.gyroCoefficient
+        while True:
+            if not wait(self.timeout):
+                self.timeouts += 1
+                # エッジを取りこぼすと、ラッチされたINTが立ったままになって次のエッジが来ない
+                # INT_STATUSを読んでラッチを解除する(データができていればそのまま読む)
+                if not self.i2c.readReg8(self.mpu_fd, REG_INT_STATUS) & INT_STATUS_RAW_DATA_RDY:
+                    continue
+            t = monotonic_ns()
+            ax, ay, az, temp, gx, gy, gz = struct.unpack('>7h', readBlock(self.mpu_fd, REG_ACCEL_XOUT_H, 14))
+            mag = self.readMag() if self.ak_fd is not None else None
+            yield t, (ac * ax, ac * ay, ac * az), temp / 333.87 + 21.0, (gc * gx, gc * gy, gc * gz), mag
+
+
+if __name__ == '__main__':
+    import datetime
+    import wiringpi as wi
+    from wpi3_i2c import I2C
+    from wpi3_clock import clock_anchor
+
+    wi.wiringPiSetup()  # wiringPiの初期化
+    i2c = I2C()
+    mpu9250 = i2c.setup(0x68)
+    AK8963 = i2c.setup(0x0C)
+    i2c.writeReg8(mpu9250, 0x6B, 0x00)  # PWR_MGMT_1をクリア
+    time.sleep(0.1)
+    i2c.writeReg8(mpu9250, 0x19, 9)  # SMPLRT_DIV 1000/(1+9)=100Hz
+    i2c.writeReg8(mpu9250, 0x1A, 0x01)  # DLPF_CFG=1
+    i2c.writeReg8(mpu9250, 0x1B, 0x10)  # 1000dps
+    i2c.writeReg8(mpu9250, 0x1C, 0x10)  # 8g
+    acq = DataReadyAcquisition(i2c, mpu9250, AK8963, SysfsEdgeSource(INT_PIN))
+    acq.enable()
+    i2c.writeReg8(AK8963, 0x0A, 0x16)  # 100Hz連続測定モード, 16bit
+
+    mag = (0.0, 0.0, 0.0)
+    now = datetime.datetime.now()
+    fmt_name = "/home/pi/data/mpu9250drdy_logs_{0:%Y%m%d-%H%M%S}.csv".format(now)
+    with open(fmt_name, 'w') as f:
+        f.write("# anchor_ns=%(anchor_ns)d,anchor_unix=%(anchor_unix).6f\n" % clock_anchor())
+        f.write("t[ns],x[g],y[g],z[g],x[dps],y[dps],z[dps],x[uT],y[uT],z[uT]\n")  # header行をファイル出力
+        try:
+            for t, acc, temp, gyr, m in acq.samples():
+                if m is not None:
+                    mag = m  # 新しい磁気データがなければ前の値を使う
+                f.write("%d,%6.3f,%6.3f,%6.3f,%6.3f,%6.3f,%6.3f,%6.3f,%6.3f,%6.3f\n" % (
+                    t, acc[0], acc[1], acc[2], gyr[0], gyr[1], gyr[2], mag[0], mag[1], mag[2]))
+        except KeyboardInterrupt:
+            pass
+    acq.disable()
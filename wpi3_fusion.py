@@ -0,0 +1,187 @@
+#!/usr/bin/python3 -u
+# -*- coding: utf-8 -*-
+
+############################################################
+# Written by pond-e
+#
+# Environment:  Python 3.4.2
+#               OS: Raspi OS
+#               on Raspberry Pi Zero W
+#
+# GPS、IMU、気圧のデータを1つの時間軸(GPSのUTC)にそろえて1つのレコードにする
+# ・ClockSyncはmonotonic_ns()とGPSのUTCのずれを、ZDA/RMCが届いた時刻から推定する
+#   センテンスは測位の時刻より必ず遅れて届くので、ずれの最大値(一番遅れが小さいもの)を使う
+# ・FusionはIMUのサンプルを次のGPSの測位が届くまでためておき、
+#   前後2つの測位の位置を線形補間して各サンプルに付ける
+#   気圧は最後に読んだ値をそのまま付ける
+#
+# 後処理でdatagga_*.csvとcs17_wpi3_2sensors_logs_*.csvを突き合わせる代わりに、
+# 飛行中にそろったレコードを作る
+#
+# 起動方法
+# pi@raspberrypi ~ $ sudo python3 wpi3_fusion.py
+############################################################
+
+import calendar
+import collections
+import time
+from collections import namedtuple
+
+from wpi3_nmea import GGA, RMC, ZDA
+
+# utc: UNIX時間[s](GPSのUTC), mono: monotonic_ns()[ns]
+FusedRecord = namedtuple('FusedRecord', ['utc', 'mono', 'acc', 'gyr', 'mag', 'temp', 'press', 'lat', 'lon', 'alt'])
+
+
+class ClockSync(object):
+    # window: ずれの推定に使う直近の観測数
+    def __init__(self, window=32):
+        self.samples = collections.deque(maxlen=window)
+        self.offset = None  # UTC - monotonic [s]
+
+    # GPSの時刻utc(UNIX時間[s])のセンテンスがmono(monotonic_ns)に届いた
+    def observe(self, mono, utc):
+        self.samples.append(utc - mono * 1e-9)
+        self.offset = max(self.samples)
+
+    def ready(self):
+        return self.offset is not None
+
+    # monotonic_nsの時刻をUTC(UNIX時間[s])にする
+    def to_utc(self, mono):
+        return mono * 1e-9 + self.offset
+
+
+class Fusion(object):
+    # emit: FusedRecordを受け取る関数
+    # max_pending: GPSの測位が来ないときにためておくIMUサンプルの最大数
+    #              (超えたら位置なしで出力する)
+    def __init__(self, emit, clock=None, max_pending=2000):
+        self.emit = emit
+        self.clock = clock if clock is not None else ClockSync()
+        self.max_pending = max_pending
+        self.pending = collections.deque()  # 位置を付ける前のIMUサンプル
+        self.prev_fix = None  # (utc, lat, lon, alt)
+        self.last_fix = None
+        self.date = None  # ZDA/RMCから得たUTCの日付の0時(UNIX時間[s])
+        self.baro = (None, None)  # (温度, 気圧)
+
+    # GPSのセンテンス(wpi3_nmeaのnamedtuple)と、それが届いたmonotonic_nsの時刻
+    def gps(self, msg, mono):
+        if isinstance(msg, ZDA):
+            if msg.utc is not None:
+                utc = calendar.timegm(msg.utc.timetuple()) + msg.utc.microsecond / 1e6
+                self.date = utc - msg.time
+                self.clock.observe(mono, utc)
+        elif isinstance(msg, RMC):
+            if msg.date is not None and msg.time is not None:
+                self.date = float(calendar.timegm(msg.date.timetuple()))
+                self.clock.observe(mono, self.date + msg.time)
+        elif isinstance(msg, GGA):
+            if self.date is None or msg.time is None or msg.lat is None:
+                return
+            utc = self.date + msg.time
+            if self.last_fix is not None and utc < self.last_fix[0] - 43200:
+                utc += 86400  # 日付が変わった
+            self.prev_fix = self.last_fix
+            self.last_fix = (utc, msg.lat, msg.lon, msg.altitude)
+            self._release()
+
+    # 気圧センサの値
+    def baro_sample(self, temp, press):
+        self.baro = (temp, press)
+
+    # IMUのサンプル
+    def imu(self, mono, acc, gyr, mag=None):
+        self.pending.append((mono, acc, gyr, mag) + self.baro)
+        if len(self.pending) > self.max_pending:
+            mono, acc, gyr, mag, temp, press = self.pending.popleft()
+            utc = self.clock.to_utc(mono) if self.clock.ready() else None
+            self.emit(FusedRecord(utc, mono, acc, gyr, mag, temp, press, None, None, None))
+
+    # 最新の測位より前のサンプルに位置を補間して出力する
+    def _release(self):
+        if not self.clock.ready():
+            return
+        to_utc = self.clock.to_utc
+        pending = self.pending
+        fix_utc, lat1, lon1, alt1 = self.last_fix
+        prev = self.prev_fix
+        while pending:
+            utc = to_utc(pending[0][0])
+            if utc > fix_utc:
+                break
+            mono, acc, gyr, mag, temp, press = pending.popleft()
+            if prev is None or utc <= prev[0]:
+                lat, lon, alt = (prev or self.last_fix)[1:]
+            else:
+                r = (utc - prev[0]) / (fix_utc - prev[0])
+                lat = prev[1] + (lat1 - prev[1]) * r
+                lon = prev[2] + (lon1 - prev[2]) * r
+                alt = None if alt1 is None or prev[3] is None else prev[3] + (alt1 - prev[3]) * r
+            self.emit(FusedRecord(utc, mono, acc, gyr, mag, temp, press, lat, lon, alt))
+
+    # 残っているサンプルを最後の位置で出力する
+    def flush(self):
+        fix = self.last_fix
+        while self.pending:
+            mono, acc, gyr, mag, temp, press = self.pending.popleft()
+            utc = self.clock.to_utc(mono) if self.clock.ready() else None
+            lat, lon, alt = fix[1:] if fix is not None else (None, None, None)
+            self.emit(FusedRecord(utc, mono, acc, gyr, mag, temp, press, lat, lon, alt))
+
+
+if __name__ == '__main__':
+    import datetime
+    import struct
+    import wiringpi as wi
+    from wpi3_i2c import shared_bus
+    from wpi3_bme280_driver import BME280
+    from wpi3_gps_receiver import GPSReceiver
+    from wpi3_async import AsyncRuntime
+
+    wi.wiringPiSetup()  # wiringPiの初期化
+    i2c = shared_bus()
+    mpu9250 = i2c.setup(0x68)
+    i2c.writeReg8(mpu9250, 0x6B, 0x00)  # PWR_MGMT_1をクリア
+    time.sleep(0.1)
+    i2c.writeReg8(mpu9250, 0x1B, 0x10)  # 1000dps
+    i2c.writeReg8(mpu9250, 0x1C, 0x10)  # 8g
+    bme = BME280(i2c, i2c.setup(0x76))
+    bme.setup()
+    gps = GPSReceiver()
+    gps.configure(baudrate=115200, rate=10)
+
+    now = datetime.datetime.now()
+    fmt_name = "/home/pi/data/fusion_logs_{0:%Y%m%d-%H%M%S}.csv".format(now)
+    f = open(fmt_name, 'w')
+    f.write('utc,mono,ax,ay,az,gx,gy,gz,temp,press,lat,lon,alt\n')
+
+    def emit(r):
+        f.write("%.6f,%d,%d,%d,%d,%d,%d,%d,%s,%s,%s,%s,%s\n" % (
+            r.utc if r.utc is not None else 0, r.mono, r.acc[0], r.acc[1], r.acc[2],
+            r.gyr[0], r.gyr[1], r.gyr[2], r.temp, r.press, r.lat, r.lon, r.alt))
+
+    fusion = Fusion(emit)
+
+    def consumer(name, t, data):
+        if name == 'imu':
+            fusion.imu(t, data[0:3], data[4:7])
+        elif name == 'baro':
+            fusion.baro_sample(data[0], data[1])
+        else:
+            fusion.gps(data, t)
+
+    runtime = AsyncRuntime(consumer)
+    runtime.add_poll('imu', 200, lambda: struct.unpack('>7h', i2c.readBlock(mpu9250, 0x3B, 14)))
+    runtime.add_poll('baro', 25, bme.read)
+    runtime.add_gps(gps)
+    try:
+        runtime.run()
+    except KeyboardInterrupt:
+        pass
+    fusion.flush()
+    runtime.print_report()
+    print("offset=%s" % fusion.clock.offset)
+    runtime.close()
+    f.close()
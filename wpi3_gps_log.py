@@ -0,0 +1,114 @@
+#!/usr/bin/python3 -u
+# -*- coding: utf-8 -*-
+
+############################################################
+# Written by pond-e
+#
+# Environment:  Python 3.4.2
+#               OS: Raspi OS
+#               on Raspberry Pi Zero W
+# Used sensor: AE-GYSFDMAXB(GPS)
+#
+# GPSのデータをCSVへ書き出す
+# ・ファイルは開いたままにして、センテンスごとにopen/closeしない
+# ・GSVは1周期分(全センテンス、1センテンス4衛星すべて)をためてから
+#   衛星の表としてまとめて書き出す(時刻はその測位のZDAの時刻)
+# ・ZDA(1回の測位の最後のセンテンス)でGGAの行を書き出し、
+#   flush_interval秒ごと(0なら測位ごと)にファイルをflushする
+#
+# wpi3_nmea.NMEAParserが返すnamedtupleをhandle()に渡して使う
+############################################################
+
+import time
+
+from wpi3_nmea import GGA, GSV, ZDA
+
+GGA_HEADER = 'yyyy-mm-dd HH:MM:SS.ffffff ,a number of satellites ,high ,latitude ,longitude \n'
+GSV_HEADER = 'yyyy-mm-dd HH:MM:SS.ffffff ,talker ,No. ,Elevation in degrees ,degrees in true north ,SNR \n'
+
+
+class GPSLogSink(object):
+    # gga_path: 位置のCSV, gsv_path: 衛星の表のCSV
+    # flush_interval: この秒数ごとにflushする(0なら測位ごと)
+    def __init__(self, gga_path, gsv_path, flush_interval=1.0, echo=False):
+        self.f_gga = open(gga_path, 'w')
+        self.f_gsv = open(gsv_path, 'w')
+        self.f_gga.write(GGA_HEADER)
+        self.f_gsv.write(GSV_HEADER)
+        self.flush_interval = flush_interval
+        self.echo = echo  # Trueなら位置の行を標準出力する
+        self.alt_lat_long = '0,0,0'  # 最後に受信した高度、緯度、経度
+        self.num_sat = '0'  # 最後に受信した衛星の個数
+        self.utc = None  # 最後に受信したZDAの時刻
+        self.satellites = {}  # トーカーごとに集めている途中のGSV
+        self.cycle = []  # この測位で集め終わった衛星 (トーカー, Satellite)
+        self.tables = []  # 書き出し待ちの衛星の表の行
+        self.last_flush = time.monotonic()
+        self.epochs = 0  # 書き出した測位の数
+        self.gsv_cycles = 0  # 書き出したGSVの周期の数
+        self.gsv_broken = 0  # 途中のセンテンスが抜けて捨てたGSVの周期の数
+
+    def handle(self, msg):
+        if isinstance(msg, GSV):
+            self._gsv(msg)
+        elif isinstance(msg, GGA):
+            if msg.lat is not None and msg.altitude is not None:
+                self.alt_lat_long = "%3.2f,%5.6f,%5.6f" % (msg.altitude, msg.lat, msg.lon)
+            else:
+                self.alt_lat_long = '0,0,0'
+        elif isinstance(msg, ZDA):
+            self.utc = msg.utc
+            self._epoch()
+
+    # GSVを集めて、最後のセンテンスが来たら1周期分を表にする
+    def _gsv(self, msg):
+        sats = self.satellites.get(msg.talker)
+        if msg.msg_num == 1:
+            sats = []
+            self.num_sat = str(msg.num_sats or 0)
+        elif sats is None or len(sats) != (msg.msg_num - 1) * 4:
+            # 前のセンテンスが抜けている
+            self.satellites.pop(msg.talker, None)
+            self.gsv_broken += 1
+            return
+        sats.extend(msg.sats)
+        if msg.msg_num < msg.num_msgs:
+            self.satellites[msg.talker] = sats
+            return
+        self.satellites.pop(msg.talker, None)
+        talker = msg.talker
+        self.cycle.extend((talker, s) for s in sats)
+        self.gsv_cycles += 1
+
+    # 1回の測位の終わり 衛星の表にもこの測位の時刻を付ける
+    def _epoch(self):
+        utc = self.utc
+        for talker, s in self.cycle:
+            self.tables.append('%s,%s,%d,%s,%s,%s\n' % (
+                utc, talker, s.prn, _str(s.elevation), _str(s.azimuth), _str(s.snr)))
+        self.cycle = []
+        line = "%s,%s,%s\n" % (self.utc, self.num_sat, self.alt_lat_long)
+        self.f_gga.write(line)
+        if self.echo:
+            print(line, end='')
+        self.epochs += 1
+        now = time.monotonic()
+        if now - self.last_flush >= self.flush_interval:
+            self.flush()
+            self.last_flush = now
+
+    def flush(self):
+        if self.tables:
+            self.f_gsv.write(''.join(self.tables))
+            self.tables = []
+        self.f_gsv.flush()
+        self.f_gga.flush()
+
+    def close(self):
+        self.flush()
+        self.f_gga.close()
+        self.f_gsv.close()
+
+
+def _str(x):
+    return '' if x is None else str(x)
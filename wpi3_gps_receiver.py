@@ -0,0 +1,219 @@
+#!/usr/bin/python3 -u
+# -*- coding: utf-8 -*-
+
+############################################################
+# Written by pond-e
+#
+# Environment:  Python 3.4.2
+#               OS: Raspi OS
+#               on Raspberry Pi Zero W
+# Used sensor: AE-GYSFDMAXB(GPS)
+#
+# AE-GYSFDMAXB(MediaTek MT3333)の設定をPMTKコマンドで変更して読み出す
+# ・PMTK314で使わないセンテンスを止めて帯域を空ける
+# ・PMTK251でボーレートを上げる(9600bpsでは1秒に1組しか送れない)
+# ・PMTK220で測位の周期を短くする(最大10Hz)
+# ・シリアルはtimeout=0で開き、届いている分をまとめて読む
+#   (何も来なくてもselectのtimeoutで戻るので、スレッドが止まったままにならない)
+#
+# 実機なしで確認するときはFakeReceiverで疑似端末(pty)にNMEAを流す
+#    fake = FakeReceiver(); fake.start()
+#    gps = GPSReceiver(fake.port)
+#
+# 起動方法
+# pi@raspberrypi ~ $ sudo python3 wpi3_gps_receiver.py
+############################################################
+
+import datetime
+import os
+import select
+import serial
+import threading
+import time
+import tty
+
+from wpi3_nmea import NMEAParser, PMTKAck, format_degree, make_sentence
+
+PORT = "/dev/ttyAMA0"
+DEFAULT_BAUDRATE = 9600  # 電源投入時のボーレート
+
+# PMTK314で出力を選べるセンテンス (フィールドの位置)
+PMTK314_FIELDS = {'GLL': 0, 'RMC': 1, 'VTG': 2, 'GGA': 3, 'GSA': 4, 'GSV': 5, 'ZDA': 17, 'MCHN': 18}
+
+
+# PMTK314のコマンド本体を作る
+# sentences: {'GGA': 1, 'GSV': 5}のように 何回の測位ごとに出力するか
+def pmtk314(sentences):
+    fields = [0] * 19
+    for name, every in sentences.items():
+        fields[PMTK314_FIELDS[name]] = every
+    return 'PMTK314,' + ','.join(str(x) for x in fields)
+
+
+class GPSReceiver(object):
+    def __init__(self, port=PORT, baudrate=DEFAULT_BAUDRATE):
+        self.port = port
+        self.parser = NMEAParser()
+        self.ser = None
+        self.open(baudrate)
+
+    def open(self, baudrate):
+        if self.ser is not None:
+            self.ser.close()
+        self.ser = serial.Serial(
+            port=self.port,
+            baudrate=baudrate,
+            parity=serial.PARITY_NONE,
+            bytesize=serial.EIGHTBITS,
+            stopbits=serial.STOPBITS_ONE,
+            timeout=0,  # ブロックしない
+            xonxoff=0,
+            rtscts=0,
+        )
+        self.baudrate = baudrate
+
+    def close(self):
+        self.ser.close()
+
+    # 届いている分をまとめて読み、解析できたセンテンスのリストを返す
+    # timeout秒待っても何も届かなければ空のリスト
+    def read(self, timeout=1.0):
+        ser = self.ser
+        n = ser.in_waiting
+        if n == 0:
+            r, _w, _x = select.select([ser.fileno()], [], [], timeout)
+            if not r:
+                return []
+            n = max(1, ser.in_waiting)
+        return self.parser.feed(ser.read(n))
+
+    # 受信したセンテンスを1つずつ返す
+    def messages(self, timeout=1.0):
+        while True:
+            for msg in self.read(timeout):
+                yield msg
+
+    # PMTKコマンドを送り、PMTK001の応答を待つ 成功ならTrue
+    # 応答を待つ間に届いた他のセンテンスは捨てる
+    def command(self, body, timeout=1.0):
+        self.ser.write(make_sentence(body))
+        number = int(body.split(',')[0][4:])
+        end = time.monotonic() + timeout
+        while time.monotonic() < end:
+            for msg in self.read(max(0.0, end - time.monotonic())):  # selectに負の値を渡さない
+                if isinstance(msg, PMTKAck) and msg.command == number:
+                    return msg.flag == 3
+        return False
+
+    # 出力するセンテンス、ボーレート、測位周期を設定する
+    # 先にセンテンスを減らしておかないと、ボーレートを上げる前に周期を上げたとき送りきれない
+    def configure(self, baudrate=115200, rate=10, sentences=None):
+        if sentences is None:
+            sentences = {'RMC': 1, 'GGA': 1, 'GSA': 1, 'GSV': rate, 'ZDA': 1}
+        ok = self.command(pmtk314(sentences))
+        if baudrate != self.baudrate:
+            # ボーレートの変更には応答がないので、送り終わってから開き直す
+            self.ser.write(make_sentence('PMTK251,%d' % baudrate))
+            self.ser.flush()
+            time.sleep(0.1)
+            self.open(baudrate)
+        ok = self.command('PMTK220,%d' % int(1000 / rate)) and ok
+        return ok
+
+
+# 疑似端末にNMEAを流す実機なしの受信機
+# PMTK220, PMTK251, PMTK314を受け付けてPMTK001で応答する
+class FakeReceiver(object):
+    def __init__(self, rate=1):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)  # エコーを止める(送ったセンテンスがコマンドとして戻ってこないように)
+        self.port = os.ttyname(self.slave)
+        self.rate = rate
+        self.enabled = {'GGA': 1, 'GSA': 1, 'GSV': 1, 'RMC': 1, 'VTG': 1, 'ZDA': 1}
+        self.commands = []  # 受け取ったコマンド
+        self.sent = 0  # 送ったセンテンス数
+        self._running = False
+        self._rx = b''
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+    def _send(self, body):
+        os.write(self.master, make_sentence(body))
+        self.sent += 1
+
+    def _handle(self, body):
+        fields = body.split(',')
+        self.commands.append(body)
+        if fields[0] == 'PMTK220':
+            self.rate = 1000.0 / int(fields[1])
+        elif fields[0] == 'PMTK314':
+            values = [int(x) for x in fields[1:]]
+            self.enabled = dict((name, values[i]) for name, i in PMTK314_FIELDS.items()
+                                if i < len(values) and values[i])
+        elif fields[0] == 'PMTK251':
+            return  # ボーレート変更は応答しない
+        self._send('PMTK001,%s,3' % fields[0][4:])
+
+    # 測位の時刻と位置 (UTCのdatetime, 緯度, 経度[度], 高度[m], 衛星数)
+    # 別の位置を流すときは上書きする(wpi3_simulator.SimReceiver)
+    def fix(self):
+        utc = datetime.datetime.fromtimestamp(time.time(), datetime.timezone.utc).replace(tzinfo=None)
+        return utc, 35 + 41.1493 / 60, 139 + 45.3994 / 60, 6.9, 8
+
+    # 1回の測位分のセンテンス
+    def _epoch(self, count):
+        t, lat, lon, alt, sats = self.fix()
+        hms = '%02d%02d%02d.%03d' % (t.hour, t.minute, t.second, t.microsecond // 1000)
+        pos = '%s,%s,%s,%s' % (format_degree(lat, 2, 'NS') + format_degree(lon, 3, 'EW'))
+        bodies = {
+            'GGA': 'GPGGA,%s,%s,1,%02d,1.0,%.1f,M,35.9,M,,0000' % (hms, pos, sats, alt),
+            'GSA': 'GPGSA,A,3,29,26,05,10,02,27,08,15,,,,,1.8,1.0,1.5',
+            'GSV': 'GPGSV,1,1,04,26,72,352,34,05,63,073,33,29,53,199,43,02,42,129,30',
+            'RMC': 'GPRMC,%s,A,%s,000.0,240.3,%02d%02d%02d,,,A' % (
+                hms, pos, t.day, t.month, t.year % 100),
+            'VTG': 'GPVTG,240.3,T,,M,000.0,N,000.0,K,A',
+            'ZDA': 'GPZDA,%s,%02d,%02d,%04d,,' % (hms, t.day, t.month, t.year),
+        }
+        for name in ('GGA', 'GSA', 'GSV', 'RMC', 'VTG', 'ZDA'):
+            every = self.enabled.get(name, 0)
+            if every and count % every == 0:
+                self._send(bodies[name])
+
+    def _run(self):
+        count = 0
+        next_time = time.monotonic()
+        while self._running:
+            r, _w, _x = select.select([self.master], [], [], max(0.0, next_time - time.monotonic()))
+            if r:
+                self._rx += os.read(self.master, 1024)
+                while b'\n' in self._rx:
+                    line, self._rx = self._rx.split(b'\n', 1)
+                    line = line.strip()
+                    if line.startswith(b'$PMTK') and b'*' in line:
+                        self._handle(line[1:line.index(b'*')].decode('ascii'))
+            if time.monotonic() >= next_time:
+                self._epoch(count)
+                count += 1
+                next_time += 1.0 / self.rate
+
+
+if __name__ == '__main__':
+    gps = GPSReceiver()
+    print("configure: %s" % gps.configure(baudrate=115200, rate=10))
+    start = time.monotonic()
+    try:
+        for msg in gps.messages():
+            print(msg)
+    except KeyboardInterrupt:
+        pass
+    elapsed = time.monotonic() - start
+    print("%.1f sentences/s %s" % (gps.parser.sentences / elapsed, gps.parser.stats()))
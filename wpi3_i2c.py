@@ -0,0 +1,394 @@
+#!/usr/bin/python3 -u
+# -*- coding: utf-8 -*-
+
+############################################################
+# Written by pond-e
+#
+# Environment:  Python 3.4.2
+#               OS: Raspi OS
+#               on Raspberry Pi Zero W
+#
+# wiringpiのI2Cにブロック読み出しを追加するためのモジュール
+# wiringpiのreadReg8は1回の呼び出しで1バイトしか読めないので、
+# i2c.setup()が返すファイルディスクリプタにioctl(I2C_RDWR)で、レジスタアドレスの書き込みと
+# 読み出しを1回のトランザクションにして、連続したレジスタをまとめて読み出す。
+#
+# 使い方
+#    from wpi3_i2c import I2C
+#    i2c = I2C()
+#    fd = i2c.setup(0x68)
+#    data = i2c.readBlock(fd, 0x3B, 14)
+#
+# 複数のスレッドから同じバスを使うときはshared_bus()が返すI2CBusを使う。
+# I2CBusはI2Cと同じメソッドを持ち、1回の読み書きごとにロックを取る。
+# 複数の読み書きをtransaction()にまとめると1回のロックで実行できる。
+#
+# バックエンド(setup, readReg8, writeReg8, readBlockを持つもの)は差し替えられる
+# ・I2C: wiringpi
+# ・IoctlI2C: /dev/i2c-Nへのioctl(I2C_RDWR) レジスタアドレスの書き込みと読み出しを
+#   リピーテッドスタートでつないだ1回のトランザクションにする(wiringpiを通さない)
+# ・SimI2C: メモリ上のレジスタマップ(実機なしで動かすとき) 1回ごとの遅延を設定できる
+# shared_bus()が使うバックエンドは環境変数CS17_I2C_BACKEND(wiringpi, ioctl, sim)で選ぶ
+#
+# バックエンドごとの速度の比較(センサのドライバと同じ読み書きのパターン)
+# pi@raspberrypi ~ $ sudo python3 wpi3_i2c.py ioctl
+############################################################
+
+import ctypes
+import fcntl
+import os
+import sys
+import threading
+import time
+
+
+class I2C(object):
+    # wi.I2C()と同じ使い方ができるようにする
+    def __init__(self):
+        import wiringpi as wi  # wiringPiモジュールの呼び出し
+        self._i2c = wi.I2C()
+        self._rdwr = {}  # ファイルディスクリプタ -> (スレーブアドレス, IoctlI2C)
+
+    # i2cアドレスをセットアップしてファイルディスクリプタを返す
+    def setup(self, address):
+        fd = self._i2c.setup(address)
+        self._rdwr[fd] = (address, IoctlI2C(fd=fd))
+        return fd
+
+    # 1バイト読み出し
+    # wiringpiは失敗すると-1を返すので、ほかのバックエンドと同じくIOErrorにする
+    def readReg8(self, fd, reg):
+        data = self._i2c.readReg8(fd, reg)
+        if data < 0:
+            raise IOError('I2C read failed (fd %d, reg 0x%02x)' % (fd, reg))
+        return data
+
+    # 1バイト書き込み
+    def writeReg8(self, fd, reg, data):
+        result = self._i2c.writeReg8(fd, reg, data)
+        if result < 0:
+            raise IOError('I2C write failed (fd %d, reg 0x%02x)' % (fd, reg))
+        return result
+
+    # regから連続してlengthバイト読み出す
+    # センサ側のレジスタアドレス自動インクリメントを利用する
+    # setup()が返したファイルディスクリプタにioctl(I2C_RDWR)で、レジスタアドレスの書き込みと
+    # 読み出しをリピーテッドスタートでつないだ1回のトランザクションにする
+    # (os.writeとos.readに分けると間にSTOPが入って2回のトランザクションになる)
+    def readBlock(self, fd, reg, length):
+        address, rdwr = self._rdwr[fd]
+        return rdwr.readBlock(address, reg, length)
+
+
+# ioctl(I2C_RDWR)で使うlinux/i2c.h, linux/i2c-dev.hの定義
+I2C_RDWR = 0x0707
+I2C_M_RD = 0x0001
+
+
+class _I2CMsg(ctypes.Structure):
+    _fields_ = [('addr', ctypes.c_uint16), ('flags', ctypes.c_uint16),
+                ('len', ctypes.c_uint16), ('buf', ctypes.POINTER(ctypes.c_uint8))]
+
+
+class _I2CRdwrData(ctypes.Structure):
+    _fields_ = [('msgs', ctypes.POINTER(_I2CMsg)), ('nmsgs', ctypes.c_uint32)]
+
+
+# /dev/i2c-Nを直接使うバックエンド
+# setup()はスレーブアドレスをそのまま返し、読み書きのたびにメッセージにアドレスを入れる
+# (1つのファイルディスクリプタで全部のセンサを扱う)
+# スレッドセーフではないので、複数のスレッドからはI2CBusを通して使う
+# fdを渡すと、開いてあるファイルディスクリプタ(wiringpiのsetup()の戻り値など)を使う(close()では閉じない)
+class IoctlI2C(object):
+    def __init__(self, bus=1, fd=None):
+        self._own = fd is None
+        self.fd = os.open('/dev/i2c-%d' % bus, os.O_RDWR) if fd is None else fd
+        # 毎回作らないように、メッセージとバッファを先に確保しておく
+        self._reg = (ctypes.c_uint8 * 2)()
+        self._msgs = (_I2CMsg * 2)()
+        self._data = _I2CRdwrData(self._msgs, 0)
+        self._bufs = {}  # 長さ -> 読み出しバッファ
+
+    def setup(self, address):
+        return address
+
+    def close(self):
+        if self._own:
+            os.close(self.fd)
+
+    def _transfer(self, nmsgs):
+        self._data.nmsgs = nmsgs
+        fcntl.ioctl(self.fd, I2C_RDWR, self._data)
+
+    def readReg8(self, address, reg):
+        return self.readBlock(address, reg, 1)[0]
+
+    def writeReg8(self, address, reg, data):
+        self._reg[0] = reg
+        self._reg[1] = data
+        msg = self._msgs[0]
+        msg.addr = address
+        msg.flags = 0
+        msg.len = 2
+        msg.buf = self._reg
+        self._transfer(1)
+
+    # レジスタアドレスの書き込みと読み出しを1回のトランザクションで行う
+    def readBlock(self, address, reg, length):
+        buf = self._bufs.get(length)
+        if buf is None:
+            buf = (ctypes.c_uint8 * length)()
+            self._bufs[length] = buf
+        self._reg[0] = reg
+        w = self._msgs[0]
+        w.addr = address
+        w.flags = 0
+        w.len = 1
+        w.buf = self._reg
+        r = self._msgs[1]
+        r.addr = address
+        r.flags = I2C_M_RD
+        r.len = length
+        r.buf = buf
+        self._transfer(2)
+        return bytes(buf)
+
+
+# メモリ上の256バイトのレジスタマップ
+# 読み出しはアドレスの自動インクリメントをまねる(0xFFを超えた分は0)
+# センサの動きをまねるときはread()/write()を上書きする
+class RegisterMap(object):
+    def __init__(self):
+        self.regs = bytearray(256)
+
+    def read(self, reg, length):
+        data = bytes(self.regs[reg:reg + length])
+        if len(data) < length:
+            data += bytes(length - len(data))
+        return data
+
+    def write(self, reg, data):
+        self.regs[reg] = data
+
+
+# 実機なしで使うバックエンド
+# latency: 1回の読み書きの固定の時間[s], byte_time: 1バイトあたりの時間[s]
+# (400kHzなら1バイト(9bit)で約22.5us)
+class SimI2C(object):
+    def __init__(self, latency=0.0, byte_time=0.0):
+        self.latency = latency
+        self.byte_time = byte_time
+        self.devices = {}  # アドレス -> RegisterMapなど
+        self.transactions = 0
+        self.bytes = 0
+
+    # アドレスにデバイスを付ける(付けていないアドレスはsetup()で空のRegisterMapになる)
+    def attach(self, address, device):
+        self.devices[address] = device
+
+    def setup(self, address):
+        if address not in self.devices:
+            self.devices[address] = RegisterMap()
+        return address
+
+    # 遅延をまねる(time.sleepは短い時間では精度が悪いので待ち続ける)
+    def _delay(self, length):
+        self.transactions += 1
+        self.bytes += length
+        delay = self.latency + self.byte_time * length
+        if delay > 0:
+            end = time.perf_counter() + delay
+            while time.perf_counter() < end:
+                pass
+
+    def readReg8(self, address, reg):
+        self._delay(2)
+        return self.devices[address].read(reg, 1)[0]
+
+    def writeReg8(self, address, reg, data):
+        self._delay(2)
+        self.devices[address].write(reg, data)
+
+    def readBlock(self, address, reg, length):
+        self._delay(1 + length)
+        data = self.devices[address].read(reg, length)
+        if len(data) != length:
+            raise IOError('I2C block read is short: %d/%d bytes' % (len(data), length))
+        return data
+
+
+BACKENDS = {'wiringpi': I2C, 'ioctl': IoctlI2C, 'sim': SimI2C}
+
+
+# 名前からバックエンドを作る Noneなら環境変数CS17_I2C_BACKEND(なければwiringpi)
+def make_backend(name=None):
+    if name is None:
+        name = os.environ.get('CS17_I2C_BACKEND', 'wiringpi')
+    return BACKENDS[name]()
+
+
+# 複数のスレッドで共有するI2Cバス
+# ファイルディスクリプタはアドレスごとに1つだけ作って使い回す
+class I2CBus(object):
+    def __init__(self, i2c=None):
+        self.i2c = make_backend() if i2c is None else i2c
+        self.lock = threading.Lock()
+        self.fds = {}  # アドレス -> ファイルディスクリプタ
+        # 統計情報
+        self.acquisitions = 0  # ロックを取った回数
+        self.contended = 0  # 他のスレッドが使っていて待たされた回数
+        self.wait_ns = 0  # 待たされた時間の合計[ns]
+        self.max_wait_ns = 0  # 待たされた時間の最大[ns]
+
+    # ロックを取る 待たされた場合は時間を数える
+    def _acquire(self):
+        lock = self.lock
+        if not lock.acquire(False):
+            start = time.perf_counter()
+            lock.acquire()
+            wait = int((time.perf_counter() - start) * 1e9)
+            self.contended += 1
+            self.wait_ns += wait
+            if wait > self.max_wait_ns:
+                self.max_wait_ns = wait
+        self.acquisitions += 1
+
+    def setup(self, address):
+        with self.lock:
+            fd = self.fds.get(address)
+            if fd is None:
+                fd = self.i2c.setup(address)
+                self.fds[address] = fd
+            return fd
+
+    def readReg8(self, fd, reg):
+        self._acquire()
+        try:
+            return self.i2c.readReg8(fd, reg)
+        finally:
+            self.lock.release()
+
+    def writeReg8(self, fd, reg, data):
+        self._acquire()
+        try:
+            return self.i2c.writeReg8(fd, reg, data)
+        finally:
+            self.lock.release()
+
+    # レジスタアドレスの書き込みと読み出しの間に他のスレッドが割り込まないようにする
+    def readBlock(self, fd, reg, length):
+        self._acquire()
+        try:
+            return self.i2c.readBlock(fd, reg, length)
+        finally:
+            self.lock.release()
+
+    # 複数の読み書きを1回のロックで実行する
+    # ops: ('r8', fd, reg), ('w8', fd, reg, data), ('rb', fd, reg, length) のリスト
+    # 戻り値は各操作の戻り値のリスト
+    def transaction(self, ops):
+        i2c = self.i2c
+        results = []
+        self._acquire()
+        try:
+            for op in ops:
+                kind = op[0]
+                if kind == 'rb':
+                    results.append(i2c.readBlock(op[1], op[2], op[3]))
+                elif kind == 'r8':
+                    results.append(i2c.readReg8(op[1], op[2]))
+                elif kind == 'w8':
+                    results.append(i2c.writeReg8(op[1], op[2], op[3]))
+                else:
+                    raise ValueError('unknown I2C operation %r' % (kind,))
+        finally:
+            self.lock.release()
+        return results
+
+    # 統計情報
+    def stats(self):
+        return {'acquisitions': self.acquisitions, 'contended': self.contended,
+                'wait_ns': self.wait_ns, 'max_wait_ns': self.max_wait_ns}
+
+
+_shared_bus = None
+_shared_lock = threading.Lock()
+
+
+# プロセス内で1つだけのI2CBusを返す
+# 別々のモジュール(cs17_wpi3_2sensors.py, wpi3_mpu9250_2.pyなど)から呼んでも同じバスになる
+def shared_bus():
+    global _shared_bus
+    with _shared_lock:
+        if _shared_bus is None:
+            _shared_bus = I2CBus()
+        return _shared_bus
+
+
+# shared_bus()が返すバスのバックエンドを差し替える
+# (wpi3_simulator.pyなど 各モジュールが最初にshared_bus()を呼ぶより前に呼ぶ)
+def set_shared_backend(i2c):
+    global _shared_bus
+    with _shared_lock:
+        _shared_bus = I2CBus(i2c)
+        return _shared_bus
+
+
+# センサのドライバと同じ読み書きのパターン (名前, 読み書きするバイト数, バスのトランザクション数, 関数)
+def access_patterns(i2c):
+    mpu = i2c.setup(0x68)
+    ak = i2c.setup(0x0C)
+    bme = i2c.setup(0x76)
+
+    def mag_bypass():  # cs17_wpi3_2sensors.getMag()
+        i2c.readReg8(ak, 0x02)
+        for reg in range(0x03, 0x0A):
+            i2c.readReg8(ak, reg)
+
+    def bme_single():  # 0xF7~0xFEを1バイトずつ
+        for reg in range(0xF7, 0xFF):
+            i2c.readReg8(bme, reg)
+
+    def fifo():  # MPU9250Fifo.read() (42サンプル分)
+        i2c.readBlock(mpu, 0x72, 2)
+        i2c.readBlock(mpu, 0x74, 504)
+
+    return [
+        ('mpu burst 14', 14, 1, lambda: i2c.readBlock(mpu, 0x3B, 14)),
+        ('mpu i2cmst 22', 22, 1, lambda: i2c.readBlock(mpu, 0x3B, 22)),
+        ('mag bypass 8x1', 8, 8, mag_bypass),
+        ('bme280 block 8', 8, 1, lambda: i2c.readBlock(bme, 0xF7, 8)),
+        ('bme280 8x1', 8, 8, bme_single),
+        ('fifo 2+504', 506, 2, fifo),
+    ]
+
+
+# パターンごとに duration 秒くり返して、回数/秒、トランザクション/秒、バイト/秒を測る
+# 戻り値は[(名前, パターンの回数/秒, トランザクション/秒, バイト/秒), ...]
+def benchmark(i2c, duration=1.0):
+    results = []
+    for name, length, transactions, func in access_patterns(i2c):
+        count = 0
+        start = time.perf_counter()
+        end = start + duration
+        while time.perf_counter() < end:
+            func()
+            count += 1
+        elapsed = time.perf_counter() - start
+        results.append((name, count / elapsed, count * transactions / elapsed, count * length / elapsed))
+    return results
+
+
+if __name__ == '__main__':
+    name = sys.argv[1] if len(sys.argv) > 1 else 'sim'
+    if name == 'sim':
+        i2c = SimI2C(latency=100e-6, byte_time=22.5e-6)  # 400kHzのバスをまねる
+    elif name == 'wiringpi':
+        import wiringpi as wi
+        wi.wiringPiSetup()  # wiringPiの初期化
+        i2c = I2C()
+    else:
+        i2c = make_backend(name)
+    print("backend: %s" % name)
+    for pattern, pps, tps, bps in benchmark(i2c):
+        print("%-16s %10.0f patterns/s %10.0f tx/s %12.0f bytes/s" % (pattern, pps, tps, bps))
@@ -0,0 +1,230 @@
+#!/usr/bin/python3 -u
+# -*- coding: utf-8 -*-
+
+############################################################
+# Written by pond-e
+#
+# Environment:  Python 3.4.2
+#               OS: Raspi OS
+#               on Raspberry Pi Zero W
+# Used sensor: MPU-9250(Akiduki denshi)
+#
+# MPU-9250の加速度・ジャイロのオフセットを求めて、センサのオフセットレジスタに書き込む
+# ・起動のたびに1000サンプルを1つずつ読むのをやめ、FIFO(1kHz)でまとめて集める(0.4秒ほど)
+# ・求めた値はセンサの個体(WHO_AM_Iとセルフテストの工場出荷値)とレンジの設定ごとに
+#   ファイルに保存し、古くなければ次の起動ではレジスタに書くだけにする(数ミリ秒)
+#   古いかどうかは経過日数と、測ったときからの温度の変化で判断する
+# ・ジャイロ: XG_OFFSET_H~ZG_OFFSET_L(0x13~0x18) 1000dpsのときの1LSB単位
+# ・加速度: XA_OFFSET_H/L(0x77,0x78), YA(0x7A,0x7B), ZA(0x7D,0x7E)
+#   16gのときの1LSB単位で、最下位ビット(bit0)は予約なので元の値を残す
+# ・加速度はz軸が上を向いて静止している前提で1gを差し引く
+# ・FIFOで測る間に変えるレジスタ(サンプリングレート、DLPF、FIFO_EN、USER_CTRL)は測り終わったら元に戻す
+#   (キャッシュを使ったときと測り直したときで、そのあとのセンサの設定が変わらないように)
+#
+# キャリブレーション(キャッシュを使わずに測り直す)
+# pi@raspberrypi ~ $ sudo python3 wpi3_imucal.py
+############################################################
+
+import json
+import os
+import struct
+import time
+
+from wpi3_mpu9250_fifo import MPU9250Fifo, FifoOverflow
+
+REG_SELF_TEST_X_GYRO = 0x00  # 0x00~0x02
+REG_SELF_TEST_X_ACCEL = 0x0D  # 0x0D~0x0F
+REG_XG_OFFSET_H = 0x13  # 0x13~0x18
+REG_ACCEL_XOUT_H = 0x3B
+REG_WHO_AM_I = 0x75
+REG_ACCEL_OFFSET = (0x77, 0x7A, 0x7D)  # X, Y, ZのH(Lは+1)
+REG_USER_CTRL = 0x6A
+# MPU9250Fifo.start()/stop()が書き換えるレジスタ SMPLRT_DIV, CONFIG, ACCEL_CONFIG2, FIFO_EN, USER_CTRL
+FIFO_SAVED_REGS = (0x19, 0x1A, 0x1D, 0x23, REG_USER_CTRL)
+USER_CTRL_RESET_BITS = 0x07  # FIFO_RST, I2C_MST_RST, SIG_COND_RST (書き戻さない)
+
+IMU_CAL_FILE = '/home/pi/data/imucal.json'
+MAX_AGE = 30 * 24 * 3600  # これより古い値は使わない[s]
+MAX_TEMP_DELTA = 10.0  # 測ったときとの温度の差がこれより大きければ測り直す[℃]
+FIFO_TIMEOUT = 10  # FIFOで集めるのに予定(count / 1kHz)の何倍かかったらあきらめるか
+
+
+# センサの個体を区別する文字列
+# WHO_AM_Iとセルフテストの工場出荷値(チップごとに違う)を並べる
+def sensor_identity(i2c, fd):
+    who = i2c.readReg8(fd, REG_WHO_AM_I)
+    st = i2c.readBlock(fd, REG_SELF_TEST_X_GYRO, 3) + i2c.readBlock(fd, REG_SELF_TEST_X_ACCEL, 3)
+    return '%02x-%s' % (who, ''.join('%02x' % b for b in st))
+
+
+# キャッシュのキー(個体とレンジの設定)
+def cache_key(identity, accelRange, gyroRange):
+    return '%s/%dg/%ddps' % (identity, accelRange, gyroRange)
+
+
+# 温度[℃] (0x41~0x42)
+def readTemp(i2c, fd):
+    t, = struct.unpack('>h', i2c.readBlock(fd, 0x41, 2))
+    return t / 333.87 + 21.0
+
+
+# 静止した状態の加速度・ジャイロの平均[LSB]を測る
+# source='fifo'ならFIFO(1kHz)、'burst'なら14バイトのブロック読み出しを繰り返す
+# FIFOにサンプルがたまらなければ(センサがスリープのまま、FIFO_ENが効いていないなど)
+# 予定の時間のFIFO_TIMEOUT倍(最低1秒)でIOError
+def measureBias(i2c, fd, count=400, source='fifo'):
+    total = [0.0] * 6
+    n = 0
+    if source == 'fifo':
+        saved = [(reg, i2c.readReg8(fd, reg)) for reg in FIFO_SAVED_REGS]
+        # 変換係数を1にして生の値のまま受け取る
+        fifo = MPU9250Fifo(i2c, fd, rate=1000, accelCoefficient=1.0, gyroCoefficient=1.0)
+        fifo.start()
+        end = time.monotonic() + max(1.0, FIFO_TIMEOUT * count / 1000.0)
+        try:
+            while n < count:
+                if time.monotonic() > end:
+                    raise IOError('FIFO collected only %d of %d samples' % (n, count))
+                time.sleep(0.02)  # 512バイトのFIFOは1kHzで42ms分
+                try:
+                    samples = fifo.read()
+                except FifoOverflow:
+                    continue
+                for s in samples[:count - n]:
+                    for i in range(6):
+                        total[i] += s[i + 1]
+                    n += 1
+        finally:
+            fifo.stop()
+            for reg, value in saved:
+                if reg == REG_USER_CTRL:
+                    value &= ~USER_CTRL_RESET_BITS
+                i2c.writeReg8(fd, reg, value)
+    else:
+        for _i in range(count):
+            ax, ay, az, _t, gx, gy, gz = struct.unpack('>7h', i2c.readBlock(fd, REG_ACCEL_XOUT_H, 14))
+            for i, v in enumerate((ax, ay, az, gx, gy, gz)):
+                total[i] += v
+            n += 1
+    return [x / n for x in total[:3]], [x / n for x in total[3:]]
+
+
+def readGyroOffset(i2c, fd):
+    return list(struct.unpack('>3h', i2c.readBlock(fd, REG_XG_OFFSET_H, 6)))
+
+
+def writeGyroOffset(i2c, fd, values):
+    for i, v in enumerate(values):
+        v &= 0xFFFF
+        i2c.writeReg8(fd, REG_XG_OFFSET_H + 2 * i, v >> 8)
+        i2c.writeReg8(fd, REG_XG_OFFSET_H + 2 * i + 1, v & 0xFF)
+
+
+def readAccelOffset(i2c, fd):
+    return [struct.unpack('>h', i2c.readBlock(fd, reg, 2))[0] for reg in REG_ACCEL_OFFSET]
+
+
+# bit0(予約)は書き込む前の値を残す
+def writeAccelOffset(i2c, fd, values):
+    for reg, v in zip(REG_ACCEL_OFFSET, values):
+        low = i2c.readReg8(fd, reg + 1)
+        v = (v & 0xFFFE) | (low & 0x01)
+        i2c.writeReg8(fd, reg, (v >> 8) & 0xFF)
+        i2c.writeReg8(fd, reg + 1, v & 0xFF)
+
+
+# 測った平均[LSB]から、オフセットレジスタに書く値を求める
+# 今のレジスタの値が入った状態で測っているので、そこから差し引く
+def offsetRegisters(accel_bias, gyro_bias, accel_reg, gyro_reg, accelRange, gyroRange):
+    # 重力の分(z軸が上向き)
+    accel_bias = [accel_bias[0], accel_bias[1], accel_bias[2] - 32768.0 / accelRange]
+    # ジャイロのレジスタは1000dpsのときの1LSB (32.8LSB/dps)
+    gyro = [int(round(r - b * gyroRange / 1000.0)) for r, b in zip(gyro_reg, gyro_bias)]
+    # 加速度のレジスタは16gのときの1LSB (2048LSB/g) bit0は使えないので偶数にする
+    accel = [r - (int(round(b * accelRange / 16.0)) & ~1) for r, b in zip(accel_reg, accel_bias)]
+    return accel, gyro
+
+
+def load_cache(path=IMU_CAL_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_cache(cache, path=IMU_CAL_FILE):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+    os.rename(tmp, path)  # 書きかけのファイルを残さない
+
+
+# キャッシュの値が使えるか 使えなければ理由の文字列、使えればNone
+def stale_reason(entry, temp, now=None, max_age=MAX_AGE, max_temp_delta=MAX_TEMP_DELTA):
+    if entry is None:
+        return 'no cache'
+    now = time.time() if now is None else now
+    if now - entry['time'] > max_age:
+        return 'too old'
+    if abs(temp - entry['temp']) > max_temp_delta:
+        return 'temperature changed'
+    return None
+
+
+# オフセットを測ってレジスタに書き込み、キャッシュに保存する
+# FIFOで集められなければブロック読み出しで測り直す(起動が止まらないように)
+def calibrate(i2c, fd, accelRange, gyroRange, path=IMU_CAL_FILE, count=400, source='fifo'):
+    accel_reg = readAccelOffset(i2c, fd)
+    gyro_reg = readGyroOffset(i2c, fd)
+    try:
+        accel_bias, gyro_bias = measureBias(i2c, fd, count, source)
+    except IOError:
+        if source != 'fifo':
+            raise
+        source = 'burst'
+        accel_bias, gyro_bias = measureBias(i2c, fd, count, source)
+    accel, gyro = offsetRegisters(accel_bias, gyro_bias, accel_reg, gyro_reg, accelRange, gyroRange)
+    writeAccelOffset(i2c, fd, accel)
+    writeGyroOffset(i2c, fd, gyro)
+    entry = {'accel_reg': accel, 'gyro_reg': gyro, 'accel_bias': accel_bias, 'gyro_bias': gyro_bias,
+             'temp': readTemp(i2c, fd), 'time': time.time(), 'count': count, 'source': source}
+    cache = load_cache(path)
+    cache[cache_key(sensor_identity(i2c, fd), accelRange, gyroRange)] = entry
+    save_cache(cache, path)
+    return entry
+
+
+# キャッシュが使えればレジスタに書くだけ、使えなければ測り直す
+# 戻り値は(キャッシュの内容, 測り直した理由またはNone)
+# センサをリセットするとオフセットレジスタも初期値に戻るので、起動のたびに呼ぶ
+def load_or_calibrate(i2c, fd, accelRange, gyroRange, path=IMU_CAL_FILE, max_age=MAX_AGE,
+                      max_temp_delta=MAX_TEMP_DELTA, **kwargs):
+    key = cache_key(sensor_identity(i2c, fd), accelRange, gyroRange)
+    entry = load_cache(path).get(key)
+    reason = stale_reason(entry, readTemp(i2c, fd), max_age=max_age, max_temp_delta=max_temp_delta)
+    if reason is not None:
+        return calibrate(i2c, fd, accelRange, gyroRange, path, **kwargs), reason
+    writeAccelOffset(i2c, fd, entry['accel_reg'])
+    writeGyroOffset(i2c, fd, entry['gyro_reg'])
+    return entry, None
+
+
+if __name__ == '__main__':
+    import wiringpi as wi
+    from wpi3_i2c import I2C
+
+    wi.wiringPiSetup()  # wiringPiの初期化
+    i2c = I2C()
+    mpu9250 = i2c.setup(0x68)
+    i2c.writeReg8(mpu9250, 0x6B, 0x00)  # PWR_MGMT_1をクリア
+    time.sleep(0.1)
+    i2c.writeReg8(mpu9250, 0x1B, 0x10)  # 1000dps
+    i2c.writeReg8(mpu9250, 0x1C, 0x10)  # 8g
+    start = time.perf_counter()
+    entry = calibrate(i2c, mpu9250, 8, 1000)
+    print("calibration: %.3f s" % (time.perf_counter() - start))
+    print("accel bias [LSB] = %.1f, %.1f, %.1f" % tuple(entry['accel_bias']))
+    print("gyro bias  [LSB] = %.1f, %.1f, %.1f" % tuple(entry['gyro_bias']))
+    start = time.perf_counter()
+    entry, reason = load_or_calibrate(i2c, mpu9250, 8, 1000)
+    print("cached: %.3f s (%s)" % (time.perf_counter() - start, reason or 'hit'))
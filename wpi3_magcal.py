@@ -0,0 +1,180 @@
+#!/usr/bin/python3 -u
+# -*- coding: utf-8 -*-
+
+############################################################
+# Written by pond-e
+#
+# Environment:  Python 3.4.2
+#               OS: Raspi OS
+#               on Raspberry Pi Zero W
+# Used sensor: MPU-9250(AK8963)
+#
+# 磁気センサ(AK8963)のキャリブレーション
+# ・ASAレジスタ(0x10~0x12)の工場出荷時の感度調整値を読み出す
+#   Hadj = H * ((ASA - 128) / 256 + 1)
+# ・センサをいろいろな向きに回して集めた値に楕円体を当てはめ(最小二乗法)、
+#   ハードアイアン(中心のずれ)とソフトアイアン(ゆがみ)を求める
+# ・結果はJSONのファイルに保存し、次の起動からはそれを読み込む
+# ・補正はASAも含めて1つの3x3行列とオフセットにまとめておき、
+#   1サンプルあたり行列1回の計算で済ませる
+#
+# キャリブレーション(60秒の間、センサをあらゆる向きにゆっくり回す)
+# pi@raspberrypi ~ $ sudo python3 wpi3_magcal.py
+############################################################
+
+import json
+import time
+
+try:
+    import numpy as np
+except ImportError:  # 楕円体の当てはめのときだけ使う
+    np = None
+
+AK8963_CNTL1 = 0x0A
+AK8963_ASAX = 0x10
+CNTL1_POWER_DOWN = 0x00
+CNTL1_FUSE_ROM = 0x0F
+
+MAG_CAL_FILE = '/home/pi/data/magcal.json'
+
+
+# ASAレジスタを読み出して軸ごとの感度の倍率(x, y, z)を返す
+# 読み出したあとはパワーダウンモードにするので、測定モードは後で設定し直す
+def readASA(i2c, fd):
+    i2c.writeReg8(fd, AK8963_CNTL1, CNTL1_POWER_DOWN)
+    time.sleep(0.01)
+    i2c.writeReg8(fd, AK8963_CNTL1, CNTL1_FUSE_ROM)  # Fuse ROMアクセスモード
+    time.sleep(0.01)
+    data = i2c.readBlock(fd, AK8963_ASAX, 3)
+    i2c.writeReg8(fd, AK8963_CNTL1, CNTL1_POWER_DOWN)
+    time.sleep(0.01)
+    return tuple((asa - 128) / 256.0 + 1.0 for asa in data)
+
+
+class MagCalibration(object):
+    # offset: 中心のずれ(x, y, z)[uT], matrix: ゆがみを直す3x3行列(行のリスト)
+    # asa: 感度の倍率(x, y, z)
+    # 補正後の値 = matrix * (asa * m - offset)
+    def __init__(self, offset=(0.0, 0.0, 0.0), matrix=((1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.0, 0.0, 1.0)),
+                 asa=(1.0, 1.0, 1.0), field=None):
+        self.offset = tuple(offset)
+        self.matrix = tuple(tuple(row) for row in matrix)
+        self.asa = tuple(asa)
+        self.field = field  # 当てはめたときの磁場の強さ[uT]
+        # ASAをかけてオフセットを引く計算を行列の中にまとめる
+        # matrix * (asa * m - offset) = (matrix * diag(asa)) * m - matrix * offset
+        m = self.matrix
+        self.m00, self.m01, self.m02 = [m[0][j] * asa[j] for j in range(3)]
+        self.m10, self.m11, self.m12 = [m[1][j] * asa[j] for j in range(3)]
+        self.m20, self.m21, self.m22 = [m[2][j] * asa[j] for j in range(3)]
+        self.b0, self.b1, self.b2 = [sum(m[i][j] * offset[j] for j in range(3)) for i in range(3)]
+
+    # 1サンプルの補正 x, y, zはASAをかける前の[uT]
+    def apply(self, x, y, z):
+        return (self.m00 * x + self.m01 * y + self.m02 * z - self.b0,
+                self.m10 * x + self.m11 * y + self.m12 * z - self.b1,
+                self.m20 * x + self.m21 * y + self.m22 * z - self.b2)
+
+    # 配列でまとめて補正する (n, 3)の配列を返す
+    def apply_batch(self, mag):
+        mag = np.asarray(mag, dtype=np.float64)
+        combined = np.array([[self.m00, self.m01, self.m02],
+                             [self.m10, self.m11, self.m12],
+                             [self.m20, self.m21, self.m22]])
+        return mag.dot(combined.T) - np.array([self.b0, self.b1, self.b2])
+
+    def to_dict(self):
+        return {'offset': list(self.offset), 'matrix': [list(row) for row in self.matrix],
+                'asa': list(self.asa), 'field': self.field}
+
+
+def save_calibration(cal, path=MAG_CAL_FILE):
+    with open(path, 'w') as f:
+        json.dump(cal.to_dict(), f, indent=2)
+
+
+def load_calibration(path=MAG_CAL_FILE):
+    with open(path) as f:
+        d = json.load(f)
+    return MagCalibration(d['offset'], d['matrix'], d['asa'], d.get('field'))
+
+
+# 楕円体の当てはめ
+# samples: ASAをかけた(x, y, z)[uT]のリスト(9点以上、いろいろな向きのもの)
+# 一般の2次曲面 Ax^2+By^2+Cz^2+2Dxy+2Exz+2Fyz+2Gx+2Hy+2Iz = 1 を最小二乗法で解き、
+# 中心と、楕円体を半径fieldの球に写す対称行列を求める
+# 戻り値は(中心, 3x3行列, field[uT], 残差(補正後の大きさの標準偏差/field))
+def fit_ellipsoid(samples):
+    if np is None:
+        raise ImportError('fit_ellipsoid requires numpy')
+    m = np.asarray(samples, dtype=np.float64)
+    if m.ndim != 2 or m.shape[1] != 3 or m.shape[0] < 9:
+        raise ValueError('at least 9 samples of (x, y, z) are required')
+    x = m[:, 0]
+    y = m[:, 1]
+    z = m[:, 2]
+    D = np.column_stack([x * x, y * y, z * z, 2 * x * y, 2 * x * z, 2 * y * z, 2 * x, 2 * y, 2 * z])
+    v = np.linalg.lstsq(D, np.ones(len(m)), rcond=None)[0]
+    A = np.array([[v[0], v[3], v[4]],
+                  [v[3], v[1], v[5]],
+                  [v[4], v[5], v[2]]])
+    center = -np.linalg.solve(A, v[6:9])
+    # 中心を原点に移すと (m-c)^T A (m-c) = 1 + c^T A c
+    k = 1.0 + center.dot(A).dot(center)
+    M = A / k
+    w, V = np.linalg.eigh(M)
+    if (w <= 0).any():
+        raise ValueError('samples do not form an ellipsoid (rotate the sensor in all directions)')
+    radii = 1.0 / np.sqrt(w)
+    field = float(np.prod(radii) ** (1.0 / 3.0))  # 体積が同じ球の半径
+    W = V.dot(np.diag(np.sqrt(w) * field)).dot(V.T)
+    corrected = (m - center).dot(W.T)
+    residual = float(np.std(np.sqrt((corrected * corrected).sum(axis=1))) / field)
+    return center, W, field, residual
+
+
+# 集めた値(ASAをかける前の[uT])からキャリブレーションを作る
+def calibrate(samples, asa=(1.0, 1.0, 1.0)):
+    scaled = [(x * asa[0], y * asa[1], z * asa[2]) for x, y, z in samples]
+    center, W, field, residual = fit_ellipsoid(scaled)
+    return MagCalibration(center.tolist(), W.tolist(), asa, field), residual
+
+
+# duration秒の間、read()の値を集める Noneは捨てる
+def collect(read, duration=60.0, interval=0.01):
+    samples = []
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        m = read()
+        if m is not None:
+            samples.append(m)
+        time.sleep(interval)
+    return samples
+
+
+if __name__ == '__main__':
+    import wiringpi as wi
+    from wpi3_i2c import I2C
+    from wpi3_drdy import DataReadyAcquisition
+
+    wi.wiringPiSetup()  # wiringPiの初期化
+    i2c = I2C()
+    mpu9250 = i2c.setup(0x68)
+    AK8963 = i2c.setup(0x0C)
+    i2c.writeReg8(mpu9250, 0x6B, 0x00)  # PWR_MGMT_1をクリア
+    time.sleep(0.1)
+    i2c.writeReg8(mpu9250, 0x37, 0x02)  # BYPASS_EN=1
+    asa = readASA(i2c, AK8963)
+    print("ASA = %.4f, %.4f, %.4f" % asa)
+    i2c.writeReg8(AK8963, AK8963_CNTL1, 0x16)  # 100Hz連続測定モード, 16bit
+    acq = DataReadyAcquisition(i2c, mpu9250, AK8963, None)  # 磁気の読み出しだけ使う
+
+    print("rotate the sensor in all directions for 60 seconds")
+    samples = collect(acq.readMag)
+    cal, residual = calibrate(samples, asa)
+    print("%d samples, field=%.2f uT, residual=%.2f %%" % (len(samples), cal.field, residual * 100))
+    print("offset = %.2f, %.2f, %.2f" % cal.offset)
+    for row in cal.matrix:
+        print("         %7.4f %7.4f %7.4f" % row)
+    save_calibration(cal)
+    print("saved to %s" % MAG_CAL_FILE)
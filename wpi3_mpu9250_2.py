@@ -18,16 +18,19 @@
 ############################################################
 import sys  # sysモジュールの呼び出し
 import wiringpi as wi  # wiringPiモジュールの呼び出し
+from wpi3_i2c import shared_bus  # スレッド間で共有するI2Cバス
+from wpi3_clock import monotonic_ns, clock_anchor  # サンプルの時刻
 import time  # timeライブラリの呼び出し
 import datetime  # datetimeモジュールの呼び出し
 import os
+import struct
 
 # データ計測時間は　SAMPLING_TIME x TIMES
 SAMPLING_TIME = 0.1  # データ取得の時間間隔[sec]
 TIMES = 100  # データの計測回数
 
 wi.wiringPiSetup()  # wiringPiの初期化
-i2c = wi.I2C()  # i2cの初期化
+i2c = shared_bus()  # i2cの初期化(ブロック読み出し対応、スレッド間で共有)
 
 address = 0x68
 addrAK8963 = 0x0C  # 磁気センサAK8963 アドレス
@@ -61,6 +64,7 @@ offsetAccelZ = 0
 offsetGyroX = 0
 offsetGyroY = 0
 offsetGyroZ = 0
+lastMag = None  # 最後に読んだ磁気の値[uT]
 
 
 # レジスタを初期設定に戻す。
@@ -199,46 +203,44 @@ def u2s(unsigneddata):
     return unsigneddata
 
 
+# 加速度・温度・ジャイロ値を0x3B~0x48の14バイトまとめて取得
+# 1回のI2Cトランザクションで全軸を読み出す
+def getAccelTempGyro():
+    data = i2c.readBlock(mpu9250, 0x3B, 14)
+    ax, ay, az, t, gx, gy, gz = struct.unpack('>7h', data)  # ビッグエンディアンの符号付き16bit
+    acc = (accelCoefficient * ax + offsetAccelX,
+           accelCoefficient * ay + offsetAccelY,
+           accelCoefficient * az + offsetAccelZ)
+    gyr = (gyroCoefficient * gx + offsetGyroX,
+           gyroCoefficient * gy + offsetGyroY,
+           gyroCoefficient * gz + offsetGyroZ)
+    temp_mpu = t / 333.87 + 21.0  # [℃]
+    return acc, temp_mpu, gyr
+
+
 # 加速度値を取得
 def getAccel():
-    ACCEL_XOUT_H = i2c.readReg8(mpu9250, 0x3B)
-    ACCEL_XOUT_L = i2c.readReg8(mpu9250, 0x3C)
-    ACCEL_YOUT_H = i2c.readReg8(mpu9250, 0x3D)
-    ACCEL_YOUT_L = i2c.readReg8(mpu9250, 0x3E)
-    ACCEL_ZOUT_H = i2c.readReg8(mpu9250, 0x3F)
-    ACCEL_ZOUT_L = i2c.readReg8(mpu9250, 0x40)
-    rawX = accelCoefficient * u2s(ACCEL_XOUT_H << 8 | ACCEL_XOUT_L) + offsetAccelX
-    rawY = accelCoefficient * u2s(ACCEL_YOUT_H << 8 | ACCEL_YOUT_L) + offsetAccelY
-    rawZ = accelCoefficient * u2s(ACCEL_ZOUT_H << 8 | ACCEL_ZOUT_L) + offsetAccelZ
-    # data    = i2c.readReg8(address, 0x3B )
-    # print "getaccell data=%d"%data
-    # rawX    = accelCoefficient * u2s(data[0] << 8 | data[1]) + offsetAccelX
-    # rawY    = accelCoefficient * u2s(data[2] << 8 | data[3]) + offsetAccelY
-    # rawZ    = accelCoefficient * u2s(data[4] << 8 | data[5]) + offsetAccelZ
+    data = i2c.readBlock(mpu9250, 0x3B, 6)
+    x, y, z = struct.unpack('>3h', data)
+    rawX = accelCoefficient * x + offsetAccelX
+    rawY = accelCoefficient * y + offsetAccelY
+    rawZ = accelCoefficient * z + offsetAccelZ
     return rawX, rawY, rawZ
 
 
 # ジャイロ値を取得
 def getGyro():
-    GYRO_XOUT_H = i2c.readReg8(mpu9250, 0x43)
-    GYRO_XOUT_L = i2c.readReg8(mpu9250, 0x44)
-    GYRO_YOUT_H = i2c.readReg8(mpu9250, 0x45)
-    GYRO_YOUT_L = i2c.readReg8(mpu9250, 0x46)
-    GYRO_ZOUT_H = i2c.readReg8(mpu9250, 0x47)
-    GYRO_ZOUT_L = i2c.readReg8(mpu9250, 0x48)
-    rawX = gyroCoefficient * u2s(GYRO_XOUT_H << 8 | GYRO_XOUT_L) + offsetGyroX
-    rawY = gyroCoefficient * u2s(GYRO_YOUT_H << 8 | GYRO_YOUT_L) + offsetGyroY
-    rawZ = gyroCoefficient * u2s(GYRO_ZOUT_H << 8 | GYRO_ZOUT_L) + offsetGyroZ
-    # data    =  i2c.readReg8(address, 0x43 )
-    # rawX    = gyroCoefficient * u2s(data[0] << 8 | data[1]) + offsetGyroX
-    # rawY    = gyroCoefficient * u2s(data[2] << 8 | data[3]) + offsetGyroY
-    # rawZ    = gyroCoefficient * u2s(data[4] << 8 | data[5]) + offsetGyroZ
+    data = i2c.readBlock(mpu9250, 0x43, 6)
+    x, y, z = struct.unpack('>3h', data)
+    rawX = gyroCoefficient * x + offsetGyroX
+    rawY = gyroCoefficient * y + offsetGyroY
+    rawZ = gyroCoefficient * z + offsetGyroZ
     return rawX, rawY, rawZ
 
 
 # 磁気値を取得
 def getMag():
-    global MAG_ACCESS
+    global MAG_ACCESS, lastMag
     if MAG_ACCESS == False:
         # 磁気センサへのアクセスが有効になっていない場合は例外
         raise Exception('002 Access to a sensor is invalid.')
@@ -254,13 +256,6 @@ def getMag():
         i2c.writeReg8(AK8963, 0x0A, _writeData)
         time.sleep(0.01)
 
-    elif MAG_MODE == MAG_MODE_SERIAL_1 or MAG_MODE == MAG_MODE_SERIAL_2:
-        status = i2c.readReg8(AK8963, 0x02)
-        if (status & 0x02) == 0x02:
-            # if (status[0] & 0x02) == 0x02:
-            # データオーバーランがあるので再度センシング
-            i2c.readReg8(AK8963, 0x09)
-
     elif MAG_MODE == MAG_MODE_EX_TRIGER:
         # 未実装
         return
@@ -268,31 +263,18 @@ def getMag():
     elif MAG_MODE == MAG_MODE_POWERDOWN:
         raise Exception('003 Mag sensor power down')
 
-    # ST1レジスタを確認してデータ読み出しが可能か確認する
+    # ST1を1回だけ見る 連続測定モードで新しいデータがなければ前の値を使う(sleepで待たない)
+    # 最初の1回と単発測定モードだけはデータができるまで待つ
     status = i2c.readReg8(AK8963, 0x02)
-    while (status & 0x01) != 0x01:
-        # while (status[0] & 0x01) != 0x01:
-        # Wait until data ready state.
-        time.sleep(0.01)
-        status = i2c.readReg8(AK8963, 0x02)
-
-    # データ読み出し
-    MAG_XOUT_L = i2c.readReg8(AK8963, 0x03)
-    MAG_XOUT_H = i2c.readReg8(AK8963, 0x04)
-    MAG_YOUT_L = i2c.readReg8(AK8963, 0x05)
-    MAG_YOUT_H = i2c.readReg8(AK8963, 0x06)
-    MAG_ZOUT_L = i2c.readReg8(AK8963, 0x07)
-    MAG_ZOUT_H = i2c.readReg8(AK8963, 0x08)
-    MAG_OF = i2c.readReg8(AK8963, 0x09)
-    rawX = u2s(MAG_XOUT_H << 8 | MAG_XOUT_L)
-    rawY = u2s(MAG_YOUT_H << 8 | MAG_YOUT_L)
-    rawZ = u2s(MAG_ZOUT_H << 8 | MAG_ZOUT_L)
-    st2 = MAG_OF
-    # data    = i2c.readReg8(addrAK8963, 0x03 ,7)
-    # rawX    = u2s(data[1] << 8 | data[0])  # Lower bit is ahead.
-    # rawY    = u2s(data[3] << 8 | data[2])  # Lower bit is ahead.
-    # rawZ    = u2s(data[5] << 8 | data[4])  # Lower bit is ahead.
-    # st2     = data[6]
+    if (status & 0x01) != 0x01:
+        if lastMag is not None and MAG_MODE != MAG_MODE_SINGLE:
+            return lastMag
+        while (status & 0x01) != 0x01:
+            time.sleep(0.001)
+            status = i2c.readReg8(AK8963, 0x02)
+
+    # HXL~HZH, ST2の7バイトをまとめて読む(ST2まで読むと次の測定に進む、オーバーランもこれで解除)
+    rawX, rawY, rawZ, st2 = struct.unpack('<3hB', i2c.readBlock(AK8963, 0x03, 7))
 
     # オーバーフローチェック
     if (st2 & 0x08) == 0x08:
@@ -309,7 +291,8 @@ def getMag():
         rawY = rawY * magCoefficient14
         rawZ = rawZ * magCoefficient14
 
-    return rawX, rawY, rawZ
+    lastMag = rawX, rawY, rawZ
+    return lastMag
 
 
 # 加速度センサを較正する
@@ -379,24 +362,25 @@ if __name__ == '__main__':
     fmt_name = "/home/pi/data/mpu9250wpi_logs_{0:%Y%m%d-%H%M%S}.csv".format(now)
     f_mpu9250 = open(fmt_name, 'w')  # 書き込みファイル
     # f_mpu9250= open('home/pi/data/mpu9250wpi_logs.csv', 'w')    #書き込みファイル
-    value = "yyyy-mm-dd hh:mm:ss.mmmmmm, x[g],y[g],z[g],x[dps],y[dps],z[dps],x[uT],y[uT],z[uT]"  # header行への書き込み内容
+    # 時刻の列はmonotonic_ns 実際の時刻はanchor_unix + (t - anchor_ns) / 1e9
+    f_mpu9250.write("# anchor_ns=%(anchor_ns)d,anchor_unix=%(anchor_unix).6f\n" % clock_anchor())
+    value = "t[ns],x[g],y[g],z[g],x[dps],y[dps],z[dps],x[uT],y[uT],z[uT]"  # header行への書き込み内容
     f_mpu9250.write(value + "\n")  # header行をファイル出力
+    period = int(SAMPLING_TIME * 1e9)
     # while True:
     for _i in range(TIMES):
         try:
-            date = datetime.datetime.now()  # now()メソッドで現在日付・時刻のdatetime型データの変数を取得 世界時：UTCnow
-            now = time.time()  # 現在時刻の取得
-            acc = getAccel()  # 加速度値の取得
-            gyr = getGyro()  # ジャイロ値の取得
+            now = monotonic_ns()  # 読み出し直前の時刻[ns]
+            acc, temp_mpu, gyr = getAccelTempGyro()  # 加速度・ジャイロ値をまとめて取得
             mag = getMag()  # 磁気値の取得
             # データの表示
             # ファイルへ書出し
-            value = "%s,%6.3f,%6.3f,%6.3f,%6.3f,%6.3f,%6.3f,%6.3f,%6.3f,%6.3f" % (
-            date, acc[0], acc[1], acc[2], gyr[0], gyr[1], gyr[2], mag[0], mag[1], mag[2])  # 時間、xyz軸回りの加速度
+            value = "%d,%6.3f,%6.3f,%6.3f,%6.3f,%6.3f,%6.3f,%6.3f,%6.3f,%6.3f" % (
+            now, acc[0], acc[1], acc[2], gyr[0], gyr[1], gyr[2], mag[0], mag[1], mag[2])  # 時間、xyz軸回りの加速度
             print(value)
             f_mpu9250.write(value + "\n")  # ファイルを出力
             # 指定秒数の一時停止
-            sleepTime = SAMPLING_TIME - (time.time() - now)
+            sleepTime = (period - (monotonic_ns() - now)) / 1e9
             if sleepTime < 0.0:
                 continue
             time.sleep(sleepTime)
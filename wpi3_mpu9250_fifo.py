@@ -0,0 +1,172 @@
+#!/usr/bin/python3 -u
+# -*- coding: utf-8 -*-
+
+############################################################
+# Written by pond-e
+#
+# Environment:  Python 3.4.2
+#               OS: Raspi OS
+#               on Raspberry Pi Zero W
+# Used sensor: MPU-9250(Strawberry Linux)
+#
+# MPU-9250の内蔵FIFO(512バイト)を使って加速度・ジャイロを取得する
+# センサ側がサンプリングレートどおりにFIFOへ書き込むので、
+# Python側が止まっても(GC、ファイル書き込み、print)FIFOが溢れない限り
+# サンプルは抜けない。FIFO_COUNTを見てまとめて読み出し、
+# 時刻はサンプル番号とサンプリングレートから復元する。
+#
+# 起動方法
+# pi@raspberrypi ~ $ sudo python3 wpi3_mpu9250_fifo.py
+############################################################
+
+import struct
+import time
+
+from wpi3_clock import monotonic_ns
+
+# レジスタ
+REG_SMPLRT_DIV = 0x19
+REG_CONFIG = 0x1A
+REG_GYRO_CONFIG = 0x1B
+REG_ACCEL_CONFIG1 = 0x1C
+REG_ACCEL_CONFIG2 = 0x1D
+REG_FIFO_EN = 0x23
+REG_INT_STATUS = 0x3A
+REG_USER_CTRL = 0x6A
+REG_PWR_MGMT_1 = 0x6B
+REG_FIFO_COUNTH = 0x72
+REG_FIFO_R_W = 0x74
+
+FIFO_EN_GYRO = 0x70  # GYRO_XOUT, GYRO_YOUT, GYRO_ZOUT
+FIFO_EN_ACCEL = 0x08
+USER_CTRL_FIFO_EN = 0x40
+USER_CTRL_FIFO_RST = 0x04
+USER_CTRL_RESET_BITS = 0x07  # FIFO_RST, I2C_MST_RST, SIG_COND_RST (書いたあと0に戻る)
+INT_STATUS_FIFO_OVERFLOW = 0x10
+
+FIFO_SIZE = 512  # [byte]
+FRAME_SIZE = 12  # 加速度6バイト + ジャイロ6バイト
+FRAME = struct.Struct('>6h')
+
+
+class FifoOverflow(Exception):
+    pass
+
+
+class MPU9250Fifo(object):
+    # i2c: wpi3_i2c.I2C, fd: i2c.setup(0x68)の戻り値
+    # rate: サンプリングレート[Hz] (1000 / (1 + SMPLRT_DIV))
+    # accelCoefficient, gyroCoefficient: 生データから[g], [dps]への変換係数
+    def __init__(self, i2c, fd, rate=1000, accelCoefficient=8 / float(0x8000),
+                 gyroCoefficient=1000 / float(0x8000)):
+        self.i2c = i2c
+        self.fd = fd
+        self.div = max(0, min(255, int(round(1000.0 / rate)) - 1))
+        self.rate = 1000.0 / (1 + self.div)
+        self.period = 1.0 / self.rate
+        self.period_ns = 1000000 * (1 + self.div)  # 内部の1kHzを分周するので整数になる
+        self.accelCoefficient = accelCoefficient
+        self.gyroCoefficient = gyroCoefficient
+        self.t0 = 0  # 最初のサンプルの時刻[ns]
+        self.index = 0  # FIFOリセットからのサンプル番号
+        self.overflows = 0  # FIFOオーバーフローの回数
+
+    # FIFOモードの設定をしてFIFOを空にする
+    # 加速度・ジャイロのレンジ設定はそのまま使う
+    def start(self):
+        self.i2c.writeReg8(self.fd, REG_FIFO_EN, 0x00)
+        self.i2c.writeReg8(self.fd, REG_SMPLRT_DIV, self.div)
+        # DLPF_CFG=1 (ジャイロ184Hz, 内部1kHz), FIFO_MODE=0 (溢れたら古いデータを上書き)
+        self.i2c.writeReg8(self.fd, REG_CONFIG, 0x01)
+        # ACCEL_FCHOICE_B=0, A_DLPF_CFG=1 (加速度184Hz, 内部1kHz)
+        self.i2c.writeReg8(self.fd, REG_ACCEL_CONFIG2, 0x01)
+        self.reset()
+        self.i2c.writeReg8(self.fd, REG_FIFO_EN, FIFO_EN_GYRO | FIFO_EN_ACCEL)
+
+    # USER_CTRLのFIFO以外のビット(I2C_MST_ENなど)はそのまま残す
+    def _userCtrl(self):
+        return self.i2c.readReg8(self.fd, REG_USER_CTRL) & ~(USER_CTRL_FIFO_EN | USER_CTRL_RESET_BITS)
+
+    # FIFOを止める
+    def stop(self):
+        self.i2c.writeReg8(self.fd, REG_FIFO_EN, 0x00)
+        self.i2c.writeReg8(self.fd, REG_USER_CTRL, self._userCtrl())
+
+    # FIFOをリセットして時刻の基準を取り直す
+    def reset(self):
+        ctrl = self._userCtrl()
+        self.i2c.writeReg8(self.fd, REG_USER_CTRL, ctrl | USER_CTRL_FIFO_RST)
+        self.i2c.writeReg8(self.fd, REG_USER_CTRL, ctrl | USER_CTRL_FIFO_EN)
+        self.t0 = monotonic_ns() + self.period_ns
+        self.index = 0
+
+    # FIFOにたまっているバイト数
+    def count(self):
+        data = self.i2c.readBlock(self.fd, REG_FIFO_COUNTH, 2)
+        return ((data[0] & 0x1F) << 8) | data[1]
+
+    # FIFOにたまっているサンプルをまとめて読み出す
+    # 戻り値は(時刻(monotonic_ns), ax, ay, az[g], gx, gy, gz[dps])のリスト
+    # オーバーフローしていた場合はFIFOをリセットしてFifoOverflowを投げる
+    def read(self):
+        if self.i2c.readReg8(self.fd, REG_INT_STATUS) & INT_STATUS_FIFO_OVERFLOW:
+            self.overflows += 1
+            self.reset()
+            raise FifoOverflow('FIFO overflow, %d samples lost at least' % (FIFO_SIZE // FRAME_SIZE))
+        n = self.count() // FRAME_SIZE
+        if n == 0:
+            return []
+        data = self.i2c.readBlock(self.fd, REG_FIFO_R_W, n * FRAME_SIZE)
+        ac = self.accelCoefficient
+        gc = self.gyroCoefficient
+        t0 = self.t0
+        period = self.period_ns
+        i = self.index
+        samples = []
+        for ax, ay, az, gx, gy, gz in FRAME.iter_unpack(data):
+            samples.append((t0 + i * period, ac * ax, ac * ay, ac * az, gc * gx, gc * gy, gc * gz))
+            i += 1
+        self.index = i
+        return samples
+
+    # FIFOが半分ほどたまるのを待ってから読み出し、サンプルを1つずつ返す
+    # オーバーフローした場合はself.overflowsを数えて読み出しを続ける
+    def stream(self):
+        wait = (FIFO_SIZE // FRAME_SIZE // 2) * self.period
+        while True:
+            try:
+                samples = self.read()
+            except FifoOverflow:
+                continue
+            for sample in samples:
+                yield sample
+            time.sleep(wait)
+
+
+if __name__ == '__main__':
+    import datetime
+    import wiringpi as wi
+    from wpi3_i2c import I2C
+    from wpi3_clock import clock_anchor
+
+    wi.wiringPiSetup()  # wiringPiの初期化
+    i2c = I2C()
+    mpu9250 = i2c.setup(0x68)
+    i2c.writeReg8(mpu9250, REG_PWR_MGMT_1, 0x00)
+    time.sleep(0.1)
+    i2c.writeReg8(mpu9250, REG_GYRO_CONFIG, 0x10)  # 1000dps
+    i2c.writeReg8(mpu9250, REG_ACCEL_CONFIG1, 0x10)  # 8g
+    fifo = MPU9250Fifo(i2c, mpu9250, rate=1000)
+    fifo.start()
+
+    now = datetime.datetime.now()
+    fmt_name = "/home/pi/data/mpu9250fifo_logs_{0:%Y%m%d-%H%M%S}.csv".format(now)
+    with open(fmt_name, 'w') as f:
+        f.write("# anchor_ns=%(anchor_ns)d,anchor_unix=%(anchor_unix).6f\n" % clock_anchor())
+        f.write("t[ns],x[g],y[g],z[g],x[dps],y[dps],z[dps]\n")  # header行をファイル出力
+        try:
+            for s in fifo.stream():
+                f.write("%d,%6.3f,%6.3f,%6.3f,%6.3f,%6.3f,%6.3f\n" % s)
+        except KeyboardInterrupt:
+            pass
+    fifo.stop()
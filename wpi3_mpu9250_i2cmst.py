@@ -0,0 +1,241 @@
+#!/usr/bin/python3 -u
+# -*- coding: utf-8 -*-
+
+############################################################
+# Written by pond-e
+#
+# Environment:  Python 3.4.2
+#               OS: Raspi OS
+#               on Raspberry Pi Zero W
+# Used sensor: MPU-9250(Akiduki denshi)
+#
+# MPU-9250の内蔵I2Cマスタで磁気センサ(AK8963)を読み出す
+# ・BYPASS_ENを使わず、MPU-9250がサンプルごとにAK8963のST1~ST2(8バイト)を読んで
+#   EXT_SENS_DATA_00(0x49~)にコピーする(I2C_SLV0)
+# ・0x3B~0x50の22バイトを1回のブロック読み出しで取ると、加速度、温度、ジャイロ、
+#   磁気がそろう(ST1のポーリング、1バイトずつの読み出し、ST2の読み出しがいらない)
+# ・AK8963への書き込み(モード設定)はI2C_SLV4で行う
+# ・SLV0はサンプリングレートで動くので、I2C_MST_DLYで磁気の出力レート(100Hz)くらいに間引く
+# ・ST1~ST2を毎回読むとAK8963のDRDYは消えるので、DRDYが立つのは測定直後の1回だけ
+#   HX~HZはその間も最新の値なので、DRDYは見ずにST2のHOFLだけを確かめる
+# ・fifo=TrueならSLV0のデータもFIFOに入れる(加速度+ジャイロ+磁気で1サンプル20バイト)
+#
+# 起動方法(従来のバイパス方式との1サンプルあたりの時間の比較)
+# pi@raspberrypi ~ $ sudo python3 wpi3_mpu9250_i2cmst.py
+############################################################
+
+import struct
+import time
+
+# レジスタ
+REG_SMPLRT_DIV = 0x19
+REG_CONFIG = 0x1A
+REG_I2C_MST_CTRL = 0x24
+REG_I2C_SLV0_ADDR = 0x25
+REG_I2C_SLV0_REG = 0x26
+REG_I2C_SLV0_CTRL = 0x27
+REG_I2C_SLV4_ADDR = 0x31
+REG_I2C_SLV4_REG = 0x32
+REG_I2C_SLV4_DO = 0x33
+REG_I2C_SLV4_CTRL = 0x34
+REG_I2C_MST_STATUS = 0x36
+REG_INT_PIN_CFG = 0x37
+REG_ACCEL_XOUT_H = 0x3B
+REG_EXT_SENS_DATA_00 = 0x49
+REG_I2C_MST_DELAY_CTRL = 0x67
+REG_FIFO_EN = 0x23
+REG_USER_CTRL = 0x6A
+REG_FIFO_COUNTH = 0x72
+REG_FIFO_R_W = 0x74
+
+AK8963_ADDRESS = 0x0C
+AK8963_ST1 = 0x02
+AK8963_CNTL1 = 0x0A
+
+I2C_READ = 0x80  # I2C_SLVx_ADDRの読み出しフラグ
+I2C_SLV_EN = 0x80
+I2C_MST_CLK_400K = 0x0D
+I2C_SLV4_DONE = 0x40
+USER_CTRL_I2C_MST_EN = 0x20
+USER_CTRL_FIFO_EN = 0x40
+USER_CTRL_FIFO_RST = 0x04
+INT_PIN_CFG_BYPASS_EN = 0x02
+FIFO_EN_GYRO_ACCEL = 0x78
+FIFO_EN_SLV0 = 0x01
+
+MAG_LENGTH = 8  # ST1, HXL~HZH, ST2
+BURST_LENGTH = 14 + MAG_LENGTH  # 0x3B~0x50
+IMU = struct.Struct('>7h')  # 加速度、温度、ジャイロ(ビッグエンディアン)
+MAG = struct.Struct('<B3hB')  # ST1, x, y, z, ST2 (AK8963はリトルエンディアン)
+FIFO_FRAME = struct.Struct('>6h')  # FIFOの加速度、ジャイロ(温度は入れない)
+FIFO_FRAME_SIZE = FIFO_FRAME.size + MAG_LENGTH
+MAG_MODE_RATE = {0x02: 8.0, 0x06: 100.0}  # AK8963の連続測定モードの出力レート[Hz]
+
+
+# MPU-9250のサンプリングレート[Hz]
+# DLPF_CFGが1~6なら1kHz / (1 + SMPLRT_DIV)、0と7ならSMPLRT_DIVは効かず8kHz
+def sample_rate(i2c, fd):
+    dlpf = i2c.readReg8(fd, REG_CONFIG) & 0x07
+    if dlpf == 0 or dlpf == 7:
+        return 8000.0
+    return 1000.0 / (1 + i2c.readReg8(fd, REG_SMPLRT_DIV))
+
+
+# rate[Hz]のサンプルごとに動くSLV0を、mag_rate[Hz]くらいに間引くI2C_MST_DLY(0~31)
+def mag_delay_for(rate, mag_rate):
+    return max(0, min(0x1F, int(round(rate / mag_rate)) - 1))
+
+
+class MPU9250I2CMaster(object):
+    # i2c: wpi3_i2c.I2C, mpu_fd: i2c.setup(0x68)の戻り値
+    # asa: AK8963の感度調整値(wpi3_magcal.readASA()、バイパス方式のうちに読んでおく)
+    def __init__(self, i2c, mpu_fd, accelCoefficient=8 / float(0x8000), gyroCoefficient=1000 / float(0x8000),
+                 magCoefficient=4912 / 32760.0, asa=(1.0, 1.0, 1.0)):
+        self.i2c = i2c
+        self.fd = mpu_fd
+        self.accelCoefficient = accelCoefficient
+        self.gyroCoefficient = gyroCoefficient
+        self.magCx = magCoefficient * asa[0]
+        self.magCy = magCoefficient * asa[1]
+        self.magCz = magCoefficient * asa[2]
+        self.magOverflows = 0  # 磁気センサのオーバーフローの回数
+        self.magDelay = 0
+        self.fifo = False
+
+    # I2C_SLV4でAK8963のレジスタに1バイト書く
+    def akWrite(self, reg, data, timeout=0.05):
+        i2c = self.i2c
+        i2c.writeReg8(self.fd, REG_I2C_SLV4_ADDR, AK8963_ADDRESS)
+        i2c.writeReg8(self.fd, REG_I2C_SLV4_REG, reg)
+        i2c.writeReg8(self.fd, REG_I2C_SLV4_DO, data)
+        i2c.writeReg8(self.fd, REG_I2C_SLV4_CTRL, I2C_SLV_EN)
+        end = time.monotonic() + timeout
+        while not i2c.readReg8(self.fd, REG_I2C_MST_STATUS) & I2C_SLV4_DONE:
+            if time.monotonic() > end:
+                raise IOError('AK8963 write timeout (reg 0x%02x)' % reg)
+            time.sleep(0.001)
+
+    # バイパスをやめてI2Cマスタを有効にし、AK8963を連続測定モードにする
+    # mode: AK8963のCNTL1 (0x16: 100Hz連続測定, 16bit)
+    # mag_delay: 磁気を読む間隔(サンプリングレート / (1 + mag_delay)ごと) 0なら毎サンプル
+    #            Noneなら今のサンプリングレートとmodeの出力レートから決める
+    # fifo: Trueなら加速度、ジャイロ、磁気をFIFOに入れる
+    def enable(self, mode=0x16, mag_delay=None, fifo=False):
+        i2c = self.i2c
+        fd = self.fd
+        if mag_delay is None:
+            mag_delay = mag_delay_for(sample_rate(i2c, fd), MAG_MODE_RATE.get(mode & 0x0F, 100.0))
+        self.magDelay = mag_delay
+        i2c.writeReg8(fd, REG_INT_PIN_CFG, 0x00)  # BYPASS_EN=0
+        i2c.writeReg8(fd, REG_USER_CTRL, USER_CTRL_I2C_MST_EN)
+        i2c.writeReg8(fd, REG_I2C_MST_CTRL, I2C_MST_CLK_400K)
+        self.akWrite(AK8963_CNTL1, 0x00)  # パワーダウンを挟んでからモードを変える
+        time.sleep(0.01)
+        self.akWrite(AK8963_CNTL1, mode)
+        time.sleep(0.01)
+        # SLV4の遅延設定(I2C_MST_DLY)をSLV0にも使う
+        i2c.writeReg8(fd, REG_I2C_SLV4_CTRL, mag_delay & 0x1F)
+        i2c.writeReg8(fd, REG_I2C_MST_DELAY_CTRL, 0x01 if mag_delay else 0x00)
+        # ST1からST2までの8バイトをEXT_SENS_DATA_00~07へ
+        i2c.writeReg8(fd, REG_I2C_SLV0_ADDR, I2C_READ | AK8963_ADDRESS)
+        i2c.writeReg8(fd, REG_I2C_SLV0_REG, AK8963_ST1)
+        i2c.writeReg8(fd, REG_I2C_SLV0_CTRL, I2C_SLV_EN | MAG_LENGTH)
+        self.fifo = fifo
+        if fifo:
+            i2c.writeReg8(fd, REG_FIFO_EN, 0x00)
+            i2c.writeReg8(fd, REG_USER_CTRL, USER_CTRL_I2C_MST_EN | USER_CTRL_FIFO_RST)
+            i2c.writeReg8(fd, REG_USER_CTRL, USER_CTRL_I2C_MST_EN | USER_CTRL_FIFO_EN)
+            i2c.writeReg8(fd, REG_FIFO_EN, FIFO_EN_GYRO_ACCEL | FIFO_EN_SLV0)
+        time.sleep(0.01)
+
+    # I2Cマスタを止めてバイパス方式に戻す
+    def disable(self):
+        i2c = self.i2c
+        fd = self.fd
+        i2c.writeReg8(fd, REG_FIFO_EN, 0x00)
+        i2c.writeReg8(fd, REG_I2C_SLV0_CTRL, 0x00)
+        i2c.writeReg8(fd, REG_USER_CTRL, 0x00)
+        i2c.writeReg8(fd, REG_INT_PIN_CFG, INT_PIN_CFG_BYPASS_EN)
+
+    # 磁気の8バイトを[uT]にする オーバーフローならNone
+    # ST1のDRDYはSLV0が読むたびに消えるので見ない(値は次の測定まで最新のまま)
+    def _mag(self, st1, x, y, z, st2):
+        if st2 & 0x08:
+            self.magOverflows += 1
+            return None
+        return x * self.magCx, y * self.magCy, z * self.magCz
+
+    # 22バイトを1回で読み出す
+    # 戻り値は(加速度(x,y,z)[g], 温度[℃], ジャイロ(x,y,z)[dps], 磁気(x,y,z)[uT]またはNone)
+    def read(self):
+        data = self.i2c.readBlock(self.fd, REG_ACCEL_XOUT_H, BURST_LENGTH)
+        ax, ay, az, t, gx, gy, gz = IMU.unpack_from(data, 0)
+        ac = self.accelCoefficient
+        gc = self.gyroCoefficient
+        return ((ac * ax, ac * ay, ac * az), t / 333.87 + 21.0, (gc * gx, gc * gy, gc * gz),
+                self._mag(*MAG.unpack_from(data, 14)))
+
+    # FIFOにたまっているサンプルをまとめて読み出す(enable(fifo=True)のとき)
+    # 戻り値は(加速度(x,y,z)[g], ジャイロ(x,y,z)[dps], 磁気(x,y,z)[uT]またはNone)のリスト
+    def readFifo(self):
+        data = self.i2c.readBlock(self.fd, REG_FIFO_COUNTH, 2)
+        n = (((data[0] & 0x1F) << 8) | data[1]) // FIFO_FRAME_SIZE
+        if n == 0:
+            return []
+        data = self.i2c.readBlock(self.fd, REG_FIFO_R_W, n * FIFO_FRAME_SIZE)
+        ac = self.accelCoefficient
+        gc = self.gyroCoefficient
+        samples = []
+        for i in range(0, n * FIFO_FRAME_SIZE, FIFO_FRAME_SIZE):
+            ax, ay, az, gx, gy, gz = FIFO_FRAME.unpack_from(data, i)
+            samples.append(((ac * ax, ac * ay, ac * az), (gc * gx, gc * gy, gc * gz),
+                            self._mag(*MAG.unpack_from(data, i + FIFO_FRAME.size))))
+        return samples
+
+
+if __name__ == '__main__':
+    import wiringpi as wi
+    from wpi3_i2c import I2C
+    from wpi3_drdy import DataReadyAcquisition
+    from wpi3_magcal import readASA
+
+    wi.wiringPiSetup()  # wiringPiの初期化
+    i2c = I2C()
+    mpu9250 = i2c.setup(0x68)
+    AK8963 = i2c.setup(AK8963_ADDRESS)
+    i2c.writeReg8(mpu9250, 0x6B, 0x00)  # PWR_MGMT_1をクリア
+    time.sleep(0.1)
+    i2c.writeReg8(mpu9250, REG_INT_PIN_CFG, INT_PIN_CFG_BYPASS_EN)
+    i2c.writeReg8(mpu9250, 0x1B, 0x10)  # 1000dps
+    i2c.writeReg8(mpu9250, 0x1C, 0x10)  # 8g
+    i2c.writeReg8(mpu9250, REG_CONFIG, 0x01)  # DLPF 184Hz (サンプリングレート1kHz、SLV0は10回に1回)
+    asa = readASA(i2c, AK8963)
+    count = 1000
+
+    # バイパス方式: 14バイト + ST1 + 7バイト
+    i2c.writeReg8(AK8963, AK8963_CNTL1, 0x16)  # 100Hz連続測定モード, 16bit
+    bypass = DataReadyAcquisition(i2c, mpu9250, AK8963, None)
+    start = time.perf_counter()
+    for _i in range(count):
+        i2c.readBlock(mpu9250, REG_ACCEL_XOUT_H, 14)
+        bypass.readMag()
+    bypass_us = (time.perf_counter() - start) / count * 1e6
+
+    # I2Cマスタ方式: 22バイト1回
+    mst = MPU9250I2CMaster(i2c, mpu9250, asa=asa)
+    mst.enable()
+    start = time.perf_counter()
+    for _i in range(count):
+        acc, temp, gyr, mag = mst.read()
+    master_us = (time.perf_counter() - start) / count * 1e6
+    print("bypass     : %8.1f us/sample" % bypass_us)
+    print("I2C master : %8.1f us/sample" % master_us)
+    try:
+        while True:
+            acc, temp, gyr, mag = mst.read()
+            if mag is not None:
+                print("acc=%6.3f,%6.3f,%6.3f gyr=%7.2f,%7.2f,%7.2f mag=%6.1f,%6.1f,%6.1f" % (acc + gyr + mag))
+            time.sleep(0.01)
+    except KeyboardInterrupt:
+        pass
+    mst.disable()
@@ -0,0 +1,249 @@
+#!/usr/bin/python3 -u
+# -*- coding: utf-8 -*-
+
+############################################################
+# Written by pond-e
+#
+# Environment:  Python 3.4.2
+#               OS: Raspi OS
+#               on Raspberry Pi Zero W
+# Used sensor: AE-GYSFDMAXB(GPS)
+#
+# NMEAセンテンスを少しずつ受け取りながら解析するパーサ
+# ・シリアルから読んだバイト列をそのままfeed()に渡す(行の途中で切れていてよい)
+# ・*hhのチェックサムを確認し、合わないセンテンスは捨てて数える
+# ・GP(GPS), GN(複数衛星系), QZ(みちびき), GL, GA, BDなどのトーカーに対応し、
+#   センテンスの種類(GGA, GSV, ZDA, RMC, GSA, VTG)ごとの関数を表から引いて
+#   namedtupleにして返す
+#
+# 速度の確認(記録したNMEAのファイルを与える。なければ内蔵のサンプルを使う)
+# pi@raspberrypi ~ $ python3 wpi3_nmea.py datanmea.txt
+############################################################
+
+import datetime
+import sys
+import time
+from collections import namedtuple
+
+# 緯度、経度は10進の度(南緯、西経は負)、時刻はUTCのその日の0時からの秒
+GGA = namedtuple('GGA', ['talker', 'time', 'lat', 'lon', 'quality', 'num_sats', 'hdop', 'altitude', 'geoid'])
+RMC = namedtuple('RMC', ['talker', 'time', 'valid', 'lat', 'lon', 'speed', 'course', 'date'])
+GSA = namedtuple('GSA', ['talker', 'mode', 'fix', 'prns', 'pdop', 'hdop', 'vdop'])
+GSV = namedtuple('GSV', ['talker', 'num_msgs', 'msg_num', 'num_sats', 'sats'])
+Satellite = namedtuple('Satellite', ['prn', 'elevation', 'azimuth', 'snr'])
+ZDA = namedtuple('ZDA', ['talker', 'time', 'utc'])
+VTG = namedtuple('VTG', ['talker', 'course', 'course_mag', 'speed_knots', 'speed_kmh'])
+# PMTKコマンドへの応答 $PMTK001,コマンド番号,結果 (3なら成功)
+PMTKAck = namedtuple('PMTKAck', ['talker', 'command', 'flag'])
+
+MAX_SENTENCE = 120  # これより長い行は壊れているとみなす(規格上は82文字)
+
+
+# $と*の間のバイトのXOR
+# バイト列を1つの整数にして半分ずつ畳み込む(1バイトずつループするより速い)
+def checksum(body):
+    width = len(body)
+    x = int.from_bytes(body, 'little')
+    while width > 1:
+        half = (width + 1) // 2
+        bits = half * 8
+        x = (x >> bits) ^ (x & ((1 << bits) - 1))
+        width = half
+    return x
+
+
+def _float(s):
+    return float(s) if s else None
+
+
+def _int(s):
+    return int(s) if s else None
+
+
+# hhmmss.ss -> 0時からの秒
+def _time(s):
+    if not s:
+        return None
+    return int(s[0:2]) * 3600 + int(s[2:4]) * 60 + float(s[4:])
+
+
+# ddmm.mmmm(緯度) / dddmm.mmmm(経度) -> 10進の度
+def _degree(s, hemisphere, deg_len):
+    if not s:
+        return None
+    value = int(s[:deg_len]) + float(s[deg_len:]) / 60.0
+    if hemisphere in (b'S', b'W'):
+        value = -value
+    return value
+
+
+def parse_gga(talker, f):
+    return GGA(talker, _time(f[1]), _degree(f[2], f[3], 2), _degree(f[4], f[5], 3),
+               _int(f[6]), _int(f[7]), _float(f[8]), _float(f[9]), _float(f[11]))
+
+
+def parse_rmc(talker, f):
+    date = None
+    if f[9]:
+        d = f[9]
+        date = datetime.date(2000 + int(d[4:6]), int(d[2:4]), int(d[0:2]))
+    return RMC(talker, _time(f[1]), f[2] == b'A', _degree(f[3], f[4], 2), _degree(f[5], f[6], 3),
+               _float(f[7]), _float(f[8]), date)
+
+
+def parse_gsa(talker, f):
+    prns = tuple(int(p) for p in f[3:15] if p)
+    return GSA(talker, f[1].decode(), _int(f[2]), prns, _float(f[15]), _float(f[16]), _float(f[17]))
+
+
+def parse_gsv(talker, f):
+    sats = []
+    # 1センテンスに最大4衛星 (番号, 仰角, 方位角, C/N) の繰り返し
+    for i in range(4, len(f) - 3, 4):
+        if f[i]:
+            sats.append(Satellite(int(f[i]), _int(f[i + 1]), _int(f[i + 2]), _int(f[i + 3])))
+    return GSV(talker, int(f[1]), int(f[2]), _int(f[3]), tuple(sats))
+
+
+def parse_zda(talker, f):
+    t = _time(f[1])
+    utc = None
+    if t is not None and f[4]:
+        utc = datetime.datetime(int(f[4]), int(f[3]), int(f[2])) + datetime.timedelta(seconds=t)
+    return ZDA(talker, t, utc)
+
+
+def parse_vtg(talker, f):
+    return VTG(talker, _float(f[1]), _float(f[3]), _float(f[5]), _float(f[7]))
+
+
+def parse_pmtk_ack(talker, f):
+    return PMTKAck(talker, int(f[1]), int(f[2]))
+
+
+# センテンスの種類 -> (解析関数, 最低限必要なフィールド数)
+PARSERS = {
+    b'GGA': (parse_gga, 12),
+    b'RMC': (parse_rmc, 10),
+    b'GSA': (parse_gsa, 18),
+    b'GSV': (parse_gsv, 4),
+    b'ZDA': (parse_zda, 5),
+    b'VTG': (parse_vtg, 8),
+    b'001': (parse_pmtk_ack, 3),  # PMTK001
+}
+
+
+class NMEAParser(object):
+    def __init__(self, parsers=PARSERS):
+        self.parsers = parsers
+        self.buf = b''
+        # 統計情報
+        self.sentences = 0  # 解析できたセンテンス数
+        self.bad_checksum = 0  # チェックサムが合わなかった数
+        self.malformed = 0  # 形式がおかしかった数
+        self.unknown = 0  # 表にない種類の数
+
+    # 受信したバイト列を渡すと、解析できたセンテンスのリストを返す
+    # 行の途中までのデータは次のfeed()まで持ち越す
+    def feed(self, data):
+        buf = self.buf + data if self.buf else data
+        lines = buf.split(b'\n')
+        self.buf = lines.pop()
+        if len(self.buf) > MAX_SENTENCE:
+            self.buf = b''
+            self.malformed += 1
+        results = []
+        append = results.append
+        for line in lines:
+            msg = self.parse_line(line)
+            if msg is not None:
+                append(msg)
+        return results
+
+    # 1行を解析する 解析できなければNone
+    def parse_line(self, line):
+        start = line.find(b'$')
+        star = line.rfind(b'*')
+        if start < 0 or star < start or len(line) < star + 3:
+            if line.strip():
+                self.malformed += 1
+            return None
+        body = line[start + 1:star]
+        try:
+            expected = int(line[star + 1:star + 3], 16)
+        except ValueError:
+            self.malformed += 1
+            return None
+        if checksum(body) != expected:
+            self.bad_checksum += 1
+            return None
+        fields = body.split(b',')
+        address = fields[0]
+        entry = self.parsers.get(address[-3:])
+        if entry is None:
+            self.unknown += 1
+            return None
+        func, min_fields = entry
+        if len(fields) < min_fields:
+            self.malformed += 1
+            return None
+        try:
+            msg = func(address[:-3].decode(), fields)
+        except (ValueError, IndexError):
+            self.malformed += 1
+            return None
+        self.sentences += 1
+        return msg
+
+    def stats(self):
+        return {'sentences': self.sentences, 'bad_checksum': self.bad_checksum,
+                'malformed': self.malformed, 'unknown': self.unknown}
+
+
+# 10進の度 -> (ddmm.mmmm / dddmm.mmmm, 半球) _degree()の逆 hemispheres: 'NS'または'EW'
+def format_degree(value, deg_len, hemispheres):
+    m = round(abs(value) * 60.0, 4)
+    d = int(m // 60)
+    return '%0*d%07.4f' % (deg_len, d, m - d * 60), hemispheres[value < 0]
+
+
+# チェックサムを付けてセンテンスを作る(テスト用のデータやPMTKコマンドに使う)
+def make_sentence(body):
+    if isinstance(body, str):
+        body = body.encode('ascii')
+    return b'$' + body + b'*' + ('%02X' % checksum(body)).encode('ascii') + b'\r\n'
+
+
+SAMPLE = b''.join(make_sentence(s) for s in [
+    'GPGGA,085120.307,3541.1493,N,13945.3994,E,1,08,1.0,6.9,M,35.9,M,,0000',
+    'GPGSA,A,3,29,26,05,10,02,27,08,15,,,,,1.8,1.0,1.5',
+    'GPGSV,3,1,12,26,72,352,34,05,63,073,33,29,53,199,43,02,42,129,30',
+    'GPGSV,3,2,12,15,40,050,32,10,26,305,28,27,20,170,27,08,11,262,25',
+    'GPGSV,3,3,12,21,07,041,,13,06,116,,16,05,312,,193,63,175,41',
+    'GPRMC,085120.307,A,3541.1493,N,13945.3994,E,000.0,240.3,181215,,,A',
+    'GPVTG,240.3,T,,M,000.0,N,000.0,K,A',
+    'GPZDA,085120.307,18,12,2015,,',
+])
+
+
+# corpusを chunk バイトずつfeed()してスループットを測る
+# 戻り値は(センテンス/秒, MB/秒, 統計情報)
+def benchmark(corpus, chunk=256, repeat=1):
+    parser = NMEAParser()
+    start = time.perf_counter()
+    for _r in range(repeat):
+        for i in range(0, len(corpus), chunk):
+            parser.feed(corpus[i:i + chunk])
+    elapsed = time.perf_counter() - start
+    return parser.sentences / elapsed, len(corpus) * repeat / elapsed / 1e6, parser.stats()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], 'rb') as f:
+            corpus = f.read()
+    else:
+        corpus = SAMPLE * 2000
+    rate, mbps, stats = benchmark(corpus)
+    print("%10.0f sentences/s  %6.2f MB/s" % (rate, mbps))
+    print(stats)
@@ -0,0 +1,172 @@
+#!/usr/bin/python3 -u
+# -*- coding: utf-8 -*-
+
+############################################################
+# Written by pond-e
+#
+# Environment:  Python 3.4.2
+#               OS: Raspi OS
+#               on Raspberry Pi Zero W
+#
+# センサごとに別の周期で読み出すスケジューラ
+# スレッドをセンサごとに立てる(thread_test.py)代わりに、1つのスレッドが
+# I2Cバスを持ち、締め切り(次に読む時刻)が早い順にタスクを実行する。
+#   例) IMU 500Hz, 磁気 100Hz, 気圧 25Hz, GPSは届いたセンテンスごと
+# 実際に何Hzで読めたか(要求したレートとの比較)をreport()で確認できる。
+#
+# 起動方法
+# pi@raspberrypi ~ $ sudo python3 wpi3_scheduler.py
+############################################################
+
+import heapq
+import time
+
+
+class Task(object):
+    # name: 表示名, rate: 要求するレート[Hz], func: 呼び出す関数
+    # funcが数値を返した場合は処理した件数(GPSのセンテンス数など)として数える
+    def __init__(self, name, rate, func):
+        self.name = name
+        self.rate = float(rate)
+        self.period = 1.0 / rate
+        self.func = func
+        self.calls = 0  # 呼び出した回数
+        self.events = 0  # 処理した件数
+        self.skipped = 0  # 遅れたために飛ばした周期の数
+        self.max_late = 0.0  # 締め切りからの最大の遅れ[s]
+        self.errors = 0  # funcが例外を出した回数
+        self.last_error = None
+
+
+class Scheduler(object):
+    def __init__(self, clock=time.monotonic, sleep=time.sleep):
+        self.tasks = []
+        self.clock = clock
+        self.sleep = sleep
+        self.start_time = None
+        self._heap = []
+        self._running = False
+
+    # タスクを追加する
+    def add(self, name, rate, func):
+        task = Task(name, rate, func)
+        self.tasks.append(task)
+        return task
+
+    # 締め切りが早い順にタスクを実行する
+    # duration秒たつかstop()が呼ばれるまで戻らない(Noneなら止まるまで)
+    # タスクがひとつもなければValueError
+    def run(self, duration=None):
+        if not self.tasks:
+            raise ValueError('no tasks to run (add() first)')
+        clock = self.clock
+        now = clock()
+        if self.start_time is None:
+            self.start_time = now
+        heap = [(now, i, task) for i, task in enumerate(self.tasks)]
+        heapq.heapify(heap)
+        self._heap = heap
+        end = None if duration is None else now + duration
+        self._running = True
+        while self._running:
+            deadline, i, task = heap[0]
+            now = clock()
+            if end is not None and now >= end:
+                break
+            if deadline > now:
+                self.sleep(deadline - now if end is None else min(deadline, end) - now)
+                continue
+            late = now - deadline
+            if late > task.max_late:
+                task.max_late = late
+            try:
+                n = task.func()
+            except Exception as e:
+                task.errors += 1
+                task.last_error = e
+                n = 0
+            task.calls += 1
+            task.events += 1 if n is None else n
+            # 次の締め切り 1周期以上遅れていたら、遅れた分は飛ばす
+            deadline += task.period
+            now = clock()
+            if deadline < now:
+                missed = int((now - deadline) / task.period) + 1
+                task.skipped += missed
+                deadline += missed * task.period
+            heapq.heapreplace(heap, (deadline, i, task))
+        self._running = False
+
+    def stop(self):
+        self._running = False
+
+    # タスクごとの要求レートと実際のレート
+    # 戻り値は {name: (要求[Hz], 実際の呼び出し[Hz], 実際の件数[/s], 飛ばした周期, 最大遅れ[s], 例外)}
+    def report(self):
+        elapsed = max(self.clock() - self.start_time, 1e-9)
+        result = {}
+        for task in self.tasks:
+            result[task.name] = (task.rate, task.calls / elapsed, task.events / elapsed,
+                                 task.skipped, task.max_late, task.errors)
+        return result
+
+    def print_report(self):
+        print("%-8s %10s %10s %10s %8s %10s %6s" % ('task', 'req[Hz]', 'call[Hz]', 'event[/s]',
+                                                   'skipped', 'late[ms]', 'error'))
+        for name, (rate, call_rate, event_rate, skipped, late, errors) in self.report().items():
+            print("%-8s %10.1f %10.1f %10.1f %8d %10.2f %6d" % (name, rate, call_rate, event_rate,
+                                                              skipped, late * 1000, errors))
+
+
+if __name__ == '__main__':
+    import struct
+    import serial
+    import wiringpi as wi
+    from wpi3_i2c import I2C
+    from wpi3_bme280_driver import BME280
+    from wpi3_drdy import DataReadyAcquisition
+
+    wi.wiringPiSetup()  # wiringPiの初期化
+    i2c = I2C()
+    mpu9250 = i2c.setup(0x68)
+    AK8963 = i2c.setup(0x0C)
+    i2c.writeReg8(mpu9250, 0x6B, 0x00)  # PWR_MGMT_1をクリア
+    time.sleep(0.1)
+    i2c.writeReg8(mpu9250, 0x37, 0x02)  # BYPASS_EN=1
+    i2c.writeReg8(mpu9250, 0x1B, 0x10)  # 1000dps
+    i2c.writeReg8(mpu9250, 0x1C, 0x10)  # 8g
+    i2c.writeReg8(AK8963, 0x0A, 0x16)  # 100Hz連続測定モード, 16bit
+    mag = DataReadyAcquisition(i2c, mpu9250, AK8963, None)  # 磁気の読み出しだけ使う
+    bme = BME280(i2c, i2c.setup(0x76))
+    bme.setup()
+    ser = serial.Serial(port="/dev/ttyAMA0", baudrate=9600, timeout=0)  # 読めるだけ読んですぐ戻る
+
+    latest = {}
+
+    def read_imu():
+        latest['imu'] = struct.unpack('>7h', i2c.readBlock(mpu9250, 0x3B, 14))
+
+    def read_mag():
+        m = mag.readMag()
+        if m is None:
+            return 0
+        latest['mag'] = m
+
+    def read_baro():
+        latest['baro'] = bme.read()
+
+    def read_gps():
+        data = ser.read(ser.in_waiting or 1)
+        return data.count(b'\n')  # 届いたセンテンス数
+
+    sched = Scheduler()
+    sched.add('imu', 500, read_imu)
+    sched.add('mag', 100, read_mag)
+    sched.add('baro', 25, read_baro)
+    sched.add('gps', 50, read_gps)
+    try:
+        while True:
+            sched.run(5.0)
+            sched.print_report()
+    except KeyboardInterrupt:
+        sched.print_report()
@@ -0,0 +1,629 @@
+#!/usr/bin/python3 -u
+# -*- coding: utf-8 -*-
+
+############################################################
+# Written by pond-e
+#
+# Environment:  Python 3.4.2
+#               OS: Raspi OS
+#               on Raspberry Pi Zero W
+#
+# 実機なしで動かすためのセンサのシミュレータ
+# ・MPU-9250(0x68), AK8963(0x0C), BME280(0x76)のレジスタマップを
+#   wpi3_i2c.SimI2Cの上でまねる(ドライバはそのまま使える)
+#   MPU-9250: 加速度・温度・ジャイロ、FIFO、I2Cマスタ(SLV0, SLV4)
+#   AK8963: 連続測定・単発測定、ST1のDRDY(ST2を読むと次へ進む)、ASA
+#   BME280: キャリブレーション値から補正の逆を解いて生データを作る
+# ・GPSは疑似端末(pty)にNMEAを流す(wpi3_gps_receiver.FakeReceiverを使う)
+# ・値は飛行のプロファイル(FlightProfile)か、記録したCSVの再生(ReplayProfile)から作る
+#   speedで時間を1~100倍に進められる
+#   センサの出力レート(MPU-9250のサンプリングレート、AK8963の100Hzなど)は実時間のまま
+#
+# 使い方
+#    sim = Simulator(FlightProfile(), speed=10)
+#    sim.install()  # shared_bus()がシミュレータのバスになる
+#    gps = GPSReceiver(sim.start_gps())
+#
+# 飛行のプロファイルを10倍速で
+# pi@raspberrypi ~ $ python3 wpi3_simulator.py flight 10
+# 記録したCSVを50倍速で再生
+# pi@raspberrypi ~ $ python3 wpi3_simulator.py replay 50 cs17_wpi3_2sensors_logs_xxx.csv datagga_xxx.csv
+############################################################
+
+import bisect
+import datetime
+import math
+import random
+import struct
+import sys
+import time
+from collections import namedtuple
+
+from wpi3_bme280_driver import SAMPLE_CALIB_REGS, decode_calib, compensate_T, compensate_P, compensate_H
+from wpi3_gps_receiver import FakeReceiver
+from wpi3_i2c import SimI2C, RegisterMap, set_shared_backend
+
+GRAVITY = 9.80665  # [m/s^2]
+LAPSE_RATE = 0.0065  # 気温減率[K/m]
+METER_PER_DEGREE = 111320.0  # 緯度1度あたりの距離[m]
+
+# ある時刻の機体の状態
+# acc: 加速度(x, y, z)[g] (静止していればzが+1), gyr: 角速度[dps], mag: 磁場[uT] (どれもMPU-9250の軸)
+# temp[℃], press[hPa], humi[%], alt: 打ち上げ地点からの高度[m], lat, lon[度], sats: 衛星数
+SimState = namedtuple('SimState', ['acc', 'gyr', 'mag', 'temp', 'press', 'humi', 'alt', 'lat', 'lon', 'sats'])
+
+
+# 飛行のプロファイル(垂直に打ち上げてパラシュートで降りる)
+# ground: 打ち上げまでの時間[s], burn: 加速の時間[s], thrust: 加速度[m/s^2]
+# descent: 開傘後の降下速度[m/s], wind: 降下中に東へ流される速さ[m/s], spin: 飛行中のz軸の回転[dps]
+# 頂点までは抵抗なしの放物線、頂点で開傘して一定の速さで降りる
+class FlightProfile(object):
+    def __init__(self, ground=10.0, burn=2.0, thrust=50.0, descent=5.0, wind=2.0, spin=30.0,
+                 ground_pressure=1005.0, ground_temp=20.0, humi=50.0,
+                 lat=35 + 41.1493 / 60, lon=139 + 45.3994 / 60, field=(30.0, 35.0), noise=0.0, seed=0):
+        self.ground = ground
+        self.burn = burn
+        self.thrust = thrust
+        self.descent = descent
+        self.wind = wind
+        self.spin = spin
+        self.ground_pressure = ground_pressure
+        self.ground_temp = ground_temp
+        self.humi = humi
+        self.lat = lat
+        self.lon = lon
+        self.field = field  # 地磁気の水平成分と鉛直成分(下向き)[uT]
+        self.noise = noise  # 加速度[g]・角速度[dps]・磁場[uT]に加える雑音の標準偏差
+        self.rng = random.Random(seed)
+        self.burnout_speed = thrust * burn
+        self.burnout_alt = 0.5 * thrust * burn * burn
+        self.coast = self.burnout_speed / GRAVITY  # 燃焼終了から頂点までの時間
+        self.apogee = self.burnout_alt + self.burnout_speed ** 2 / (2 * GRAVITY)
+        self.landing = burn + self.coast + self.apogee / descent  # 打ち上げから着地までの時間
+        self.duration = ground + self.landing + 10.0
+        self.start_utc = None
+
+    # 打ち上げからtf秒後の(高度[m], 加速度計の値[g], 東への移動[m])
+    def _trajectory(self, tf):
+        if tf < 0:
+            return 0.0, 1.0, 0.0
+        if tf < self.burn:
+            return 0.5 * self.thrust * tf * tf, (self.thrust + GRAVITY) / GRAVITY, 0.0
+        dt = tf - self.burn
+        if dt < self.coast:
+            return self.burnout_alt + self.burnout_speed * dt - 0.5 * GRAVITY * dt * dt, 0.0, 0.0
+        dt = min(tf, self.landing) - self.burn - self.coast
+        return self.apogee - self.descent * dt, 1.0, self.wind * dt
+
+    def state(self, t):
+        tf = t - self.ground
+        alt, a, east = self._trajectory(tf)
+        flying = 0 <= tf < self.landing
+        yaw = math.radians(self.spin * min(max(tf, 0.0), self.landing))
+        h, v = self.field
+        acc = [0.0, 0.0, a]
+        gyr = [0.0, 0.0, self.spin if flying else 0.0]
+        mag = [h * math.cos(yaw), -h * math.sin(yaw), -v]
+        if self.noise:
+            gauss = self.rng.gauss
+            n = self.noise
+            acc = [x + gauss(0.0, n) for x in acc]
+            gyr = [x + gauss(0.0, n) for x in gyr]
+            mag = [x + gauss(0.0, n) for x in mag]
+        t0 = self.ground_temp + 273.15
+        press = self.ground_pressure * (1.0 - LAPSE_RATE * alt / t0) ** 5.257
+        lon = self.lon + east / (METER_PER_DEGREE * math.cos(math.radians(self.lat)))
+        return SimState(tuple(acc), tuple(gyr), tuple(mag), self.ground_temp - LAPSE_RATE * alt, press,
+                        self.humi, alt, self.lat, lon, 8 if tf < self.landing + 5.0 else 9)
+
+
+# 'yyyy-mm-dd hh:mm:ss[.ffffff]' -> datetime
+def _parse_time(s):
+    s = s.strip()
+    return datetime.datetime.strptime(s, '%Y-%m-%d %H:%M:%S.%f' if '.' in s else '%Y-%m-%d %H:%M:%S')
+
+
+# 先頭が時刻の行だけ読む(見出しやアンカーの行、時刻がNoneの行は飛ばす)
+def _read_rows(path):
+    rows = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            fields = line.split(',')
+            try:
+                t = _parse_time(fields[0])
+            except ValueError:
+                continue
+            rows.append((t, fields[1:]))
+    return rows
+
+
+# 記録したCSVを再生する
+# sensor_csv: cs17_wpi3_2sensors_logs_*.csv (wpi3_binlog.pyで変換したもの)
+# gga_csv: datagga_*.csv (なければ位置はFlightProfileの既定値のまま)
+# 2つのログの時計は揃っていない(ローカル時刻とUTC)ので、どちらも最初の行を0秒にする
+# 時刻の間は前の行の値を使い、最後まで行ったら最後の値のまま
+class ReplayProfile(object):
+    def __init__(self, sensor_csv, gga_csv=None):
+        rows = _read_rows(sensor_csv)
+        if not rows:
+            raise ValueError('no samples in %s' % sensor_csv)
+        t0 = rows[0][0]
+        self.times = [(t - t0).total_seconds() for t, _f in rows]
+        self.samples = []
+        for _t, f in rows:
+            v = [float(x) for x in f[:13]]
+            # T, H, P, 加速度, ジャイロ, 磁気, 高度
+            self.samples.append((v[0], v[1], v[2], tuple(v[3:6]), tuple(v[6:9]), tuple(v[9:12]), v[12]))
+        self.duration = self.times[-1]
+        self.start_utc = t0
+        self.gga_times = []
+        self.gga = []
+        if gga_csv is not None:
+            rows = _read_rows(gga_csv)
+            if rows:
+                t0 = rows[0][0]
+                self.start_utc = t0
+                for t, f in rows:
+                    self.gga_times.append((t - t0).total_seconds())
+                    # 衛星数, 高度, 緯度, 経度
+                    self.gga.append((int(f[0]), float(f[1]), float(f[2]), float(f[3])))
+                self.duration = max(self.duration, self.gga_times[-1])
+        self.default = FlightProfile()
+
+    def state(self, t):
+        i = max(0, bisect.bisect_right(self.times, t) - 1)
+        temp, humi, press, acc, gyr, mag, alt = self.samples[i]
+        if self.gga:
+            sats, _alt, lat, lon = self.gga[max(0, bisect.bisect_right(self.gga_times, t) - 1)]
+        else:
+            sats, lat, lon = 8, self.default.lat, self.default.lon
+        return SimState(acc, gyr, mag, temp, press, humi, alt, lat, lon, sats)
+
+
+def _int16(v):
+    v = int(round(v))
+    return 32767 if v > 32767 else -32768 if v < -32768 else v
+
+
+MPU_WHO_AM_I = 0x71
+MPU_FIFO_SIZE = 512
+SLV0_HISTORY = 64  # 覚えておくSLV0の読み出しの数(FIFOのフレームに使う)
+
+
+# MPU-9250のレジスタマップ
+# データレジスタ(0x3B~0x48)とFIFOはサンプリングレート(1000 / (1 + SMPLRT_DIV)、DLPF_CFGが0か7なら8000)で更新する
+# I2Cマスタが有効ならサンプルごとにAK8963(SLV0)をEXT_SENS_DATA(0x49~)へ読む
+# (I2C_MST_DELAY_CTRLのbit0が立っていれば1 + I2C_MST_DLYサンプルごと)
+# 実機と同じくホストが読んでいない間のサンプルでも読むので、ST1のDRDYは測定直後の1サンプルだけ立つ
+class MPU9250Sim(RegisterMap):
+    def __init__(self, sim, ak=None):
+        RegisterMap.__init__(self)
+        self.sim = sim
+        self.ak = ak
+        self.fifo = bytearray()
+        self.reset()
+
+    def reset(self):
+        self.regs[:] = bytes(256)
+        self.regs[0x00:0x03] = bytes([0x66, 0x67, 0x68])  # セルフテストの工場出荷値(適当な値)
+        self.regs[0x0D:0x10] = bytes([0x7A, 0x7B, 0x7C])
+        self.regs[0x6B] = 0x01
+        self.regs[0x75] = MPU_WHO_AM_I
+        del self.fifo[:]
+        self._restart()
+
+    # サンプリングレートが変わったらサンプルの番号を数え直す
+    def _restart(self):
+        dlpf = self.regs[0x1A] & 0x07
+        self.rate = 8000.0 if dlpf == 0 or dlpf == 7 else 1000.0 / (1 + self.regs[0x19])
+        self.t_base = time.monotonic()
+        self.index = -1
+        self.fifo_index = 0
+        self.slv0_index = -1
+        self.slv0_data = {}  # サンプルの番号 -> SLV0で読んだバイト列
+
+    def _now_index(self):
+        return int((time.monotonic() - self.t_base) * self.rate)
+
+    # i番目のサンプルの加速度・温度・ジャイロの生の値
+    def _raw(self, i):
+        s = self.sim.state_at(self.t_base - self.sim.t0 + i / self.rate)
+        ac = 32768.0 / (2 << ((self.regs[0x1C] >> 3) & 3))
+        gc = 32768.0 / (250 << ((self.regs[0x1B] >> 3) & 3))
+        return (_int16(s.acc[0] * ac), _int16(s.acc[1] * ac), _int16(s.acc[2] * ac),
+                _int16((s.temp - 21.0) * 333.87),
+                _int16(s.gyr[0] * gc), _int16(s.gyr[1] * gc), _int16(s.gyr[2] * gc))
+
+    # SLV0で読むバイト数(I2Cマスタが動いていなければ0)
+    def _slv0_length(self):
+        if self.ak is None or not self.regs[0x6A] & 0x20 or not self.regs[0x27] & 0x80:
+            return 0
+        return self.regs[0x27] & 0x0F
+
+    # SLV0で読む間隔[サンプル]
+    def _slv0_step(self):
+        if self.regs[0x67] & 0x01:
+            return 1 + (self.regs[0x34] & 0x1F)
+        return 1
+
+    # i番目のサンプルのときのEXT_SENS_DATA(i以前で最後にSLV0が読んだもの)
+    # まだ読んでいないサンプルの分は、そのサンプルの時刻でAK8963を順に読む
+    def _slv0(self, i, n):
+        step = self._slv0_step()
+        last = i - i % step
+        if last > self.slv0_index:
+            first = max(self.slv0_index + 1, last - SLV0_HISTORY * step)
+            first += -first % step
+            for k in range(first, last + 1, step):
+                self.slv0_data[k] = self.ak.read(self.regs[0x26], n, self.t_base + k / self.rate)
+            self.slv0_index = last
+            for k in [k for k in self.slv0_data if k < last - SLV0_HISTORY * step]:
+                del self.slv0_data[k]
+        read = [k for k in self.slv0_data if k <= last]
+        if not read:
+            return bytes(n)
+        return self.slv0_data[max(read)][:n]
+
+    def _sample(self):
+        i = self._now_index()
+        if i == self.index:
+            return
+        self.index = i
+        struct.pack_into('>7h', self.regs, 0x3B, *self._raw(i))
+        n = self._slv0_length()
+        if n:
+            self.regs[0x49:0x49 + n] = self._slv0(i, n)
+        self.regs[0x3A] |= 0x01  # RAW_DATA_RDY_INT
+
+    def _frame_size(self):
+        en = self.regs[0x23]
+        return ((6 if en & 0x08 else 0) + (2 if en & 0x80 else 0) +
+                2 * bin(en & 0x70).count('1') + (self._slv0_length() if en & 0x01 else 0))
+
+    # 前回からのサンプルをFIFOに入れる(溢れたら古い方から捨ててFIFO_OFLOW_INTを立てる)
+    def _fill(self):
+        i = self._now_index()
+        if not self.regs[0x6A] & 0x40 or not self.regs[0x23]:
+            self.fifo_index = i
+            return
+        size = self._frame_size()
+        first = self.fifo_index + 1
+        self.fifo_index = i
+        if first > i or size == 0:
+            return
+        keep = MPU_FIFO_SIZE // size + 1
+        if i - first + 1 > keep:
+            first = i - keep + 1
+            self.regs[0x3A] |= 0x10
+        en = self.regs[0x23]
+        n = self._slv0_length() if en & 0x01 else 0
+        for k in range(first, i + 1):
+            ax, ay, az, t, gx, gy, gz = self._raw(k)
+            frame = b''
+            if en & 0x08:
+                frame += struct.pack('>3h', ax, ay, az)
+            if en & 0x80:
+                frame += struct.pack('>h', t)
+            for bit, g in ((0x40, gx), (0x20, gy), (0x10, gz)):
+                if en & bit:
+                    frame += struct.pack('>h', g)
+            if n:
+                frame += self._slv0(k, n)
+            self.fifo += frame
+        if len(self.fifo) > MPU_FIFO_SIZE:
+            del self.fifo[:len(self.fifo) - MPU_FIFO_SIZE]
+            self.regs[0x3A] |= 0x10
+
+    def read(self, reg, length):
+        if reg == 0x74:  # FIFO_R_W (アドレスは進まない)
+            self._fill()
+            data = bytes(self.fifo[:length])
+            del self.fifo[:length]
+            return data + bytes(length - len(data))
+        end = reg + length
+        if reg <= 0x60 and end > 0x3A:
+            self._sample()
+        if (reg <= 0x3A < end) or (reg <= 0x73 and end > 0x72):
+            self._fill()
+            self.regs[0x72] = (len(self.fifo) >> 8) & 0x1F
+            self.regs[0x73] = len(self.fifo) & 0xFF
+        data = RegisterMap.read(self, reg, length)
+        # 読むと消えるステータス
+        if reg <= 0x3A < end:
+            self.regs[0x3A] = 0
+        if reg <= 0x36 < end:
+            self.regs[0x36] = 0
+        return data
+
+    def write(self, reg, data):
+        if reg == 0x6B and data & 0x80:  # H_RESET
+            self.reset()
+            return
+        if reg == 0x6A:  # USER_CTRL FIFO_RST, I2C_MST_RST, SIG_COND_RSTは書いたあと0に戻る
+            if data & 0x04:
+                del self.fifo[:]
+                self.fifo_index = self._now_index()
+            if data & 0x40 and not self.regs[0x6A] & 0x40:
+                self.fifo_index = self._now_index()
+            data &= ~0x07
+        if reg == 0x34 and data & 0x80 and self.ak is not None:  # I2C_SLV4の1回の読み書き
+            if self.regs[0x31] & 0x80:
+                self.regs[0x35] = self.ak.read(self.regs[0x32], 1)[0]
+            else:
+                self.ak.write(self.regs[0x32], self.regs[0x33])
+            self.regs[0x36] |= 0x40  # I2C_SLV4_DONE
+            data &= ~0x80
+        self.regs[reg] = data
+        if reg in (0x19, 0x1A):
+            self._restart()
+
+
+AK8963_WIA = 0x48
+AK8963_MODE_RATE = {0x02: 8.0, 0x06: 100.0}  # 連続測定モードの周期[Hz]
+AK8963_SINGLE_TIME = 0.0072  # 単発測定の時間[s]
+
+
+# AK8963のレジスタマップ
+# 連続測定モードでは周期ごとに新しい値にしてST1のDRDYを立てる
+# ST2(0x09)まで読むとDRDYが下がる 読まないうちに次の値が来たらDOR
+class AK8963Sim(RegisterMap):
+    def __init__(self, sim, asa=(0xB0, 0xB2, 0xA5)):
+        RegisterMap.__init__(self)
+        self.sim = sim
+        self.asa = asa
+        self.reset()
+
+    def reset(self):
+        self.regs[:] = bytes(256)
+        self.regs[0x00] = AK8963_WIA
+        self.regs[0x01] = 0x9A
+        self.regs[0x10:0x13] = bytes(self.asa)
+        self.t_mode = time.monotonic()
+        self.index = 0
+        self.single_due = None
+
+    # now: 測定の時刻(time.monotonic())
+    def _measure(self, now):
+        s = self.sim.state_at(now - self.sim.t0)
+        mx, my, mz = s.mag
+        cntl1 = self.regs[0x0A]
+        coefficient = 4912 / 32760.0 if cntl1 & 0x10 else 4912 / 8190.0
+        st2 = cntl1 & 0x10  # BITM
+        raw = []
+        # AK8963の軸はMPU-9250と違う (x, y, z) = (MPU y, MPU x, -MPU z)
+        for value, asa in zip((my, mx, -mz), self.asa):
+            if abs(value) > 4912:
+                st2 |= 0x08  # HOFL
+            raw.append(_int16(value / (coefficient * ((asa - 128) / 256.0 + 1.0))))
+        struct.pack_into('<3h', self.regs, 0x03, *raw)
+        self.regs[0x09] = st2
+        if self.regs[0x02] & 0x01:
+            self.regs[0x02] |= 0x02  # DOR
+        self.regs[0x02] |= 0x01  # DRDY
+
+    # now: 読み出す時刻(SLV0はサンプルの時刻で読むので、少し前のこともある)
+    def _update(self, now):
+        mode = self.regs[0x0A] & 0x0F
+        rate = AK8963_MODE_RATE.get(mode)
+        if rate is not None:
+            i = int((now - self.t_mode) * rate)
+            if i > self.index:
+                self.index = i
+                self._measure(now)
+        elif mode == 0x01 and self.single_due is not None and now >= self.single_due:
+            self.single_due = None
+            self._measure(now)
+            self.regs[0x0A] &= 0x10  # 測定が終わるとパワーダウンモード
+
+    # at: 読み出す時刻(Noneなら今)
+    def read(self, reg, length, at=None):
+        self._update(time.monotonic() if at is None else at)
+        data = RegisterMap.read(self, reg, length)
+        if reg <= 0x09 < reg + length:
+            self.regs[0x02] = 0
+        return data
+
+    def write(self, reg, data):
+        if reg == 0x0B and data & 0x01:  # CNTL2 SRST
+            self.reset()
+            return
+        self.regs[reg] = data
+        if reg == 0x0A:
+            self.t_mode = time.monotonic()
+            self.index = 0
+            if data & 0x0F == 0x01:
+                self.single_due = self.t_mode + AK8963_SINGLE_TIME
+
+
+# f(lo)~f(hi)が単調な整数の関数で、f(x)がtargetに一番近いx(二分法)
+def _invert(f, target, lo, hi):
+    rising = f(hi) > f(lo)
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if (f(mid) < target) == rising:
+            lo = mid
+        else:
+            hi = mid
+    return lo if abs(f(lo) - target) <= abs(f(hi) - target) else hi
+
+
+# 温度[℃], 気圧[hPa], 湿度[%]になる生データ(pres_raw, temp_raw, hum_raw)
+# wpi3_bme280_driverの補正の式を逆に解く
+def bme280_raw(c, temp, press, humi):
+    temp_raw = _invert(lambda x: compensate_T(c, x)[0], temp, 0, 0xFFFFF)
+    t_fine = compensate_T(c, temp_raw)[1]
+    pres_raw = _invert(lambda x: compensate_P(c, x, t_fine), press, 0, 0xFFFFF)
+    hum_raw = _invert(lambda x: compensate_H(c, x, t_fine), humi, 0, 0xFFFF)
+    return pres_raw, temp_raw, hum_raw
+
+
+BME280_RESET_DATA = bytes([0x80, 0x00, 0x00, 0x80, 0x00, 0x00, 0x80, 0x00])  # 変換前の0xF7~0xFE
+BME280_FIRST_CONVERSION = 0.013  # setup()から最初の変換が終わるまで[s] (osrs_t=1, osrs_p=4)
+
+
+# BME280のレジスタマップ
+# 測定値(0xF7~0xFE)はperiod秒ごとに更新する(ノーマルモードの測定周期)
+# 実機と同じく、ctrl_meas(0xF4)でモードを設定して最初の変換が終わるまではリセット値(0x80000)
+class BME280Sim(RegisterMap):
+    def __init__(self, sim, calib_regs=SAMPLE_CALIB_REGS, period=0.01):
+        RegisterMap.__init__(self)
+        self.sim = sim
+        calib_88, calib_a1, calib_e1 = calib_regs
+        self.regs[0x88:0xA0] = calib_88
+        self.regs[0xA1] = calib_a1[0]
+        self.regs[0xE1:0xE8] = calib_e1
+        self.regs[0xD0] = 0x60  # chip id
+        self.calib = decode_calib(*calib_regs)
+        self.period = period
+        self.index = -1
+        self.regs[0xF7:0xFF] = BME280_RESET_DATA
+        self.ready = None  # 最初の変換が終わる時刻
+
+    def _measure(self):
+        now = time.monotonic()
+        if self.ready is None or now < self.ready:
+            self.regs[0xF3] = 0x08 if self.ready is not None else 0x00  # measuring
+            return
+        self.regs[0xF3] = 0x00
+        i = int((now - self.sim.t0) / self.period)
+        if i == self.index:
+            return
+        self.index = i
+        s = self.sim.state()
+        pres_raw, temp_raw, hum_raw = bme280_raw(self.calib, s.temp, s.press, s.humi)
+        self.regs[0xF7:0xFF] = bytes([pres_raw >> 12, (pres_raw >> 4) & 0xFF, (pres_raw & 0x0F) << 4,
+                                      temp_raw >> 12, (temp_raw >> 4) & 0xFF, (temp_raw & 0x0F) << 4,
+                                      hum_raw >> 8, hum_raw & 0xFF])
+
+    def read(self, reg, length):
+        if reg < 0xFF and reg + length > 0xF3:
+            self._measure()
+        return RegisterMap.read(self, reg, length)
+
+    def write(self, reg, data):
+        RegisterMap.write(self, reg, data)
+        if reg == 0xF4:
+            if data & 0x03:
+                if self.ready is None:
+                    self.ready = time.monotonic() + BME280_FIRST_CONVERSION
+            else:
+                self.ready = None  # スリープモード
+
+
+# シミュレータの時刻と位置をNMEAで流す受信機
+class SimReceiver(FakeReceiver):
+    def __init__(self, sim, rate=1):
+        FakeReceiver.__init__(self, rate)
+        self.sim = sim
+
+    def fix(self):
+        s = self.sim.state()
+        return self.sim.utc(), s.lat, s.lon, s.alt, s.sats
+
+
+class Simulator(object):
+    # profile: FlightProfileかReplayProfile, speed: 時間を進める倍率
+    # latency, byte_time: I2Cの1回あたり、1バイトあたりの時間[s] (wpi3_i2c.SimI2C)
+    # loop: Trueならプロファイルの最後まで行ったら最初に戻る
+    def __init__(self, profile, speed=1.0, latency=0.0, byte_time=0.0, loop=False):
+        self.profile = profile
+        self.speed = speed
+        self.loop = loop
+        self.t0 = time.monotonic()
+        self.start_utc = profile.start_utc or datetime.datetime.fromtimestamp(
+            time.time(), datetime.timezone.utc).replace(tzinfo=None)
+        self.i2c = SimI2C(latency, byte_time)
+        self.ak = AK8963Sim(self)
+        self.mpu = MPU9250Sim(self, self.ak)
+        self.bme = BME280Sim(self)
+        self.i2c.attach(0x68, self.mpu)
+        self.i2c.attach(0x0C, self.ak)
+        self.i2c.attach(0x76, self.bme)
+        self.gps = None
+
+    # プロファイルの時刻[s] (elapsed: 開始からの実時間[s] Noneなら今)
+    def time(self, elapsed=None):
+        if elapsed is None:
+            elapsed = time.monotonic() - self.t0
+        t = elapsed * self.speed
+        if self.loop and self.profile.duration > 0:
+            t %= self.profile.duration
+        return t
+
+    def state(self):
+        return self.profile.state(self.time())
+
+    def state_at(self, elapsed):
+        return self.profile.state(self.time(elapsed))
+
+    def utc(self):
+        return self.start_utc + datetime.timedelta(seconds=self.time())
+
+    # プロファイルを最後まで再生したか
+    def finished(self):
+        return not self.loop and self.time() >= self.profile.duration
+
+    # shared_bus()をシミュレータのバスにする
+    def install(self):
+        return set_shared_backend(self.i2c)
+
+    # 疑似端末のGPSを動かしてポート名を返す
+    def start_gps(self, rate=1):
+        self.gps = SimReceiver(self, rate)
+        self.gps.start()
+        return self.gps.port
+
+    def close(self):
+        if self.gps is not None:
+            self.gps.stop()
+            self.gps = None
+
+
+if __name__ == '__main__':
+    from wpi3_altitude import Altimeter
+    from wpi3_bme280_driver import BME280
+    from wpi3_gps_receiver import GPSReceiver
+    from wpi3_magcal import readASA
+    from wpi3_mpu9250_i2cmst import MPU9250I2CMaster
+    from wpi3_nmea import GGA
+
+    speed = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    if len(sys.argv) > 3 and sys.argv[1] == 'replay':
+        profile = ReplayProfile(sys.argv[3], sys.argv[4] if len(sys.argv) > 4 else None)
+    else:
+        profile = FlightProfile()
+    sim = Simulator(profile, speed)
+    i2c = sim.install()
+    mpu9250 = i2c.setup(0x68)
+    i2c.writeReg8(mpu9250, 0x6B, 0x00)  # PWR_MGMT_1をクリア
+    i2c.writeReg8(mpu9250, 0x1B, 0x10)  # 1000dps
+    i2c.writeReg8(mpu9250, 0x1C, 0x10)  # 8g
+    i2c.writeReg8(mpu9250, 0x1A, 0x01)  # DLPF 184Hz (サンプリングレート1kHz)
+    i2c.writeReg8(mpu9250, 0x37, 0x02)  # BYPASS_EN=1 (ASAを読むため)
+    asa = readASA(i2c, i2c.setup(0x0C))
+    mst = MPU9250I2CMaster(i2c, mpu9250, asa=asa)
+    mst.enable()
+    bme = BME280(i2c, i2c.setup(0x76))
+    bme.setup()
+    bme.waitReady()
+    altimeter = Altimeter(bme.read()[1])
+    gps = GPSReceiver(sim.start_gps())
+    fix = None
+    mag = (0.0, 0.0, 0.0)
+    try:
+        while not sim.finished():
+            for msg in gps.read(0):
+                if isinstance(msg, GGA):
+                    fix = msg
+            acc, temp_mpu, gyr, m = mst.read()
+            if m is not None:
+                mag = m
+            temp, press, humi = bme.read()
+            print("%7.2f,%6.2f,%7.2f,%8.2f,%6.3f,%6.3f,%6.3f,%7.2f,%6.1f,%6.1f,%6.1f,%s" % (
+                sim.time(), temp, press, altimeter.altitude(press, temp), acc[0], acc[1], acc[2], gyr[2],
+                mag[0], mag[1], mag[2], '%.6f,%.6f' % (fix.lat, fix.lon) if fix else '-,-'))
+            time.sleep(0.1)
+    except KeyboardInterrupt:
+        pass
+    gps.close()
+    sim.close()
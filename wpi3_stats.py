@@ -0,0 +1,193 @@
+#!/usr/bin/python3 -u
+# -*- coding: utf-8 -*-
+
+############################################################
+# Written by pond-e
+#
+# Environment:  Python 3.4.2
+#               OS: Raspi OS
+#               on Raspberry Pi Zero W
+#
+# 計測ループの中に入れておく軽い計測
+# ・段階(bme, imu, mag, log)ごとの時間をperf_counter_nsで測り、
+#   固定の区切り(BOUNDS_US)のヒストグラムに数える(メモリは段階ごとに16個の整数だけ)
+# ・間に合わなかった回数(overruns)、I2Cのエラー(i2c_errors)、
+#   磁気センサのデータ待ち(mag_not_ready)、ログのバッファ溢れ(dropped)を数える
+# ・interval秒ごとに統計のレコード(wpi3_binlog.STATS_RECORD)をログに入れるので、
+#   ログの抜けがバス、SDカード、printのどれのせいか後から分かる
+# ・enabledで実行中に切り替えられる(SIGUSR1で反転)
+#   無効のときのループ側の負担は1回の属性の読み出しと数回のif文だけ
+#   (benchmark()で測る。回数の少ないエラーの数は無効のときも数える)
+#
+# ループでの使い方
+#    st = stats if stats.enabled else None
+#    if st:
+#        st.begin()
+#    bme.read()
+#    if st:
+#        st.lap('bme')
+#    ...
+#    if st:
+#        st.end()
+#
+# 無効のときと有効のときの1ループあたりの負担の計測
+# pi@raspberrypi ~ $ python3 wpi3_stats.py
+############################################################
+
+import bisect
+
+from wpi3_clock import perf_counter_ns
+
+STAGES = ('bme', 'imu', 'mag', 'log', 'loop')  # loopはループ全体(待ち時間を除く)
+COUNTERS = ('samples', 'overruns', 'i2c_errors', 'mag_not_ready', 'dropped')
+# ヒストグラムの区切り[us] 最後の区切りより長いものは最後の箱に入れる
+BOUNDS_US = (20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000, 200000, 500000, 1000000)
+
+
+# 固定の区切りのヒストグラム
+class Histogram(object):
+    def __init__(self, bounds_us=BOUNDS_US):
+        self.bounds_us = bounds_us
+        self.bounds = [b * 1000 for b in bounds_us]  # [ns]
+        self.counts = [0] * (len(bounds_us) + 1)
+        self.count = 0
+        self.total = 0  # [ns]
+        self.max = 0  # [ns]
+
+    def add(self, ns):
+        self.counts[bisect.bisect_left(self.bounds, ns)] += 1
+        self.count += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+
+    # q(0~1)の値が入っている箱の上の区切り[us] (最大値を超える場合と最後の箱は最大値)
+    def percentile(self, q):
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank and c:
+                if i < len(self.bounds_us):
+                    return min(float(self.bounds_us[i]), self.max / 1e3)
+                break
+        return self.max / 1e3
+
+    def to_dict(self):
+        return {'count': self.count, 'mean_us': self.total / 1e3 / self.count if self.count else 0.0,
+                'p50_us': self.percentile(0.5), 'p99_us': self.percentile(0.99), 'max_us': self.max / 1e3,
+                'counts': list(self.counts)}
+
+
+class Stats(object):
+    # enabled: 最初から計測するか, interval: 統計のレコードを作る間隔[s]
+    def __init__(self, enabled=True, interval=1.0):
+        self.enabled = enabled
+        self.interval_ns = int(interval * 1e9)
+        self.hist = dict((name, Histogram()) for name in STAGES)
+        self.totals = dict((name, 0) for name in COUNTERS)  # 起動してからの回数
+        self.counts = dict((name, 0) for name in COUNTERS)  # 今の区間の回数
+        self.peak = dict((name, 0) for name in STAGES)  # 今の区間の最大値[ns]
+        self.next_ns = 0
+        self.last_dropped = 0
+        self.records = 0  # 作った統計のレコードの数
+        self._start = 0
+        self._last = 0
+
+    # 計測の有効・無効を反転する(signal.signal(SIGUSR1, stats.toggle)に使える)
+    def toggle(self, *_args):
+        self.enabled = not self.enabled
+        self.next_ns = 0
+
+    def count(self, name, n=1):
+        self.counts[name] += n
+        self.totals[name] += n
+
+    def add(self, stage, ns):
+        self.hist[stage].add(ns)
+        if ns > self.peak[stage]:
+            self.peak[stage] = ns
+
+    # ループの始め
+    def begin(self):
+        self._start = self._last = perf_counter_ns()
+
+    # 前のlap()(またはbegin())からの時間をstageに数える
+    def lap(self, stage):
+        now = perf_counter_ns()
+        self.add(stage, now - self._last)
+        self._last = now
+
+    # ループの終わり(待つ前)
+    def end(self):
+        self.add('loop', perf_counter_ns() - self._start)
+        self.counts['samples'] += 1
+        self.totals['samples'] += 1
+
+    # 統計のレコードを作る時刻か now: monotonic_ns
+    def due(self, now):
+        return now >= self.next_ns
+
+    # 今の区間の統計をwpi3_binlog.STATS_RECORDの値(時刻を除く)にして区間をリセットする
+    # dropped: ロガーのバッファ溢れの累計
+    def record(self, now, dropped=0):
+        self.count('dropped', dropped - self.last_dropped)
+        self.last_dropped = dropped
+        values = tuple(min(self.counts[name], 0xFFFF) for name in COUNTERS)
+        values += tuple(self.peak[name] / 1e6 for name in STAGES)  # [ms]
+        for name in COUNTERS:
+            self.counts[name] = 0
+        for name in STAGES:
+            self.peak[name] = 0
+        self.next_ns = now + self.interval_ns
+        self.records += 1
+        return values
+
+    # 起動してからのまとめ
+    def summary(self):
+        d = dict(self.totals)
+        d['stages'] = dict((name, self.hist[name].to_dict()) for name in STAGES)
+        d['bounds_us'] = list(BOUNDS_US)
+        return d
+
+
+# 1ループあたりの計測の負担[ns]を測る
+# 中身のないループ(計測なし)、無効のとき、有効のときを比べる
+def benchmark(count=1000000):
+    stats = Stats(enabled=False)
+    result = {}
+
+    start = perf_counter_ns()
+    for _i in range(count):
+        pass
+    base = perf_counter_ns() - start
+
+    for name, enabled in (('disabled', False), ('enabled', True)):
+        stats.enabled = enabled
+        start = perf_counter_ns()
+        for _i in range(count):
+            st = stats if stats.enabled else None
+            if st:
+                st.begin()
+            if st:
+                st.lap('bme')
+            if st:
+                st.lap('imu')
+            if st:
+                st.lap('mag')
+            if st:
+                st.lap('log')
+            if st:
+                st.end()
+            if st and st.due(0):
+                st.record(0)
+        result[name] = (perf_counter_ns() - start - base) / float(count)
+    return result
+
+
+if __name__ == '__main__':
+    result = benchmark()
+    print("disabled: %7.1f ns/loop" % result['disabled'])
+    print("enabled:  %7.1f ns/loop" % result['enabled'])